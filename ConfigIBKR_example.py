@@ -35,8 +35,26 @@ IBKR = ibkr.IBKRImporter(
     FeesSuffix='Fees',          # suffix for fees & commisions
     currency = 'CHF',           # main currency
     depositAccount = '',        # put in your checkings account if you want deposit transactions
-    suppressClosedLotPrice=False # Sometimes reports IB an inaccurate lot price.
+    suppressClosedLotPrice=False, # Sometimes reports IB an inaccurate lot price.
                                  # In this case it is better to suppress it and let beancount to match lot
+    collapseTradeSplits=False,   # merge the partial executions IB splits an order into,
+                                 # one transaction per order instead of one per execution
+    priceEntries=False,          # Price entries from the mark prices of open positions and the
+                                 # conversion rates of the statement, instead of fetching them with bean-price.
+                                 # needs OpenPositions and ConversionRates in the flex query
+    accountMap=None,             # for flex queries over several IB accounts: IB account id -> main account,
+                                 # or a dict of settings, e.g. {'U1234567': 'Assets:Invest:IB',
+                                 # 'U7654321': {'Mainaccount': 'Assets:Invest:IBKid', 'WHTAccount': 'Expenses:Kid:WTax'}}
+                                 # all statements of the query are booked from one download.
+    maxWorkers=None,             # threads downloading the chunks of a long period
+    downloadOptions=None,        # settings of the flex query download, e.g. {'state_path': 'ibkr_state.json',
+                                 # 'max_tries': 20, 'initial_delay': 5}, see importer/flexquery.py
+    archive=None,                # flexarchive.StatementArchive('ibkr_archive'): keeps every downloaded statement,
+                                 # deduplicated. the entries are built from the archive, for the fromDate/toDate
+                                 # in the credentials file, so several years of statements can be booked at once
+    archiveOnly=False,           # build from the archive only, without asking IB
+    ledgerLots=False,            # with an existing ledger (bean-extract -f), sell the lots at the cost the
+                                 # ledger holds them at, and take lots missing in the statement from the oldest ones
     fpath = 'testIB/ibfq.pk'    # use a pickle dump instead of the API, as it has
                                 # considerable loading times. Set to None for real
                                 # API Flex Query fetching. used mainly for development.
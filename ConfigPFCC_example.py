@@ -19,7 +19,8 @@ def automatic_fixes(d):
     This function allows the user to specify multiple automatic manipulations of the 
     ingested bank statement data. Its return will be the input for the
     data.Transaction() object to be created from that line of the statement
-    d: dict() with keys of a future statement, i.e. 'narration', 'payee',...
+    d: drnukebean.importer.util.RawTxn with the fields of a future statement,
+       i.e. d['narration'] or d.narration, d['payee'],...
 
     If you don't want any modifications, simply return d.
 
@@ -67,7 +68,7 @@ smart=False # make false to remove smart -importer
 
 PFCC_ = PFCC.PFCCImporter(
     '6393', # last 4 digits of CC number
-    'Assets:Liq:PF:Kreditkarte',
+    'Assets:Liq:PF:Kreditkarte', # or {'CHF': 'Assets:Liq:PF:Kreditkarte', 'EUR': ...} for several currencies
     currency='CHF',
     file_encoding='ISO-8859-1',
     manual_fixes = automatic_fixes,
@@ -21,7 +21,8 @@ def automatic_fixes(d):
     This function allows the user to specify multiple automatic manipulations of the 
     ingested bank statement data. Its return will be the input for the
     data.Transaction() object to be created from that line of the statement
-    d: dict() with keys of a future statement, i.e. 'narration', 'payee',...
+    d: drnukebean.importer.util.RawTxn with the fields of a future statement,
+       i.e. d['narration'] or d.narration, d['payee'],...
 
     If you don't want any modifications, simply return d.
 
@@ -139,7 +140,8 @@ def add_gas_purchase(d,account,amount):
 
 PFEC_ = PFGImporter(
     iban = 'CH94 0123 4567 8910 1112 0',
-    account = 'Assets:Bank:Checking',
+    account = 'Assets:Bank:Checking',   # or one account per statement currency, e.g.
+                                        # {'CHF': 'Assets:Bank:Checking', 'EUR': 'Assets:Bank:CheckingEUR'}
     currency = 'CHF',
     file_encoding = 'ISO-8859-1',
     manual_fixes = automatic_fixes,
@@ -0,0 +1,196 @@
+"""
+A local stand-in for the IBKR flex web service, to benchmark and try out the
+download of IBKRImporter without an IB account.
+
+It serves SendRequest and GetStatement like IB does: every request gets a
+reference code, the first `pending` polls of a reference code answer
+"Statement generation in progress", and the statement is the given flex xml,
+reduced to the rows within the fd/td dates of the request.
+
+  python benchmarks/fake_flex.py --size 10000 --pending 2 --chunk-days 365
+
+downloads the synthetic statement of generators.ibkr_flex_xml through
+FlexDownloader and reports the time per phase. In code:
+
+  with FakeFlexServer(generators.ibkr_flex_xml(1000)) as server:
+      FlexDownloader('0000', '0000', request_url=server.request_url).download()
+"""
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import argparse
+import itertools
+import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from ibflex import parser
+
+import generators
+from drnukebean.importer.flexquery import FlexDownloader, merge_responses
+
+# the attribute holding the date of a row, in order of preference
+DATE_ATTRIBUTES = ('tradeDate', 'reportDate', 'dateTime', 'toDate')
+
+
+def _timestamp():
+    return datetime.now().strftime('%d %B, %Y %I:%M %p EDT')
+
+
+def _statement_response(status, **elements):
+    return ''.join([f'<FlexStatementResponse timestamp="{_timestamp()}">',
+                    f'<Status>{status}</Status>',
+                    *(f'<{tag}>{text}</{tag}>' for tag, text in elements.items()),
+                    '</FlexStatementResponse>']).encode()
+
+
+def _error(code, message):
+    return _statement_response('Fail', ErrorCode=code, ErrorMessage=message)
+
+
+def select_period(xml, from_date, to_date):
+    """
+    the flex xml with only the rows dated from_date to to_date ('YYYYMMDD'),
+    as IB answers a SendRequest with fd and td
+    """
+    root = ET.fromstring(xml)
+    for statement in root.iter('FlexStatement'):
+        statement.set('fromDate', from_date)
+        statement.set('toDate', to_date)
+        for section in statement:
+            for row in list(section):
+                day = next((row.get(key) for key in DATE_ATTRIBUTES if row.get(key)), None)
+                if day and not from_date <= day[:8] <= to_date:
+                    section.remove(row)
+    return ET.tostring(root)
+
+
+class FakeFlexServer:
+    """
+    the fake flex web service on a free local port, running in a background
+    thread while used as context manager. counts the requests in .requests
+    """
+
+    def __init__(self, xml, token='0000', pending=1, port=0):
+        self.xml = xml
+        self.token = token
+        self.pending = pending
+        self.requests = {'SendRequest': 0, 'GetStatement': 0}
+        self._statements = {}  # reference code -> [polls left, xml]
+        self._codes = itertools.count(1000000001)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_url(self):
+        return f"{self.url}/SendRequest"
+
+    def send_request(self, params):
+        if params.get('t') != self.token:
+            return _error('1015', 'Token is invalid.')
+        fd, td = params.get('fd'), params.get('td')
+        xml = select_period(self.xml, fd, td) if fd and td else self.xml
+        with self._lock:
+            code = str(next(self._codes))
+            self._statements[code] = [self.pending, xml]
+        return _statement_response('Success', ReferenceCode=code,
+                                   Url=f"{self.url}/GetStatement")
+
+    def get_statement(self, params):
+        if params.get('t') != self.token:
+            return _error('1015', 'Token is invalid.')
+        with self._lock:
+            statement = self._statements.get(params.get('q'))
+            if statement is None:
+                return _error('1017', 'Reference code is invalid.')
+            if statement[0] > 0:
+                statement[0] -= 1
+                return _error('1019', 'Statement generation in progress. Please try again shortly.')
+            del self._statements[params['q']]
+        xml = statement[1]
+        return xml.encode() if isinstance(xml, str) else xml
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                endpoint = url.path.rsplit('/', 1)[-1]
+                if endpoint not in server.requests:
+                    self.send_error(404)
+                    return
+                with server._lock:
+                    server.requests[endpoint] += 1
+                body = (server.send_request if endpoint == 'SendRequest'
+                        else server.get_statement)(params)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    argparser.add_argument('--size', type=int, default=10000, help='rows of the statement')
+    argparser.add_argument('--pending', type=int, default=1,
+                           help='polls answered with "in progress" per reference code')
+    argparser.add_argument('--chunk-days', type=int, default=None,
+                           help='split the period of the statement into chunks of that many days')
+    argparser.add_argument('--delay', type=float, default=0.05, help='initial backoff in seconds')
+    argparser.add_argument('--workers', type=int, default=None)
+    args = argparser.parse_args()
+
+    xml = generators.ibkr_flex_xml(args.size)
+    root = ET.fromstring(xml).find('.//FlexStatement')
+    from_date, to_date = (datetime.strptime(root.get(key), '%Y%m%d').date()
+                          for key in ('fromDate', 'toDate'))
+    with FakeFlexServer(xml, pending=args.pending) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        downloader = FlexDownloader('0000', '0000', request_url=server.request_url,
+                                    state_path=os.path.join(directory, 'flexstate.json'),
+                                    initial_delay=args.delay, max_workers=args.workers)
+        start = time.perf_counter()
+        if args.chunk_days:
+            responses = downloader.download(from_date, to_date, args.chunk_days)
+        else:
+            responses = downloader.download()
+        download_time = time.perf_counter() - start
+        statement = merge_responses([parser.parse(response) for response in responses])
+        parse_time = time.perf_counter() - start - download_time
+
+    statement = statement.FlexStatements[0]
+    print(f"{len(responses)} response(s), {sum(map(len, responses)) / 1e6:.2f} MB, "
+          f"{len(statement.Trades)} trades, {len(statement.CashTransactions)} cash transactions")
+    print(f"download {download_time:.3f} s, parse and merge {parse_time:.3f} s, "
+          f"requests {server.requests}")
+
+
+if __name__ == '__main__':
+    main()
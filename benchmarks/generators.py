@@ -0,0 +1,352 @@
+"""
+Generators for synthetic, reproducible input files of the drnukebean importers
+and plugins. All generators take the number of rows and a seed, and write the
+file(s) into a given directory, returning the path(s).
+
+  ibkr_statement       FlexQuery statement (trades, closed lots, dividends + WHT,
+                       forex, deposits, interest, fees, cash report), as the
+                       pickle IBKRImporter loads via fpath, plus a credentials file
+  ibkr_flex_xml        the same statement as the xml of the flex web service
+  pfg_statement        PostFinance giro account csv, 'DE'/'EN', optionally in the
+                       new format with ="" quoted header values
+  pfcc_statement       PostFinance credit card csv, 'DE'/'EN'
+  finpension_statement FinPension transaction report csv
+  ledger               beancount ledger with spreading, recurring, budgeting and
+                       partner transactions
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import quoteattr
+
+import os
+import pickle
+import random
+
+from ibflex import parser
+
+
+IBAN = 'CH9300762011623852957'
+CCNUMBER = '5555 4444 3333 1234'
+IB_ACCOUNT = 'U1234567'
+SYMBOLS = [f"S{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(50)]
+ISINS = {symbol: f"US{i:09d}{i % 10}" for i, symbol in enumerate(SYMBOLS)}
+FUNDS = {'CH0017844686': 'CSIFEM',
+         'CH0429081620': 'CSIFWEXCH',
+         'CH0214967314': 'CSIFWEXCHSC'}
+START = date(2015, 1, 1)
+
+
+def _money(rng, low, high):
+    return Decimal(rng.randint(int(low * 100), int(high * 100))) / 100
+
+
+def _day(i, n):
+    # spread n rows over the years after START, non-decreasing in i
+    return START + timedelta(days=i * 3000 // max(n, 1))
+
+
+def _xml_row(tag, **attrs):
+    return '<{} {}/>'.format(tag, ' '.join(f"{key}={quoteattr(str(val))}"
+                                           for key, val in attrs.items()))
+
+
+def ibkr_statement(directory, n_rows, seed=0):
+    """
+    returns (credentials yaml path, statement pickle path) of ibkr_flex_xml
+    """
+    statement = parser.parse(ibkr_flex_xml(n_rows, seed).encode())
+
+    statement_path = os.path.join(directory, f"ibkr_{n_rows}.pkl")
+    with open(statement_path, 'wb') as f:
+        pickle.dump(statement, f)
+    creds_path = os.path.join(directory, 'ibkr.yaml')
+    with open(creds_path, 'w') as f:
+        f.write("token: '0000'\nqueryId: '0000'\n")
+    return creds_path, statement_path
+
+
+def ibkr_flex_xml(n_rows, seed=0):
+    """
+    the FlexQueryResponse xml, as the flex web service sends it. roughly 40% of
+    the rows are trades (buys, sells with their closed lots, forex), 40%
+    dividends with withholding tax, and the rest deposits, interest and fees
+    """
+    rng = random.Random(seed)
+    trades = []
+    cash = []
+    n_groups = max(n_rows // 10, 1)
+    for i in range(n_groups):
+        day = _day(i, n_groups)
+        ymd = day.strftime('%Y%m%d')
+        symbol = SYMBOLS[i % len(SYMBOLS)]
+        price = _money(rng, 20, 300)
+        quantity = rng.randint(1, 50)
+        # a buy, and a sale closing two lots
+        trades.append(_xml_row(
+            'Trade', accountId=IB_ACCOUNT, currency='USD', symbol=symbol,
+            description=f"{symbol} ETF", tradeID=f"{i}1", transactionID=f"{i}1",
+            tradeDate=ymd, dateTime=f"{ymd};100000", quantity=quantity,
+            tradePrice=price, proceeds=-price * quantity, ibCommission='-1.00',
+            ibCommissionCurrency='USD', buySell='BUY', levelOfDetail='EXECUTION',
+            assetCategory='STK', ibOrderID=f"{i}1"))
+        lot1, lot2 = rng.randint(1, 20), rng.randint(1, 20)
+        sell_price = _money(rng, 20, 300)
+        trades.append(_xml_row(
+            'Trade', accountId=IB_ACCOUNT, currency='USD', symbol=symbol,
+            description=f"{symbol} ETF", tradeID=f"{i}2", transactionID=f"{i}2",
+            tradeDate=ymd, dateTime=f"{ymd};110000", quantity=-(lot1 + lot2),
+            tradePrice=sell_price, proceeds=sell_price * (lot1 + lot2),
+            ibCommission='-1.00', ibCommissionCurrency='USD', buySell='SELL',
+            levelOfDetail='EXECUTION', assetCategory='STK', ibOrderID=f"{i}2"))
+        open_day = (day - timedelta(days=400)).strftime('%Y%m%d')
+        for lot in (lot1, lot2):
+            trades.append(_xml_row(
+                'Lot', accountId=IB_ACCOUNT, currency='USD', symbol=symbol,
+                description=f"{symbol} ETF", tradeDate=ymd, quantity=lot,
+                tradePrice=_money(rng, 20, 300), buySell='SELL',
+                openDateTime=f"{open_day};093000", levelOfDetail='CLOSED_LOT',
+                assetCategory='STK'))
+        # forex
+        fx_quantity = _money(rng, 100, 10000)
+        fx_rate = _money(rng, 0.85, 1.05)
+        trades.append(_xml_row(
+            'Trade', accountId=IB_ACCOUNT, currency='CHF', symbol='USD.CHF',
+            description='USD.CHF', tradeID=f"{i}3", transactionID=f"{i}3",
+            tradeDate=ymd, dateTime=f"{ymd};120000", quantity=fx_quantity,
+            tradePrice=fx_rate, proceeds=-(fx_quantity * fx_rate).quantize(Decimal('0.01')),
+            ibCommission='-2.00', ibCommissionCurrency='CHF', buySell='BUY',
+            levelOfDetail='EXECUTION', assetCategory='CASH', ibOrderID=f"{i}3"))
+        # dividends and their withholding tax, two each
+        for k in range(2):
+            div_symbol = SYMBOLS[(2 * i + k) % len(SYMBOLS)]
+            div_day = (START + timedelta(days=(2 * i + k) // len(SYMBOLS))).strftime('%Y%m%d')
+            per_share = _money(rng, 0.1, 2)
+            amount = _money(rng, 5, 500)
+            text = f"{div_symbol}({ISINS[div_symbol]}) Cash Dividend USD {per_share} per Share (Ordinary Dividend)"
+            cash.append(_xml_row(
+                'CashTransaction', accountId=IB_ACCOUNT, currency='USD',
+                symbol=div_symbol, description=text, amount=amount,
+                type='Dividends', reportDate=div_day, dateTime=div_day,
+                transactionID=f"{i}4{k}"))
+            cash.append(_xml_row(
+                'CashTransaction', accountId=IB_ACCOUNT, currency='USD',
+                symbol=div_symbol, description=text.replace('(Ordinary Dividend)', '- US Tax'),
+                amount=-(amount * Decimal('0.15')).quantize(Decimal('0.01')),
+                type='Withholding Tax', reportDate=div_day, dateTime=div_day,
+                transactionID=f"{i}5{k}"))
+        # deposit, interest and fee
+        cash.append(_xml_row(
+            'CashTransaction', accountId=IB_ACCOUNT, currency='CHF',
+            description='CASH RECEIPTS / ELECTRONIC FUND TRANSFERS',
+            amount=_money(rng, 100, 5000), type='Deposits & Withdrawals',
+            reportDate=ymd, dateTime=ymd, transactionID=f"{i}6"))
+        cash.append(_xml_row(
+            'CashTransaction', accountId=IB_ACCOUNT, currency='USD',
+            description=f"USD CREDIT INT FOR {day.strftime('%b-%Y').upper()}",
+            amount=_money(rng, 0.01, 20), type='Broker Interest Received',
+            reportDate=ymd, dateTime=ymd, transactionID=f"{i}7"))
+        cash.append(_xml_row(
+            'CashTransaction', accountId=IB_ACCOUNT, currency='USD',
+            description=f"BALANCE OF MONTHLY MINIMUM FEE FOR {day.strftime('%b %Y').upper()}",
+            amount=-_money(rng, 1, 10), type='Other Fees',
+            reportDate=ymd, dateTime=ymd, transactionID=f"{i}8"))
+
+    from_date = START.strftime('%Y%m%d')
+    to_date = _day(n_groups, n_groups).strftime('%Y%m%d')
+    cash_report = [_xml_row('CashReportCurrency', accountId=IB_ACCOUNT,
+                            currency=currency, fromDate=from_date,
+                            toDate=to_date, endingCash=_money(rng, 0, 100000),
+                            levelOfDetail='Currency')
+                   for currency in ('BASE_SUMMARY', 'CHF', 'USD')]
+    # mark prices of the holdings at the end, daily conversion rates
+    positions = [_xml_row('OpenPosition', accountId=IB_ACCOUNT, currency='USD',
+                          symbol=symbol, assetCategory='STK', reportDate=to_date,
+                          position=rng.randint(1, 500), markPrice=_money(rng, 20, 300),
+                          levelOfDetail='SUMMARY')
+                 for symbol in SYMBOLS]
+    rates = []
+    for i in range(n_groups):
+        ymd = _day(i, n_groups).strftime('%Y%m%d')
+        rates.append(_xml_row('ConversionRate', reportDate=ymd, fromCurrency='USD',
+                              toCurrency='CHF', rate=_money(rng, 0.85, 1.05)))
+        rates.append(_xml_row('ConversionRate', reportDate=ymd, fromCurrency='CHF',
+                              toCurrency='CHF', rate=1))
+    return ''.join([
+        '<FlexQueryResponse queryName="benchmark" type="AF">',
+        '<FlexStatements count="1">',
+        f'<FlexStatement accountId="{IB_ACCOUNT}" fromDate="{from_date}" '
+        f'toDate="{to_date}" period="LastYear" whenGenerated="{to_date};120000">',
+        '<CashReport>', *cash_report, '</CashReport>',
+        '<Trades>', *trades, '</Trades>',
+        '<CashTransactions>', *cash, '</CashTransactions>',
+        '<OpenPositions>', *positions, '</OpenPositions>',
+        '<ConversionRates>', *rates, '</ConversionRates>',
+        '</FlexStatement></FlexStatements></FlexQueryResponse>'])
+
+
+def pfg_statement(directory, n_rows, seed=0, language='DE', new_format=False):
+    rng = random.Random(seed)
+    labels = {'DE': ['Datum von:', 'Datum bis:', 'Buchungsart:', 'Konto:', 'Währung:',
+                     'Buchungsdatum', 'Avisierungstext', 'Gutschrift in CHF',
+                     'Lastschrift in CHF', 'Valuta', 'Saldo in CHF'],
+              'EN': ['Date from:', 'Date to:', 'Entry type:', 'Account:', 'Currency:',
+                     'Booking date', 'Notification text', 'Credit in CHF',
+                     'Debit in CHF', 'Value', 'Balance in CHF']}[language]
+
+    def header_value(value):
+        return f'="{value}"' if new_format else value
+
+    last = _day(n_rows, n_rows)
+    lines = [f"{labels[0]};{header_value(START.strftime('%d.%m.%Y'))}",
+             f"{labels[1]};{header_value(last.strftime('%d.%m.%Y'))}",
+             f"{labels[2]};{header_value('Alle Buchungen')}",
+             f"{labels[3]};{IBAN}",
+             f"{labels[4]};{header_value('CHF')}",
+             '',
+             ';'.join(labels[5:])]
+    balance = Decimal('10000.00')
+    # the latest transaction comes first
+    for i in reversed(range(n_rows)):
+        day = _day(i, n_rows).strftime('%d.%m.%Y')
+        amount = _money(rng, 1, 3000)
+        credit, debit = (amount, '') if rng.random() < 0.3 else ('', -amount)
+        text = f"KAUF/DIENSTLEISTUNG VOM {day} KARTEN NR. XXXX1234 SHOP  {i % 997}"
+        row = [day, text, str(credit), str(debit), day]
+        if new_format:
+            # the new format has label and category columns, and the balance last
+            row += ['', '', str(balance) if i == n_rows - 1 else '']
+        else:
+            row.append(str(balance) if i == n_rows - 1 else '')
+        lines.append(';'.join(row))
+    lines += ['', 'Disclaimer:', 'Dies ist kein durch PostFinance AG erstelltes Dokument.']
+
+    suffix = '_new' if new_format else ''
+    path = os.path.join(directory, f"pfg_{language}{suffix}_{n_rows}.csv")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def pfcc_statement(directory, n_rows, seed=0, language='DE'):
+    rng = random.Random(seed)
+    if language == 'DE':
+        header = ['Kartenkonto:;0000 1234 5678', f"Karte:;{CCNUMBER}", 'Kategorie:;Alle',
+                  'Datum;Buchungsdetails;Gutschrift in CHF;Lastschrift in CHF;Label;Kategorie']
+    else:
+        header = ['Card account:;0000 1234 5678', f"Card:;{CCNUMBER}", 'Category:;All',
+                  'Date;Booking details;Credit in CHF;Debit in CHF;Tag;Category']
+    lines = list(header)
+    for i in reversed(range(n_rows)):
+        day = _day(i, n_rows).isoformat()
+        amount = _money(rng, 1, 500)
+        if i % 50 == 0:
+            # charge of the card from the giro account, skipped by the importer
+            lines.append(f"{day};CH-DD ZAHLUNG;{amount};;;")
+        elif rng.random() < 0.05:
+            lines.append(f"{day};GUTSCHRIFT SHOP {i % 997};{amount};;;")
+        else:
+            lines.append(f"{day};SHOP  {i % 997}  ZUERICH CHE;;-{amount};;Einkauf")
+    lines += [';Total;0.00;0.00;;', '']
+
+    path = os.path.join(directory, f"pfcc_{language}_{n_rows}.csv")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def finpension_statement(directory, n_rows, seed=0):
+    rng = random.Random(seed)
+    columns = ['Date', 'Category', 'Asset Name', 'ISIN', 'Number of Shares',
+               'Asset Currency', 'Currency Rate', 'Asset Price in CHF',
+               'Cash Flow', 'Balance']
+    lines = [';'.join(columns)]
+    balance = Decimal('0.00')
+    isins = list(FUNDS)
+    for i in range(n_rows):
+        day = _day(i, n_rows).isoformat()
+        kind = i % 10
+        isin = isins[i % len(isins)]
+        if kind == 0:
+            flow = _money(rng, 100, 7000)
+            row = [day, 'Deposit', '', '', '', 'CHF', '1', '', flow]
+        elif kind == 1:
+            flow = -_money(rng, 0.5, 20)
+            row = [day, 'Flat-rate administrative fee', '', '', '', 'CHF', '1', '', flow]
+        elif kind == 2:
+            flow = _money(rng, 1, 50)
+            row = [day, 'Dividend', FUNDS[isin], isin, '', 'CHF', '1',
+                   _money(rng, 0.1, 3), flow]
+        elif kind == 3:
+            flow = _money(rng, 0.01, 2)
+            row = [day, 'Interests', '', '', '', 'CHF', '1', '', flow]
+        else:
+            price = _money(rng, 900, 2500)
+            shares = (Decimal(rng.randint(1, 5000)) / 1000)
+            flow = -(price * shares).quantize(Decimal('0.01'))
+            row = [day, 'Buy', FUNDS[isin], isin, shares, 'CHF', '1', price, flow]
+        balance += flow
+        lines.append(';'.join(str(x) for x in row + [balance]))
+
+    path = os.path.join(directory, f"finpension_S3a_Portfolio1_{n_rows}.csv")
+    with open(path, 'w', encoding='utf-8-sig') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def ledger(directory, n_rows, seed=0):
+    """
+    every 20th transaction carries spreading, recurring, budgeting or partner
+    meta, the others are plain salary and expense transactions
+    """
+    rng = random.Random(seed)
+    lines = ['option "operating_currency" "CHF"', '']
+    accounts = ['Assets:Bank', 'Assets:Receivables', 'Income:Jobs:Taxable:Salary',
+                'Income:Invest:PnL', 'Expenses:Food', 'Expenses:Rent',
+                'Expenses:Insurance', 'Liabilities:Tax']
+    lines += [f"2000-01-01 open {account}" for account in accounts] + ['']
+    for i in range(n_rows):
+        day = _day(i, n_rows)
+        amount = _money(rng, 10, 2000)
+        kind = i % 20
+        if kind == 0:
+            lines += [f'{day} * "Bank" "PnL"',
+                      '  p_spreading_frequency: "M"',
+                      f'  p_spreading_start: "{day.replace(day=1)}"',
+                      '  p_spreading_times: "3"',
+                      f"  Assets:Bank  {amount} CHF",
+                      f"  Income:Invest:PnL  -{amount} CHF"]
+        elif kind == 1:
+            lines += [f'{day} * "Insurer" "Premium"',
+                      '  recurring_frequency: "M"',
+                      f'  recurring_start: "{day.replace(day=1)}"',
+                      '  recurring_times: "12"',
+                      f"  Expenses:Insurance  {amount} CHF",
+                      f"  Assets:Bank  -{amount} CHF"]
+        elif kind == 2:
+            lines += [f'{day} * "Budget" "Food"',
+                      f'  p_budgeting_start: "{day}"',
+                      '  p_budgeting_frequency: "W"',
+                      '  p_budgeting_times: "4"',
+                      '  p_budgeting_limit_to_today: "False"',
+                      f"  Expenses:Food  {amount} CHF",
+                      f"  Assets:Bank  -{amount} CHF"]
+        elif kind == 3:
+            lines += [f'{day} * "Landlord" "Rent"',
+                      '  partner: 0.5',
+                      f"  Expenses:Rent  {amount} CHF",
+                      f"  Assets:Bank  -{amount} CHF"]
+        elif kind < 8:
+            lines += [f'{day} * "Employer" "Salary"',
+                      f"  Income:Jobs:Taxable:Salary  -{amount * 5} CHF",
+                      f"  Assets:Bank  {amount * 5} CHF"]
+        else:
+            lines += [f'{day} * "Shop" "Groceries"',
+                      f"  Expenses:Food  {amount} CHF",
+                      f"  Assets:Bank  -{amount} CHF"]
+        lines.append('')
+
+    path = os.path.join(directory, f"ledger_{n_rows}.bean")
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+    return path
@@ -0,0 +1,270 @@
+"""
+Golden-output regression harness for the drnukebean importers.
+
+Runs a corpus of statement files through the importers of a bean-extract
+config, prints the extracted entries with beancount's printer and
+  - diffs every registered fast path (see FAST_PATHS) against the reference
+    extract of the same importer
+  - with --golden DIR, diffs the reference output against golden files recorded
+    earlier with --record, to catch changes of the reference itself
+and reports the throughput per importer and path.
+
+  python benchmarks/golden.py                          synthetic corpus, see generators.py
+  python benchmarks/golden.py --config config.py --corpus statements/ --golden golden/ --record
+  python benchmarks/golden.py --config config.py --corpus statements/ --golden golden/
+
+exits with status 1 if any output differs.
+"""
+
+from collections import defaultdict
+from dataclasses import replace
+from decimal import Decimal
+
+import argparse
+import copy
+import difflib
+import os
+import pickle
+import runpy
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from beancount.core import data
+from beancount.ingest.cache import get_file
+from beancount.parser import printer
+
+import generators
+from drnukebean.importer.PFG import PFGImporter
+from drnukebean.importer.PFCC import PFCCImporter
+from drnukebean.importer.finpension import FinPensionImporter
+from drnukebean.importer.ibkr import SPLIT_SUMS, IBKRImporter
+
+
+# alternative extract paths per importer class:
+# {class name: [(label, function(importer, file) -> entries), ...]}
+# a path returning None does not apply to the file and is skipped
+FAST_PATHS = defaultdict(list)
+
+
+def register_fast_path(importer_class, label, func):
+    FAST_PATHS[importer_class.__name__].append((label, func))
+
+
+def iter_extract(importer, file_):
+    return list(importer.iter_extract(file_))
+
+
+def with_settings(importer, **settings):
+    # a copy of the importer with other options
+    variant = copy.copy(importer)
+    for key, val in settings.items():
+        setattr(variant, key, val)
+    return variant
+
+
+def split_execution(trade):
+    """
+    the parts of an execution IB could have split it into: one unit first,
+    the rest after. the amounts are shared out by quantity, to the cent
+    """
+    quantity = trade.quantity
+    if quantity is None or abs(quantity) < 2 or quantity != quantity.to_integral():
+        return [trade]
+    share = Decimal(1 if quantity > 0 else -1)
+    first = {'quantity': share}
+    for col in SPLIT_SUMS:
+        value = getattr(trade, col, None)
+        if col != 'quantity' and value is not None:
+            first[col] = (value * share / quantity).quantize(Decimal('0.01'))
+    rest = {col: getattr(trade, col) - part for col, part in first.items()}
+    return [replace(trade, **first), replace(trade, **rest)]
+
+
+def collapsed_splits(importer, file_):
+    """
+    the extract of the statement with every execution split in two, by an
+    importer collapsing them again. has to give the reference entries.
+    only for statements loaded from a pickle (fpath), None otherwise
+    """
+    if not importer.filepath:
+        return None
+    with open(importer.filepath, 'rb') as f:
+        statement = pickle.load(f)
+    statements = []
+    for poi in statement.FlexStatements:
+        trades = [part for trade in poi.Trades
+                  for part in (split_execution(trade)
+                               if trade.levelOfDetail == 'EXECUTION' else [trade])]
+        statements.append(replace(poi, Trades=trades))
+    statement = replace(statement, FlexStatements=statements)
+    with tempfile.TemporaryDirectory() as directory:
+        fpath = os.path.join(directory, 'split.pkl')
+        with open(fpath, 'wb') as f:
+            pickle.dump(statement, f)
+        variant = with_settings(importer, filepath=fpath, collapseTradeSplits=True)
+        return variant.extract(file_)
+
+
+def plain_projection(importer, file_):
+    """
+    the extract with the tables made the plain way, a DataFrame of all
+    attributes of the ibflex objects and no categoricals, instead of ProjectTable
+    """
+    def ProjectStatement(poi):
+        return {report: pd.DataFrame([vars(entry) for entry in getattr(poi, report)])
+                .reindex(columns=columns)
+                for report, columns in variant.reportColumns().items()}
+
+    variant = with_settings(importer)
+    variant.ProjectStatement = ProjectStatement
+    return variant.extract(file_)
+
+
+register_fast_path(PFGImporter, 'iter_extract', iter_extract)
+register_fast_path(PFCCImporter, 'iter_extract', iter_extract)
+register_fast_path(FinPensionImporter, 'iter_extract', iter_extract)
+register_fast_path(IBKRImporter, 'collapsed splits', collapsed_splits)
+register_fast_path(IBKRImporter, 'plain projection', plain_projection)
+
+
+def synthetic_corpus(directory, size):
+    # (files, importers) of the generated statements
+    creds, statement = generators.ibkr_statement(directory, size)
+    files = [generators.pfg_statement(directory, size, language='DE'),
+             generators.pfg_statement(directory, size, language='EN'),
+             generators.pfg_statement(directory, size, new_format=True),
+             generators.pfcc_statement(directory, size, language='DE'),
+             generators.pfcc_statement(directory, size, language='EN'),
+             generators.finpension_statement(directory, size),
+             creds]
+    importers = [
+        PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF'),
+        PFCCImporter(generators.CCNUMBER, 'Liabilities:PF:Card',
+                     currency='CHF', manual_fixes=None),
+        FinPensionImporter(deposit_account='Assets:Bank',
+                           root_account='Assets:Invest:S3a:Finpension:Portfolio1',
+                           isin_lookup=generators.FUNDS),
+        IBKRImporter(Mainaccount='Assets:Invest:IB',
+                     WHTAccount='Expenses:Invest:IB:WTax',
+                     depositAccount='Assets:Bank',
+                     fpath=statement)]
+    return files, importers
+
+
+def input_size(fname, importer):
+    # the IBKR importer reads its statement from the pickle given as fpath
+    size = os.path.getsize(fname)
+    if isinstance(importer, IBKRImporter) and importer.filepath:
+        size += os.path.getsize(importer.filepath)
+    return size
+
+
+def format_entries(entries):
+    # sorted, so that paths emitting the same entries in another order agree
+    return [printer.format_entry(entry)
+            for entry in sorted(entries, key=data.entry_sortkey)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def diff(expected, actual, expected_label, actual_label):
+    return list(difflib.unified_diff(
+        ''.join(expected).splitlines(keepends=True),
+        ''.join(actual).splitlines(keepends=True),
+        expected_label, actual_label))
+
+
+def golden_path(golden_dir, fname, importer):
+    return os.path.join(golden_dir,
+                        f"{os.path.basename(fname)}.{type(importer).__name__}.beancount")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--config', help='bean-extract config file with a CONFIG list of importers')
+    parser.add_argument('--corpus', help='directory of statement files')
+    parser.add_argument('--golden', help='directory of golden output files')
+    parser.add_argument('--record', action='store_true',
+                        help='write the reference output as new golden files')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='rows per file of the synthetic corpus')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.config:
+            importers = runpy.run_path(args.config)['CONFIG']
+        if args.corpus:
+            files = sorted(os.path.join(args.corpus, fname)
+                           for fname in os.listdir(args.corpus))
+        if not (args.config and args.corpus):
+            synthetic_files, synthetic_importers = synthetic_corpus(directory, args.size)
+            files = files if args.corpus else synthetic_files
+            importers = importers if args.config else synthetic_importers
+        if args.golden:
+            os.makedirs(args.golden, exist_ok=True)
+
+        # label -> [bytes, entries, seconds]
+        throughput = defaultdict(lambda: [0, 0, 0.0])
+        failures = []
+        for fname in files:
+            file_ = get_file(fname)
+            for importer in importers:
+                if not importer.identify(file_):
+                    continue
+                size = input_size(fname, importer)
+                name = type(importer).__name__
+                entries, elapsed = timed(importer.extract, file_)
+                reference = format_entries(entries)
+                stats = throughput[f"{name} reference"]
+                stats[0] += size
+                stats[1] += len(entries)
+                stats[2] += elapsed
+
+                if args.golden:
+                    path = golden_path(args.golden, fname, importer)
+                    if args.record:
+                        with open(path, 'w') as f:
+                            f.write(''.join(reference))
+                    elif os.path.exists(path):
+                        with open(path) as f:
+                            golden = f.read()
+                        lines = diff([golden], reference, path, f"{fname} {name}")
+                        if lines:
+                            failures.append((fname, name, 'golden', lines))
+
+                for label, func in FAST_PATHS[name]:
+                    entries, elapsed = timed(func, importer, file_)
+                    if entries is None:
+                        continue
+                    lines = diff(reference, format_entries(entries),
+                                 f"{fname} {name} reference", f"{fname} {name} {label}")
+                    if lines:
+                        failures.append((fname, name, label, lines))
+                    stats = throughput[f"{name} {label}"]
+                    stats[0] += size
+                    stats[1] += len(entries)
+                    stats[2] += elapsed
+
+    print(f"{'importer / path':<40} {'MB/s':>10} {'entries/s':>12}")
+    for label, (n_bytes, n_entries, seconds) in sorted(throughput.items()):
+        seconds = max(seconds, 1e-9)
+        print(f"{label:<40} {n_bytes / seconds / 1e6:10.2f} {n_entries / seconds:12.0f}")
+
+    for fname, name, label, lines in failures:
+        print(f"\n*** {name} {label} differs for {fname}")
+        sys.stdout.writelines(lines)
+    if failures:
+        sys.exit(1)
+    if args.record:
+        print(f"recorded golden files in {args.golden}")
+
+
+if __name__ == '__main__':
+    main()
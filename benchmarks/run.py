@@ -0,0 +1,206 @@
+"""
+Benchmarks for the drnukebean importers and plugins on synthetic inputs,
+see generators.py.
+
+  python benchmarks/run.py                          all benchmarks at 1k, 10k and 100k rows
+  python benchmarks/run.py --sizes 1000 --only pfg_de ibkr
+  python benchmarks/run.py --save                   store the timings as new baselines
+
+the timings (best of --repeat runs) are compared with benchmarks/baselines.json.
+a benchmark slower than its baseline by more than the --tolerance factor is
+reported as a regression, and the script exits with status 1.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from beancount import loader
+from beancount.ingest.cache import get_file
+
+import generators
+from drnukebean.importer.PFG import PFGImporter
+from drnukebean.importer.PFCC import PFCCImporter
+from drnukebean.importer.finpension import FinPensionImporter
+from drnukebean.importer.ibkr import IBKRImporter
+from drnukebean.plugins import budgeting, partner, recurring, spreading, tax_forecast
+from drnukebean import parallel_extract
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+SIZES = [1000, 10000, 100000]
+
+
+def importer_benchmark(make_file, make_importer):
+    # returns a setup function: (directory, size) -> function running the extract
+    def setup(directory, size):
+        file_ = get_file(make_file(directory, size))
+        importer = make_importer(directory, size)
+
+        def run():
+            return importer.extract(file_)
+        return run
+    return setup
+
+
+_ledgers = {}
+
+
+def load_ledger(directory, size):
+    # the generated ledger is loaded once per size and shared by all plugins
+    if size not in _ledgers:
+        entries, errors, options = loader.load_file(generators.ledger(directory, size))
+        _ledgers[size] = entries, options
+    return _ledgers[size]
+
+
+def plugin_benchmark(plugin, config_str=None):
+    def setup(directory, size):
+        entries, options = load_ledger(directory, size)
+        args = () if config_str is None else (config_str(directory),)
+
+        def run():
+            # plugins may extend the list they are given
+            return plugin(list(entries), options, *args)
+        return run
+    return setup
+
+
+def tax_forecast_config(directory):
+    return repr({"taxable_accounts": ["Income:Jobs:Taxable:.*"],
+                 "deductable_accounts": [],
+                 "tax_expenses_main_account": "Expenses:Taxes",
+                 "liability_account": "Liabilities:Tax",
+                 "year": 2022, "api_year": 2023, "municipality": 261,
+                 "marial_srtatus": "single", "n_children": 0,
+                 "tax_day_of_month": 24, "precision": 2,
+                 "tax_engine": "local", "cache_dir": directory})
+
+
+def ibkr_file(directory, size):
+    return generators.ibkr_statement(directory, size)[0]
+
+
+def ibkr_importer(directory, size):
+    return IBKRImporter(Mainaccount='Assets:Invest:IB',
+                        WHTAccount='Expenses:Invest:IB:WTax',
+                        depositAccount='Assets:Bank',
+                        fpath=os.path.join(directory, f"ibkr_{size}.pkl"))
+
+
+def extract_benchmark(max_workers, n_files=4):
+    # the size split over n_files statements, extracted by parallel_extract.
+    # compare extract_1 (one thread, like bean-extract) with extract_4 for the
+    # speed-up of the process pool
+    def setup(directory, size):
+        statements = os.path.join(directory, f"statements_{size}")
+        for i in range(n_files):
+            subdirectory = os.path.join(statements, str(i))
+            os.makedirs(subdirectory, exist_ok=True)
+            generators.pfg_statement(subdirectory, size // n_files, seed=i)
+        importers = [PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF')]
+
+        def run():
+            return parallel_extract.extract_files(importers, [statements],
+                                                  max_workers=max_workers)
+        return run
+    return setup
+
+
+BENCHMARKS = {
+    'pfg_de': importer_benchmark(
+        lambda d, n: generators.pfg_statement(d, n, language='DE'),
+        lambda d, n: PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF')),
+    'pfg_en': importer_benchmark(
+        lambda d, n: generators.pfg_statement(d, n, language='EN'),
+        lambda d, n: PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF')),
+    'pfg_new': importer_benchmark(
+        lambda d, n: generators.pfg_statement(d, n, new_format=True),
+        lambda d, n: PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF')),
+    'pfcc_de': importer_benchmark(
+        lambda d, n: generators.pfcc_statement(d, n, language='DE'),
+        lambda d, n: PFCCImporter(generators.CCNUMBER, 'Liabilities:PF:Card',
+                                  currency='CHF', manual_fixes=None)),
+    'pfcc_en': importer_benchmark(
+        lambda d, n: generators.pfcc_statement(d, n, language='EN'),
+        lambda d, n: PFCCImporter(generators.CCNUMBER, 'Liabilities:PF:Card',
+                                  currency='CHF', manual_fixes=None)),
+    'finpension': importer_benchmark(
+        generators.finpension_statement,
+        lambda d, n: FinPensionImporter(
+            deposit_account='Assets:Bank',
+            root_account='Assets:Invest:S3a:Finpension:Portfolio1',
+            isin_lookup=generators.FUNDS)),
+    'ibkr': importer_benchmark(ibkr_file, ibkr_importer),
+    'extract_1': extract_benchmark(1),
+    'extract_4': extract_benchmark(4),
+    'spreading': plugin_benchmark(
+        spreading.spreading, lambda d: "{'liability_acc_base': 'Assets:Receivables:'}"),
+    'recurring': plugin_benchmark(recurring.recurring, lambda d: ''),
+    'budgeting': plugin_benchmark(budgeting.budgeting, lambda d: '{}'),
+    'partner': plugin_benchmark(partner.partner),
+    'tax_forecast': plugin_benchmark(tax_forecast.tax_forecast, tax_forecast_config),
+}
+
+
+def measure(run, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        default=sorted(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='slowdown factor against the baseline reported as regression')
+    parser.add_argument('--save', action='store_true',
+                        help='store the timings in the baselines file')
+    parser.add_argument('--baselines', default=BASELINES)
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            for name in args.only:
+                run = BENCHMARKS[name](directory, size)
+                key = f"{name}@{size}"
+                results[key] = measure(run, args.repeat)
+                baseline = baselines.get(key)
+                line = f"{key:<24} {results[key]:10.4f} s"
+                if baseline:
+                    ratio = results[key] / baseline
+                    line += f"   baseline {baseline:10.4f} s   x{ratio:.2f}"
+                    if ratio > args.tolerance:
+                        line += "   REGRESSION"
+                        regressions.append(key)
+                print(line, flush=True)
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"saved {len(results)} baselines to {args.baselines}")
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,4 +5,5 @@ setup(name = 'drnuke-bean',
       description = "Dr Nukes's beancount arsenal",
       package_dir={'': 'src'},
       packages=find_packages(where='src'),
+      package_data={'drnukebean': ['plugins/tariffs/*.json']},
       zip_safe = False)
\ No newline at end of file
@@ -2,30 +2,24 @@
 # see the importer for the checkings account for more detailed documentation
 import csv
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
+from itertools import islice
 
 
 from beancount.core import data
 from beancount.core.amount import Amount
 from beancount.ingest import importer
 from beancount.core.number import Decimal
-from .util import remove_spaces
+from .util import (BATCH_ROWS, RawTxn, apply_fixes, currency_accounts,
+                   mapped_statement)
+from drnukebean.profiling import phase, profile_method
 from pathlib import Path
 
-import pdb
-
 
 class InvalidFormatError(Exception):
     pass
 
 
-def fmt_number_de(value: str) -> Decimal:
-    thousands_sep = '.'
-    decimal_sep = ','
-
-    return Decimal(value.replace(thousands_sep, '').replace(decimal_sep, '.'))
-
-
 def DecimalOrZero(value):
     # for string to number conversion with empty strings
     try:
@@ -40,11 +34,14 @@ class PFCCImporter(importer.ImporterProtocol):
                  account,
                  currency='EUR',
                  file_encoding='utf-8',
-                 manual_fixes=0,
+                 manual_fixes=None,
                  filetypes=[]):
 
+        # account is either the account of statements in currency, or a dict
+        # {currency: account} to import the cards of several currencies
         self.account = account
         self.currency = currency
+        self.accounts = currency_accounts(account, currency)
         self.file_encoding = file_encoding
         self.language = ''
         self.ccnumber = ccnumber.replace(' ', '')[-4:]
@@ -63,14 +60,15 @@ class PFCCImporter(importer.ImporterProtocol):
     def name(self):
         return 'PFCC {}'.format(self.__class__.__name__)
 
-    def file_account(self, _):
-        return self.account
+    def file_account(self, file_):
+        return self.accounts.get(self.getCurrency(file_), next(iter(self.accounts.values())))
 
     def file_date(self, file_):
         self.extract(file_)
 
         return self._date_from
 
+    @profile_method
     def identify(self, file_):
         return self.checkForAccount(file_)
 
@@ -82,10 +80,8 @@ class PFCCImporter(importer.ImporterProtocol):
             return False
 
         try:
-            f = open(file_.name, encoding=self.file_encoding)
-        
-            with f as fd:
-                reader = csv.reader(fd, delimiter=self.delimiter)
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                reader = csv.reader(statement.lines(), delimiter=self.delimiter)
                 L = [1]  # row index in which cc number is found
                 C = 1  # column index in which iban is found
                 for i, line in enumerate(reader):
@@ -107,102 +103,111 @@ class PFCCImporter(importer.ImporterProtocol):
         langdict = {'Kartenkonto:': 'DE',
                     'Card account:': 'EN'}
         try:
-            with open(file_.name, encoding=self.file_encoding) as f:
-                line = f.readline()
-                for key, val in langdict.items():
-                    if line.startswith(key):
-                        return val
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                line = statement.line(0) or ''
+            for key, val in langdict.items():
+                if line.startswith(key):
+                    return val
 
         except:
             pass
         print('***** Cannot determine language of {}'.format(file_.name))
         return None
 
+    def getCurrency(self, file_):
+        # the currency of the statement, from the header of the debit column
+        try:
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                line = statement.line(3) or ''
+            return next(csv.reader([line], delimiter=self.delimiter))[3][-3:]
+        except (UnicodeDecodeError, IOError, IndexError, StopIteration):
+            return None
+
+    @profile_method
     def extract(self, file_, existing_entries=None):
-        # the actual text processing of the bank statement
+        return list(self.iter_extract(file_, existing_entries))
 
+    def iter_extract(self, file_, existing_entries=None):
+        # the actual text processing of the bank statement. yields the entries
+        # a batch of rows at a time, so consumers can process huge statements
+        # as they go
         self.language = self.getLanguage(file_)
         if self.language == None:
-            return []
-        entries = []
-
+            return
         if not self.checkForAccount(file_):
             raise InvalidFormatError()
 
-        with open(file_.name, encoding=self.file_encoding) as fd:
-
-            reader = csv.reader(fd, delimiter=self.delimiter)
-
-            line = next(reader)  # account info, ignore
-            allowed_lines = ["Kartenkonto:", "Card account:"] # add your language
-            assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
-            line = next(reader)
-            allowed_lines = ["Karte:", "Card:"] # add your language
-            assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
-            line = next(reader) 
-            allowed_lines = ["Kategorie:", "Category:"] # add your language
-            assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
+        with mapped_statement(file_.name, self.file_encoding) as statement:
+            with phase('PFCCImporter.parse'):
+                reader = csv.reader(statement.lines(), delimiter=self.delimiter)
+
+                line = next(reader)  # account info, ignore
+                allowed_lines = ["Kartenkonto:", "Card account:"] # add your language
+                assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
+                line = next(reader)
+                allowed_lines = ["Karte:", "Card:"] # add your language
+                assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
+                line = next(reader) 
+                allowed_lines = ["Kategorie:", "Category:"] # add your language
+                assert line[0] in allowed_lines, f"statement format changed in line {reader.line_num}: {line}" 
          
 
-            # get the headers fot the actual transaction table
-            cols = next(reader)
-            cols_ger = ['Datum', 'Buchungsdetails', 'Gutschrift in CHF', 'Lastschrift in CHF', 'Label', 'Kategorie']
-            cols_eng = ['Date', 'Booking details', 'Credit in CHF', 'Debit in CHF', 'Tag', 'Category']
-            allowed_cols = list(zip(cols_ger, cols_eng))
-            assert all([cols[i] in allowed_cols[i] for i in range(len(cols))]), f"statement format changed in line {reader.line_num}: {line}" 
-
-            if cols[3][-3:] != self.currency:
-                print('Importer vs. bankstatement currency: {} {} in {}'.format(
-                    self.currency, line[4][-3:], file_.name))
-                return []
-
-            # Data entries
-            for i, row in enumerate(reader):
-                if len(row) == 0:  # "end" of bank statment
+                # get the headers fot the actual transaction table
+                cols = next(reader)
+                cols_ger = ['Datum', 'Buchungsdetails', 'Gutschrift in', 'Lastschrift in', 'Label', 'Kategorie']
+                cols_eng = ['Date', 'Booking details', 'Credit in', 'Debit in', 'Tag', 'Category']
+                allowed_cols = list(zip(cols_ger, cols_eng))
+                # the amount columns end with the card's currency, e.g. 'Credit in CHF'
+                cols_plain = [re.sub(r' [A-Z]{3}$', '', col) for col in cols]
+                assert all([cols_plain[i] in allowed_cols[i] for i in range(len(cols))]), f"statement format changed in line {reader.line_num}: {line}" 
+
+                currency = cols[3][-3:]
+                if currency not in self.accounts:
+                    print('Importer vs. bankstatement currency: {} {} in {}'.format(
+                        '/'.join(self.accounts), currency, file_.name))
+                    return
+                account = self.accounts[currency]
+
+            # Data entries, parsed and built a batch of rows at a time
+            rows = enumerate(reader)
+            end = False
+            while not end:
+                with phase('PFCCImporter.parse'):
+                    batch = []
+                    for i, row in islice(rows, BATCH_ROWS):
+                        if len(row) == 0:  # "end" of bank statment
+                            end = True
+                            break
+                        batch.append((i, row))
+                if not batch:
                     break
-                if row[1] == 'Total':  # ignore this entry
-                    continue
-                # skip credit card bill or charge transaction, as they already appear on the giro account
-                if ('CH-DD ZAHLUNG' in row[1]) or ('ONLINE LADUNG KARTENKONTO' in row[1]):
-                    continue
-
-                meta = data.new_metadata(file_.name, i)
-                credit = DecimalOrZero(row[2])
-                debit = DecimalOrZero(row[3])
-                total = credit+debit  # mind PF sign convention
-                date = datetime.strptime(row[0], '%Y-%m-%d').date()
-                amount = Amount(total, self.currency)
-
-                description = row[1]
-                
-                
-                d = dict(amount=amount,
-                        account=self.account,
-                        meta=meta,
-                        flag=self.FLAG,
-                        narration=description,
-                        payee='',
-                        date=date,
-                        postings=[data.Posting(self.account,
-                                            amount,
-                                            None,
-                                            None,
-                                            None,
-                                            None)]
-                        )
-
-                if self.manual_fixes is not None:
-                    d = self.manual_fixes(d)
-                    
-                trans = data.Transaction(d['meta'],
-                                        d['date'],
-                                        d['flag'],
-                                        remove_spaces(d['payee']),
-                                        remove_spaces(d['narration']),
-                                        data.EMPTY_SET,
-                                        data.EMPTY_SET,
-                                        d['postings']
-                                        )
-                entries.append(trans)
-
-        return entries
+
+                with phase('PFCCImporter.build') as record:
+                    transactions = []
+                    for i, row in batch:
+                        if row[1] == 'Total':  # ignore this entry
+                            continue
+                        # skip credit card bill or charge transaction, as they already appear on the giro account
+                        if ('CH-DD ZAHLUNG' in row[1]) or ('ONLINE LADUNG KARTENKONTO' in row[1]):
+                            continue
+
+                        meta = data.new_metadata(file_.name, i)
+                        credit = DecimalOrZero(row[2])
+                        debit = DecimalOrZero(row[3])
+                        total = credit+debit  # mind PF sign convention
+                        date = datetime.strptime(row[0], '%Y-%m-%d').date()
+                        amount = Amount(total, currency)
+
+                        description = row[1]
+
+                        # prepare/ make the transaction
+                        txn = RawTxn(date=date,
+                                     flag=self.FLAG,
+                                     narration=description,
+                                     account=account,
+                                     amount=amount,
+                                     meta=meta)
+                        txn = apply_fixes(txn, self.manual_fixes)
+                        transactions.append(txn.to_transaction())
+                    record['entries_out'] = len(transactions)
+                yield from transactions
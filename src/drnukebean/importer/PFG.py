@@ -1,29 +1,23 @@
 # beancount importer for Postfinance.
 import csv
 from pathlib import Path
-import re
 from datetime import datetime, timedelta
+from itertools import islice
 import logging
 
 from beancount.core import data
 from beancount.core.amount import Amount
 from beancount.ingest import importer
 from beancount.core.number import Decimal
-from .util import remove_spaces
+from .util import (BATCH_ROWS, RawTxn, apply_fixes, currency_accounts,
+                   mapped_statement)
+from drnukebean.profiling import phase, profile_method
 
 
 class InvalidFormatError(Exception):
     pass
 
 
-def fmt_number_de(value: str) -> Decimal:
-    # a fix for region specific number formats
-    thousands_sep = '.'
-    decimal_sep = ','
-
-    return Decimal(value.replace(thousands_sep, '').replace(decimal_sep, '.'))
-
-
 def DecimalOrZero(value):
     # for string to number conversion with empty strings
     if not value:
@@ -39,6 +33,11 @@ def strip_new_pf_format(s):
     return s.strip("=").strip('"')
 
 
+def normalize_iban(value):
+    # the IBAN of a header cell, also when quoted (="...") or spaced
+    return strip_new_pf_format(value).replace(' ', '')
+
+
 class PFGImporter(importer.ImporterProtocol):
     """
     Beancount Importer for the Postfinance giro account bank statements
@@ -54,12 +53,18 @@ class PFGImporter(importer.ImporterProtocol):
                  filetypes=[],
                  date_format='%d.%m.%Y'):
 
+        # account and balance_account are either the accounts of statements in
+        # currency, or dicts {currency: account} to import the statements of
+        # several currencies with one importer
         self.account = account
         if balance_account is not None:
             self.balance_account = balance_account
         else:
             self.balance_account = account
         self.currency = currency
+        self.accounts = currency_accounts(account, currency)
+        self.balance_accounts = dict(self.accounts,
+                                     **currency_accounts(self.balance_account, currency))
         self.file_encoding = file_encoding
         self.language = ''
         self.iban = iban.replace(' ', '')
@@ -76,13 +81,14 @@ class PFGImporter(importer.ImporterProtocol):
     def name(self):
         return 'PFG {}'.format(self.__class__.__name__)
 
-    def file_account(self, _):
-        return self.account
+    def file_account(self, file_):
+        return self.accounts.get(self.getCurrency(file_), next(iter(self.accounts.values())))
 
     def file_date(self, file_):
         self.extract(file_)
         return self._date_from
 
+    @profile_method
     def identify(self, file_):
         check = self.checkForAccount(file_)
         logging.info(f"identify PFG importer with file {file_.name}: {check}")
@@ -96,19 +102,19 @@ class PFGImporter(importer.ImporterProtocol):
             return False
 
         try:
-            f = open(file_.name, encoding=self.file_encoding)
-
-            with f as fd:
-                reader = csv.reader(fd, delimiter=self.delimiter)
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                reader = csv.reader(statement.lines(), delimiter=self.delimiter)
                 L = [1,3]  # row index in which iban is found
                 C = 1  # column index in which iban is found
                 for i, line in enumerate(reader):
                     if i in L:
                         try:
-                            if line[C] == self.iban:
+                            if normalize_iban(line[C]) == self.iban:
                                 return True
                         except IndexError:
                             return False
+                    if i >= max(L):  # no need to scan the transactions
+                        break
                 return False
 
         except (UnicodeDecodeError, IOError) as e:
@@ -125,11 +131,11 @@ class PFGImporter(importer.ImporterProtocol):
                     'Date from:': 'EN',
                     'Buchungsart': 'DE'}
         try:
-            with open(file_.name, encoding=self.file_encoding) as f:
-                line = f.readline()
-                for key, val in langdict.items():
-                    if key in line:
-                        return val
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                line = statement.line(0) or ''
+            for key, val in langdict.items():
+                if key in line:
+                    return val
 
         except:
             print('***** Cannot determine language of {}'.format(file_.name))
@@ -138,100 +144,110 @@ class PFGImporter(importer.ImporterProtocol):
             f'***** None of the language detection strings {list(langdict.keys())} found in line "{line}"')
         return None
 
+    def getCurrency(self, file_):
+        # the currency of the statement, from its header
+        try:
+            with mapped_statement(file_.name, self.file_encoding) as statement:
+                line = statement.line(4) or ''
+            return strip_new_pf_format(next(csv.reader([line], delimiter=self.delimiter))[1])
+        except (UnicodeDecodeError, IOError, IndexError, StopIteration):
+            return None
+
+    @profile_method
     def extract(self, file_, existing_entries=None):
-        # the actual text processing of the bank statement
+        return list(self.iter_extract(file_, existing_entries))
 
+    def iter_extract(self, file_, existing_entries=None):
+        # the actual text processing of the bank statement. yields the entries
+        # a batch of rows at a time, so consumers can process huge statements
+        # as they go
         self.language = self.getLanguage(file_)
         if self.language == None:
-            return []
-        entries = []
-
+            return
         if not self.checkForAccount(file_):
             raise InvalidFormatError()
 
-        with open(file_.name, encoding=self.file_encoding) as fd:
-
-            reader = csv.reader(fd, delimiter=self.delimiter)
-
-            line = next(reader)  # from date
-            self._date_from = datetime.strptime(
-                strip_new_pf_format(line[1]), self.date_format).date()
-            line = next(reader)   # to date
-            self._date_to = datetime.strptime(
-                strip_new_pf_format(line[1]), self.date_format).date()
-
-            line = next(reader)  # ignore booking type line
-            line = next(reader)  # ignoring IBAN line
-            line = next(reader)    # check currency
-            if strip_new_pf_format(line[1]) != self.currency:
-                print('Importer vs. bankstatement currency: {} {} in {}'.format(
-                    self.currency, line[1], file_.name))
-                return []
-            line = next(reader)  # ignore empty line
-            # get the headers fot the actual transaction table
-            cols = next(reader)
-            # headers for english files:
-            # 0 :  Booking date
-            # 1 :  Notification text
-            # 2 :  Credit in CHF
-            # 3 :  Debit in CHF
-            # 4 :  Value
-            # 5 :  Balance in CHF
+        with mapped_statement(file_.name, self.file_encoding) as statement:
+            with phase('PFGImporter.parse'):
+                reader = csv.reader(statement.lines(), delimiter=self.delimiter)
+
+                line = next(reader)  # from date
+                self._date_from = datetime.strptime(
+                    strip_new_pf_format(line[1]), self.date_format).date()
+                line = next(reader)   # to date
+                self._date_to = datetime.strptime(
+                    strip_new_pf_format(line[1]), self.date_format).date()
+
+                line = next(reader)  # ignore booking type line
+                line = next(reader)  # ignoring IBAN line
+                line = next(reader)    # check currency
+                currency = strip_new_pf_format(line[1])
+                if currency not in self.accounts:
+                    print('Importer vs. bankstatement currency: {} {} in {}'.format(
+                        '/'.join(self.accounts), line[1], file_.name))
+                    return
+                account = self.accounts[currency]
+                balance_account = self.balance_accounts[currency]
+                line = next(reader)  # ignore empty line
+                # get the headers fot the actual transaction table
+                cols = next(reader)
+                # headers for english files:
+                # 0 :  Booking date
+                # 1 :  Notification text
+                # 2 :  Credit in CHF
+                # 3 :  Debit in CHF
+                # 4 :  Value
+                # 5 :  Balance in CHF
 
             first_transaction = True  # the first tx in the csv is the latest
-            # Data entries
-            for i, row in enumerate(reader):
-                if len(row) < 5:  # "end" of bank statment or empty line
-                    continue
-                meta = data.new_metadata(file_.name, i)
-                credit = DecimalOrZero(row[2])
-                debit = DecimalOrZero(row[3])
-                total = credit+debit  # mind PF sign convention
-                date = datetime.strptime(row[0], self.date_format).date()
-                amount = Amount(total, self.currency)
-                description = row[1]
+            # Data entries, parsed and built a batch of rows at a time
+            rows = enumerate(reader)
+            while True:
+                with phase('PFGImporter.parse'):
+                    batch = list(islice(rows, BATCH_ROWS))
+                if not batch:
+                    break
+                # "end" of bank statment or empty line
+                batch = [(i, row) for i, row in batch if len(row) >= 5]
+
                 # get closing balance, if available
                 # i just happens that the first trasaction contains the latest balance
-                if (first_transaction == True) & (len(row)==8):
-                    balance = Amount(DecimalOrZero(row[7]), self.currency)
-                    entries.append(
-                        data.Balance(
-                            meta,
+                closing = next(((i, row) for i, row in batch if len(row) == 8), None)
+                if first_transaction and closing is not None:
+                    with phase('PFGImporter.balances') as record:
+                        i, row = closing
+                        date = datetime.strptime(row[0], self.date_format).date()
+                        balance = data.Balance(
+                            data.new_metadata(file_.name, i),
                             # see tariochtools EC imp.
                             date + timedelta(days=1),
-                            self.balance_account,
-                            balance,
+                            balance_account,
+                            Amount(DecimalOrZero(row[7]), currency),
                             None,
-                            None))
+                            None)
+                        record['entries_out'] = 1
+                    yield balance
                     first_transaction = False
 
-                # prepare/ make the transaction
-                d = dict(amount=amount,
-                         account=self.account,
-                         meta=meta,
-                         flag=self.FLAG,
-                         narration=description,
-                         payee='',
-                         date=date,
-                         postings=[data.Posting(self.account,
-                                                amount,
-                                                None,
-                                                None,
-                                                None,
-                                                None)]
-                         )
-
-                if self.manual_fixes is not None:
-                    d = self.manual_fixes(d)
-
-                trans = data.Transaction(d['meta'],
-                                         d['date'],
-                                         d['flag'],
-                                         remove_spaces(d['payee']),
-                                         remove_spaces(d['narration']),
-                                         data.EMPTY_SET,
-                                         data.EMPTY_SET,
-                                         d['postings']
-                                         )
-                entries.append(trans)
-        return entries
+                with phase('PFGImporter.build') as record:
+                    transactions = []
+                    for i, row in batch:
+                        meta = data.new_metadata(file_.name, i)
+                        credit = DecimalOrZero(row[2])
+                        debit = DecimalOrZero(row[3])
+                        total = credit+debit  # mind PF sign convention
+                        date = datetime.strptime(row[0], self.date_format).date()
+                        amount = Amount(total, currency)
+                        description = row[1]
+
+                        # prepare/ make the transaction
+                        txn = RawTxn(date=date,
+                                     flag=self.FLAG,
+                                     narration=description,
+                                     account=account,
+                                     amount=amount,
+                                     meta=meta)
+                        txn = apply_fixes(txn, self.manual_fixes)
+                        transactions.append(txn.to_transaction())
+                    record['entries_out'] = len(transactions)
+                yield from transactions
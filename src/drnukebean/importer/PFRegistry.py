@@ -0,0 +1,90 @@
+# beancount importer routing Postfinance statements to the configured giro and
+# credit card importers.
+# a PFGImporter is bound to one IBAN and a PFCCImporter to one card, so with
+# many accounts every importer opens every file to compare its own number.
+# PFRegistryImporter reads the IBAN or card number from a statement's header
+# once and looks up the importer of that account, which does the extract.
+import csv
+import logging
+import re
+
+from beancount.ingest import importer
+from .PFG import PFGImporter, normalize_iban
+from .PFCC import PFCCImporter
+from .util import mapped_statement
+from drnukebean.profiling import profile_method
+
+# the header only holds ascii account numbers and labels. latin-1 decodes
+# any byte, whatever the statement's actual encoding
+HEADER_ENCODING = 'ISO-8859-1'
+CARD_HEADERS = ('Kartenkonto:', 'Card account:')
+IBAN_ROWS = (1, 3)  # rows in which the IBAN is found, see PFGImporter.checkForAccount
+
+
+class PFRegistryImporter(importer.ImporterProtocol):
+    """
+    Beancount Importer for the statements of many Postfinance giro accounts
+    and credit cards, delegating to the PFGImporter of the statement's IBAN or
+    the PFCCImporter of its card
+    """
+
+    def __init__(self, importers, delimiter=';'):
+        self.delimiter = delimiter
+        self.giro = {}   # IBAN -> PFGImporter
+        self.cards = {}  # last 4 digits of the card number -> PFCCImporter
+        for imp in importers:
+            if isinstance(imp, PFGImporter):
+                registry, key = self.giro, imp.iban
+            elif isinstance(imp, PFCCImporter):
+                registry, key = self.cards, imp.ccnumber
+            else:
+                raise TypeError(f'PFRegistryImporter takes PFG and PFCC importers, not {imp!r}')
+            if key in registry:
+                raise ValueError(f'account {key} is configured twice')
+            registry[key] = imp
+
+    def name(self):
+        return 'PF {}'.format(self.__class__.__name__)
+
+    def resolve(self, file_):
+        # the importer of the account in the statement's header, None if there is none
+        try:
+            with mapped_statement(file_.name, HEADER_ENCODING) as statement:
+                lines = [statement.line(i) or '' for i in range(max(IBAN_ROWS) + 1)]
+        except (IOError, ValueError):
+            return None
+        try:
+            rows = list(csv.reader(lines, delimiter=self.delimiter))
+            if rows[0] and rows[0][0] in CARD_HEADERS:
+                imp = self.cards.get(re.sub(r'\D', '', rows[1][1])[-4:])
+            else:
+                imp = next((self.giro[iban] for iban in
+                            (normalize_iban(rows[i][1])
+                             for i in IBAN_ROWS if len(rows[i]) > 1)
+                            if iban in self.giro), None)
+        except (IndexError, csv.Error):
+            return None
+        # the delegate has the last word (file types, encoding, card number), so
+        # that identify never accepts a file the delegate's extract rejects
+        if imp is None or not imp.checkForAccount(file_):
+            return None
+        return imp
+
+    @profile_method
+    def identify(self, file_):
+        imp = self.resolve(file_)
+        logging.info(f"identify PF registry with file {file_.name}: {imp is not None and imp.name()}")
+        return imp is not None
+
+    def file_account(self, file_):
+        return self.resolve(file_).file_account(file_)
+
+    def file_date(self, file_):
+        return self.resolve(file_).file_date(file_)
+
+    @profile_method
+    def extract(self, file_, existing_entries=None):
+        return self.resolve(file_).extract(file_, existing_entries)
+
+    def iter_extract(self, file_, existing_entries=None):
+        return self.resolve(file_).iter_extract(file_, existing_entries)
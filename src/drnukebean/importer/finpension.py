@@ -27,6 +27,8 @@ from beancount.core.number import Decimal
 from beancount.core import position
 from beancount.core.number import MISSING
 
+from drnukebean.profiling import profile_method, phase
+
 # some constants set by FinPension in the csv export header
 FP_currency = 'Asset Currency'
 FP_proceeds = 'Cash Flow'
@@ -50,6 +52,8 @@ class FinPensionImporter(importer.ImporterProtocol):
                  sep=";",
                  # a regex pattern that allows to distinguish between pillar 2&3 and individual portfolios
                  regex=r"finpension_(S[2,3][a]?)_(Portfolio\d)",
+                 # None, 'day' or 'month': one transaction per ISIN and period instead of one per trade
+                 aggregate_trades=None,
                  ):
 
         self.root_account = root_account  # root account from  which others can be derived
@@ -63,7 +67,11 @@ class FinPensionImporter(importer.ImporterProtocol):
         self.flag = '*'
         self.regex = regex
         self.sep = sep
+        if aggregate_trades not in (None, 'day', 'month'):
+            raise ValueError(f"aggregate_trades must be None, 'day' or 'month', not {aggregate_trades!r}")
+        self.aggregate_trades = aggregate_trades
 
+    @profile_method
     def identify(self, file):
         # intended file format is *finpension_s2_p1* for säule(pillar) 2 portfolio 1
         result = bool(re.search(self.regex, file.name, re.IGNORECASE))
@@ -103,24 +111,32 @@ class FinPensionImporter(importer.ImporterProtocol):
             
 
 
+    @profile_method
     def extract(self, file_, existing_entries=None):
-        # the actual processing of the csv export
+        return list(self.iter_extract(file_, existing_entries))
+
+    def iter_extract(self, file_, existing_entries=None):
+        # the actual processing of the csv export. yields the entries one
+        # kind of transaction at a time
 
         # fix Account names with regard to pillar 2/3 and different portfolios.
         self.fix_accounts(file_)
 
-        df = pd.read_csv(file_.name,
-                         sep=self.sep,
-                         )
-        # convert specific columns to Decimal with specific precisions
-        to_decimal_dict = {"Number of Shares": 3,
-                           "Asset Price in CHF": 2,
-                           "Cash Flow": 2,
-                           "Balance": 2}
-        for col, digits in to_decimal_dict.items():
-            df[col] = df[col].apply(lambda x: Decimal(x).__round__(digits))
-
-        df['Date'] = pd.to_datetime(df['Date']).apply(datetime.date)
+        with phase('FinPensionImporter.parse'):
+            # memory_map lets the parser scan large exports in place
+            df = pd.read_csv(file_.name,
+                             sep=self.sep,
+                             memory_map=True,
+                             )
+            # convert specific columns to Decimal with specific precisions
+            to_decimal_dict = {"Number of Shares": 3,
+                               "Asset Price in CHF": 2,
+                               "Cash Flow": 2,
+                               "Balance": 2}
+            for col, digits in to_decimal_dict.items():
+                df[col] = df[col].apply(lambda x: Decimal(x).__round__(digits))
+
+            df['Date'] = pd.to_datetime(df['Date']).apply(datetime.date)
 
         # disect the complete report in similar transactions
         # abit messy since Finpension uses different tags in pillar 2/3a
@@ -130,19 +146,63 @@ class FinPensionImporter(importer.ImporterProtocol):
         interests = df[df.Category == "Interests"]
         dividends = df[df.Category.isin(["Dividend and Interest Distributions",'Dividend'])]
 
-        return_txn = (self.Trades(trades)
-                      + self.Deposits(deposits) # omitted for only occuring very rarely
-                      + self.Fees(fees)
-                      + self.Interest(interests)
-                      + self.Dividends(dividends)
-                      + self.Balances(df)
-                      )
-
-        return return_txn
+        builders = [(self.Trades, trades),
+                    (self.Deposits, deposits), # omitted for only occuring very rarely
+                    (self.Fees, fees),
+                    (self.Interest, interests),
+                    (self.Dividends, dividends)]
+        for builder, rows in builders:
+            with phase(f'FinPensionImporter.build.{builder.__name__}') as record:
+                return_txn = builder(rows)
+                record['entries_out'] = len(return_txn)
+            yield from return_txn
+        with phase('FinPensionImporter.balances') as record:
+            balances = self.Balances(df)
+            record['entries_out'] = len(balances)
+        yield from balances
+
+    def AggregateTrades(self, trades):
+        """
+        sums up the buys resp. sells of an ISIN per day or month into one row
+        with the total shares and cash flow. the cash flow is the exact sum, the
+        price is the volume-weighted one, i.e. cash flow per share at full
+        precision, so that shares x price balances it (the narration shows
+        the price rounded to 6 decimals).
+        the date is the last trade date of the period, the column 'source_rows'
+        lists the csv line numbers of the aggregated trades
+        """
+        if len(trades) == 0:
+            return trades
+        trades = trades.copy()
+        dates = pd.to_datetime(trades['Date'])
+        trades['period'] = dates.dt.to_period('M') if self.aggregate_trades == 'month' else dates
+        trades['sell'] = trades['Number of Shares'].map(lambda shares: shares < 0)
+        # line 1 of the csv is the header
+        trades['source_rows'] = (trades.index + 2).astype(str)
+
+        keys = ['ISIN', FP_currency, 'period', 'sell']
+        aggregated = trades.groupby(keys, sort=False).agg(
+            {'Date': 'max',
+             'Category': 'first',
+             'Asset Name': 'first',
+             'Number of Shares': 'sum',
+             FP_proceeds: 'sum',
+             FP_asseet_price: 'first',
+             'source_rows': ', '.join}).reset_index()
+        # a single trade keeps its reported price
+        single = ~aggregated['source_rows'].str.contains(',')
+        aggregated[FP_asseet_price] = [
+            price if alone or not shares else -proceeds / shares
+            for price, alone, proceeds, shares in zip(aggregated[FP_asseet_price], single,
+                                                      aggregated[FP_proceeds],
+                                                      aggregated['Number of Shares'])]
+        return aggregated.sort_values('Date', kind='stable')
 
     def Trades(self, trades):
         bean_transactions = []
-        for idx, row in trades.iterrows():
+        if self.aggregate_trades:
+            trades = self.AggregateTrades(trades)
+        for row in trades.to_dict('records'):
             currency = row[FP_currency]
             isin = row['ISIN']
             symbol = self.isin_lookup.get(isin)
@@ -155,6 +215,10 @@ class FinPensionImporter(importer.ImporterProtocol):
 
             quantity = amount.Amount(row['Number of Shares'], symbol)
             price = amount.Amount(row[FP_asseet_price], "CHF")
+            shown_price = price
+            if price.number.as_tuple().exponent < -6:
+                # the full precision price of aggregated trades
+                shown_price = amount.Amount(price.number.quantize(Decimal('0.000001')), "CHF")
 
             postings = [
                 data.Posting(self.getAssetAccount(symbol),
@@ -166,13 +230,14 @@ class FinPensionImporter(importer.ImporterProtocol):
                 buy_sell = "BUY"
             else:
                 buy_sell = "SELL"
+            meta = {'source_rows': row['source_rows']} if 'source_rows' in row else None
             bean_transactions.append(
-                data.Transaction(data.new_metadata('Buy', 0),
+                data.Transaction(data.new_metadata('Buy', 0, meta),
                                  row['Date'],
                                  self.flag,
                                  isin,     # payee
                                  ' '.join(
-                                     [buy_sell, quantity.to_string(), '@', price.to_string()+";", asset]),
+                                     [buy_sell, quantity.to_string(), '@', shown_price.to_string()+";", asset]),
                                  data.EMPTY_SET,
                                  data.EMPTY_SET,
                                  postings
@@ -182,7 +247,7 @@ class FinPensionImporter(importer.ImporterProtocol):
     def Fees(self, fees):
 
         bean_transactions = []
-        for idx, row in fees.iterrows():
+        for row in fees.to_dict('records'):
             currency = row[FP_currency]
             amount_ = amount.Amount(row[FP_proceeds], currency)
 
@@ -208,7 +273,7 @@ class FinPensionImporter(importer.ImporterProtocol):
         # make dividend & WHT transactions
 
         bean_transactions = []
-        for idx, row in dividends.iterrows():
+        for row in dividends.to_dict('records'):
             currency = row[FP_currency]
             isin = row['ISIN']
             symbol = self.isin_lookup.get(isin)
@@ -250,7 +315,7 @@ class FinPensionImporter(importer.ImporterProtocol):
     def Interest(self, int_):
         # calculates interest payments from IBKR data
         bean_transactions = []
-        for idx, row in int_.iterrows():
+        for row in int_.to_dict('records'):
             currency = row[FP_currency]
             amount_ = amount.Amount(row[FP_proceeds], currency)
 
@@ -281,7 +346,7 @@ class FinPensionImporter(importer.ImporterProtocol):
 
         bean_transactions = []
         df = df[df['Date'] == df['Date'].max()]
-        for idx, row in df.iterrows():
+        for row in df.to_dict('records'):
             currency = row[FP_currency]
             amount_ = amount.Amount(row['Balance'], currency)
             meta = data.new_metadata('balance', 0)
@@ -298,7 +363,7 @@ class FinPensionImporter(importer.ImporterProtocol):
             bean_transactions = []
             if len(self.deposit_account) == 0:  # control this from the config file
                 return []
-            for idx, row in dep.iterrows():
+            for row in dep.to_dict('records'):
                 currency = row[FP_currency]
                 amount_ = amount.Amount(row[FP_proceeds], currency)
 
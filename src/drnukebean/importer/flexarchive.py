@@ -0,0 +1,253 @@
+"""
+A local archive of IBKR flex statements.
+
+IB serves at most 365 days per flex query, so a multi-year history comes as
+many statements. StatementArchive ingests them (parsed responses, pickles or
+raw xml) and keeps every row once: trades by tradeID, cash transactions by
+transactionID, the rows without an id (closed lots, cash report, positions,
+conversion rates) by their content. New rows are appended as DataFrame
+segments, partitioned by table and year, and named by the time they were
+written:
+
+  archive/Trades/2019/<time>-<uuid>.pkl
+  archive/Trades/2019/<time>-<uuid>.pkl   rows of a later statement, new ones only
+  archive/keys.pkl                        cache of the dedup index
+
+Segments are written to a temporary file and renamed, and hold the dedup keys
+of their rows, so the archive is the segments alone: keys.pkl caches the keys
+of the segments it lists and is completed from the segments written since
+(e.g. by another process, or before a crash). Rows two processes appended at
+the same time are dropped again when the segments are read.
+
+IBKRImporter(archive=StatementArchive('archive'), ...) builds its entries from
+the archive, for the fromDate/toDate of the credentials file. Only the year
+partitions overlapping that period are read.
+
+  python -m drnukebean.importer.flexarchive archive/ statements/*.pkl
+"""
+
+from collections import Counter
+
+import argparse
+import os
+import pickle
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+from ibflex import parser
+
+from drnukebean.importer.ibkr import (CATEGORICAL_COLUMNS, PRICE_TABLE_COLUMNS,
+                                      TABLE_COLUMNS, ProjectTable)
+
+# the column identifying a row of a table, None: the row's content
+ID_COLUMNS = {'Trades': 'tradeID',
+              'CashTransactions': 'transactionID',
+              'CashReport': None,
+              'OpenPositions': None,
+              'ConversionRates': None}
+# the date a row is partitioned and queried by
+DATE_COLUMNS = {'Trades': 'tradeDate',
+                'CashTransactions': 'reportDate',
+                'CashReport': 'toDate',
+                'OpenPositions': 'reportDate',
+                'ConversionRates': 'reportDate'}
+# the column of a segment holding the dedup keys of its rows
+KEY_COLUMN = '__key__'
+ARCHIVE_COLUMNS = {report: ['accountId'] + ([ID_COLUMNS[report]] if ID_COLUMNS[report] else [])
+                   + columns
+                   for report, columns in dict(TABLE_COLUMNS, **PRICE_TABLE_COLUMNS).items()}
+
+
+def load_statement(fname):
+    # a FlexQueryResponse from a pickle as IBKRImporter's fpath, or a flex xml
+    with open(fname, 'rb') as f:
+        content = f.read()
+    if content.lstrip().startswith(b'<'):
+        return parser.parse(content)
+    return pickle.loads(content)
+
+
+class StatementArchive:
+    """
+    append-only store of the rows of flex statements, see the module doc
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._keys = None  # {report: set of row keys}, loaded on first ingest
+        self._covered = set()  # the segments whose keys are in _keys
+        self._lock = threading.Lock()
+
+    def _keys_path(self):
+        return os.path.join(self.directory, 'keys.pkl')
+
+    def _load_keys(self):
+        # the keys of all segments: the cached ones, plus those of the
+        # segments not in the cache
+        if self._keys is None:
+            self._keys = {report: set() for report in ARCHIVE_COLUMNS}
+            if os.path.exists(self._keys_path()):
+                with open(self._keys_path(), 'rb') as f:
+                    cache = pickle.load(f)
+                self._covered = cache['segments']
+                for report, keys in cache['keys'].items():
+                    self._keys[report].update(keys)
+        for report in ARCHIVE_COLUMNS:
+            for fname in self._segments(report):
+                segment = os.path.relpath(fname, self.directory)
+                if segment not in self._covered:
+                    self._keys[report].update(pd.read_pickle(fname)[KEY_COLUMN])
+                    self._covered.add(segment)
+        return self._keys
+
+    def _save_keys(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._keys_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'segments': self._covered, 'keys': self._keys}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._keys_path())
+
+    def _row_keys(self, report, tab):
+        """
+        the dedup keys of the rows of a projected table. rows without id are
+        keyed by content and their occurrence, so that identical rows of one
+        statement (e.g. two equal closed lots) are all kept
+        """
+        id_column = ID_COLUMNS[report]
+        if id_column:
+            with_id = tab[id_column].notna()
+            if with_id.all():
+                return list(zip(tab['accountId'], tab[id_column]))
+        seen = Counter()
+        keys = []
+        for row in tab.itertuples(index=False):
+            # missing values of categoricals come as NaN, which never equals itself
+            row = tuple(None if value != value else value for value in row)
+            ident = row[1] if id_column else None
+            if ident is not None:
+                keys.append((row[0], ident))
+                continue
+            seen[row] += 1
+            keys.append((row, seen[row]))
+        return keys
+
+    def ingest(self, response):
+        """
+        add the new rows of a FlexQueryResponse. returns the number of new
+        rows per table
+        """
+        added = {}
+        with self._lock:
+            known = self._load_keys()
+            for report, columns in ARCHIVE_COLUMNS.items():
+                tabs = []
+                for statement in response.FlexStatements:
+                    # not all rows carry their account, e.g. the conversion rates
+                    part = ProjectTable(getattr(statement, report), columns,
+                                        optional=('accountId',))
+                    part['accountId'] = statement.accountId
+                    tabs.append(part)
+                tab = pd.concat(tabs, ignore_index=True) if tabs else ProjectTable([], columns)
+                keys = self._row_keys(report, tab)
+                new = [key not in known[report] for key in keys]
+                tab = tab[new].copy()
+                tab[KEY_COLUMN] = [key for key, is_new in zip(keys, new) if is_new]
+                added[report] = len(tab)
+                if len(tab):
+                    self._append(report, tab)
+                    known[report].update(tab[KEY_COLUMN])
+            # only a cache, the segments have the keys too
+            self._save_keys()
+        return added
+
+    def ingest_file(self, fname):
+        return self.ingest(load_statement(fname))
+
+    def _append(self, report, tab):
+        # one new segment per year partition, existing segments are never
+        # touched. the names sort in the order the segments were written
+        years = tab[DATE_COLUMNS[report]].map(lambda day: day.year)
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+        for year, part in tab.groupby(years.values, sort=True):
+            partition = os.path.join(self.directory, report, str(year))
+            os.makedirs(partition, exist_ok=True)
+            fname = os.path.join(partition, f"{name}.pkl")
+            part.reset_index(drop=True).to_pickle(f"{fname}.tmp")
+            os.replace(f"{fname}.tmp", fname)
+            self._covered.add(os.path.relpath(fname, self.directory))
+
+    def _segments(self, report, from_date=None, to_date=None):
+        directory = os.path.join(self.directory, report)
+        if not os.path.isdir(directory):
+            return []
+        years = sorted(int(year) for year in os.listdir(directory) if year.isdigit())
+        return [os.path.join(directory, str(year), fname)
+                for year in years
+                if (from_date is None or year >= from_date.year)
+                and (to_date is None or year <= to_date.year)
+                for fname in sorted(os.listdir(os.path.join(directory, str(year))))
+                if fname.endswith('.pkl')]
+
+    def table(self, report, from_date=None, to_date=None):
+        """
+        the archived rows of a table dated from_date to to_date (None: open
+        ended), in statement order within a day
+        """
+        columns = ARCHIVE_COLUMNS[report]
+        segments = [pd.read_pickle(fname)
+                    for fname in self._segments(report, from_date, to_date)]
+        if not segments:
+            return ProjectTable([], columns)
+        tab = pd.concat(segments, ignore_index=True)
+        # rows appended by two processes at once
+        tab = tab[~tab[KEY_COLUMN].duplicated().values].drop(columns=KEY_COLUMN)
+        dates = tab[DATE_COLUMNS[report]]
+        keep = pd.Series(True, index=tab.index)
+        if from_date is not None:
+            keep &= dates.map(lambda day: day >= from_date)
+        if to_date is not None:
+            keep &= dates.map(lambda day: day <= to_date)
+        tab = tab[keep.values]
+        # a stable sort keeps the closed lots behind their sale
+        order = tab[DATE_COLUMNS[report]].map(lambda day: day.toordinal()).values
+        tab = tab.iloc[order.argsort(kind='stable')].reset_index(drop=True)
+        for col in CATEGORICAL_COLUMNS.intersection(columns):
+            # segments with other categories come back as objects
+            tab[col] = tab[col].astype('category')
+        return tab
+
+    def tables(self, from_date=None, to_date=None, reports=None):
+        """
+        {accountId: {report: DataFrame}} of the period, with the columns of
+        reports ({report: columns}, default TABLE_COLUMNS), as
+        IBKRImporter.ProjectStatement makes them
+        """
+        reports = reports or TABLE_COLUMNS
+        tabs = {report: self.table(report, from_date, to_date) for report in reports}
+        accounts = sorted(set().union(*(tab['accountId'].unique() for tab in tabs.values())))
+        return {account: {report: tabs[report][(tabs[report]['accountId'] == account).values]
+                          [columns].reset_index(drop=True)
+                          for report, columns in reports.items()}
+                for account in accounts}
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    argparser.add_argument('archive', help='archive directory')
+    argparser.add_argument('statements', nargs='+',
+                           help='flex statements, pickled FlexQueryResponses or xml')
+    args = argparser.parse_args(argv)
+
+    archive = StatementArchive(args.archive)
+    for fname in args.statements:
+        added = archive.ingest_file(fname)
+        print(f"{fname}: " + ', '.join(f"{count} {report}" for report, count in added.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
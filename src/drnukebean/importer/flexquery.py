@@ -0,0 +1,207 @@
+"""
+Resumable download of IBKR flex queries.
+
+ibflex's client.download blocks while IB is queuing the statement, and a run
+killed in the meantime loses the reference code of its SendRequest, so the
+next run has to start over. FlexDownloader keeps the reference codes in a
+small json state file until the statement is fetched: a restarted run polls
+GetStatement for the statement it requested before. While IB is busy it backs
+off exponentially, and a long period can be split into date-range chunks that
+are fetched in parallel threads and merged into one FlexQueryResponse.
+
+  downloader = FlexDownloader(token, queryId, state_path='flexstate.json')
+  responses = downloader.download(date(2015, 1, 1), date(2023, 12, 31), chunk_days=365)
+  statement = merge_responses([parser.parse(response) for response in responses])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from ibflex import client
+from ibflex.client import (BadResponseError, ResponseCodeError, StatementAccess,
+                           StatementGenerationTimeout)
+
+# GetStatement errors of a reference code IB doesn't know (anymore): request anew
+EXPIRED = ('1003', '1017')
+# errors telling to try again shortly
+RETRY = client.SERVER_BUSY + client.CLIENT_THROTTLED + ('1004', '1005', '1006', '1007',
+                                                        '1008', '1021')
+# IB serves periods of at most a year per request
+MAX_CHUNK_DAYS = 365
+
+
+def _ymd(day):
+    return day.strftime('%Y%m%d') if day else ''
+
+
+def date_chunks(from_date, to_date, chunk_days=MAX_CHUNK_DAYS):
+    # consecutive (first day, last day) periods of at most chunk_days days
+    chunks = []
+    start = from_date
+    while start <= to_date:
+        end = min(start + timedelta(days=chunk_days - 1), to_date)
+        chunks.append((start, end))
+        start = end + timedelta(days=1)
+    return chunks
+
+
+class FlexDownloader:
+    """
+    downloads flex query statements, remembering the reference codes of
+    pending requests in state_path (no persistence without). the backoff
+    starts at initial_delay seconds and doubles up to max_delay, at most
+    max_tries polls per statement. reference codes older than max_age are
+    not resumed.
+    """
+
+    def __init__(self, token, query_id,
+                 state_path=None,
+                 request_url=None,
+                 initial_delay=5,
+                 max_delay=300,
+                 max_tries=20,
+                 max_age=timedelta(hours=6),
+                 max_workers=None,
+                 timeout=60):
+        self.token = str(token)
+        self.query_id = str(query_id)
+        self.state_path = state_path
+        self.request_url = request_url or client.REQUEST_URL
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_tries = max_tries
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def download(self, from_date=None, to_date=None, chunk_days=None):
+        """
+        the raw FlexQueryResponses of the query: one for the period configured
+        in the query without dates, else one per chunk of chunk_days days
+        """
+        if from_date is None or to_date is None:
+            return [self.fetch()]
+        chunks = date_chunks(from_date, to_date, chunk_days or MAX_CHUNK_DAYS)
+        if len(chunks) == 1:
+            return [self.fetch(*chunks[0])]
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            return list(pool.map(self.fetch, *zip(*chunks)))
+
+    def fetch(self, from_date=None, to_date=None):
+        # the raw FlexQueryResponse of one period, resuming a pending request
+        key = ':'.join([self.query_id, _ymd(from_date), _ymd(to_date)])
+        access = self._pending(key)
+        if access:
+            logging.info(f"resuming flex query {key} with reference code {access['ReferenceCode']}")
+        delay = self.initial_delay
+        for _ in range(self.max_tries):
+            if access is None:
+                params = {'fd': _ymd(from_date), 'td': _ymd(to_date)} if from_date else {}
+                result = client.parse_stmt_response(
+                    self._get(self.request_url, self.query_id, **params))
+                if isinstance(result, StatementAccess):
+                    access = {'ReferenceCode': result.ReferenceCode, 'Url': result.Url,
+                              'requested': time.time()}
+                    self._remember(key, access)
+                    # IB needs a moment to generate the statement anyway
+                    time.sleep(delay)
+                    continue
+            else:
+                response = self._get(access['Url'] or client.STMT_URL, access['ReferenceCode'])
+                # FlexQueryResponses can be huge, only check their start
+                if b'FlexQueryResponse' in response.content[:1000]:
+                    self._remember(key, None)
+                    return response.content
+                result = client.parse_stmt_response(response)
+                if isinstance(result, StatementAccess):
+                    raise BadResponseError(response)
+
+            if result.ErrorCode in EXPIRED and access is not None:
+                logging.info(f"reference code of flex query {key} expired, requesting anew")
+                self._remember(key, None)
+                access = None
+            elif result.ErrorCode not in RETRY:
+                self._remember(key, None)
+                raise ResponseCodeError(result.ErrorCode, result.ErrorMessage)
+            logging.info(f"flex query {key}: {result.ErrorMessage} retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+        # the reference code stays in the state, the next run resumes it
+        raise StatementGenerationTimeout(
+            f"flex query {key} not ready after {self.max_tries} tries")
+
+    def _get(self, url, query, **params):
+        return requests.get(url, params={'v': '3', 't': self.token, 'q': query, **params},
+                            headers={'user-agent': 'Java'}, timeout=self.timeout)
+
+    def _load_state(self):
+        if not (self.state_path and os.path.exists(self.state_path)):
+            return {}
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning(f"ignoring unreadable flex query state {self.state_path}")
+            return {}
+
+    def _pending(self, key):
+        with self._lock:
+            access = self._load_state().get(key)
+        if access and time.time() - access['requested'] < self.max_age.total_seconds():
+            return access
+        return None
+
+    def _remember(self, key, access):
+        # store (or with None drop) the reference code of a request
+        if not self.state_path:
+            return
+        with self._lock:
+            state = self._load_state()
+            if access is None:
+                state.pop(key, None)
+            else:
+                state[key] = access
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=1)
+            os.replace(tmp_path, self.state_path)
+
+
+def _merge_statements(statements):
+    # one FlexStatement of the chunks of an account: the sections concatenated
+    first = statements[0]
+    if len(statements) == 1:
+        return first
+    sections = {field.name: tuple(item for statement in statements
+                                  for item in getattr(statement, field.name) or ())
+                for field in dataclasses.fields(first)
+                if isinstance(field.default, tuple)}
+    return dataclasses.replace(first,
+                               fromDate=min(statement.fromDate for statement in statements),
+                               toDate=max(statement.toDate for statement in statements),
+                               whenGenerated=statements[-1].whenGenerated,
+                               **sections)
+
+
+def merge_responses(responses):
+    """
+    one FlexQueryResponse of the parsed responses of several date-range
+    chunks, with one FlexStatement per account
+    """
+    if len(responses) == 1:
+        return responses[0]
+    accounts = {}
+    for response in responses:
+        for statement in response.FlexStatements:
+            accounts.setdefault(statement.accountId, []).append(statement)
+    return dataclasses.replace(responses[0], FlexStatements=tuple(
+        _merge_statements(statements) for statements in accounts.values()))
@@ -10,6 +10,7 @@ Setup:
 
 import pandas as pd
 from datetime import datetime, timedelta
+import copy
 import xml.etree.ElementTree as ET
 import warnings
 import pickle
@@ -19,7 +20,7 @@ import logging
 
 import yaml
 from os import path
-from ibflex import client, parser, Types
+from ibflex import parser, Types
 from ibflex.enums import CashAction, BuySell
 from ibflex.client import ResponseCodeError
 
@@ -32,6 +33,10 @@ from beancount.core.number import Decimal
 from beancount.core import position
 from beancount.core.number import MISSING
 
+from drnukebean.importer.flexquery import FlexDownloader, merge_responses
+from drnukebean.importer.util import LotIndex
+from drnukebean.profiling import profile_method, phase
+
 
 class IBKRImporter(importer.ImporterProtocol):
     """
@@ -52,7 +57,15 @@ class IBKRImporter(importer.ImporterProtocol):
                  depositAccount='',
                  suppressClosedLotPrice=False,
                  symbolMap={},
-                 configFile='ibkr.yaml'
+                 configFile='ibkr.yaml',
+                 collapseTradeSplits=False,
+                 priceEntries=False,
+                 accountMap=None,
+                 maxWorkers=None,
+                 downloadOptions=None,
+                 archive=None,
+                 archiveOnly=False,
+                 ledgerLots=False
                  ):
 
         self.Mainaccount = Mainaccount  # main IB account in beancount
@@ -75,7 +88,30 @@ class IBKRImporter(importer.ImporterProtocol):
         self.symbolMap = symbolMap
         self.configFile = configFile
         self.roc_str = "Return of Capital" # that special swiss thing
-
+        # merge the partial executions IB splits an order into, see CollapseTradeSplits
+        self.collapseTradeSplits = collapseTradeSplits
+        # Price entries from the mark prices of open positions and the
+        # conversion rates in the statement, see Prices
+        self.priceEntries = priceEntries
+        # IB account id -> main account, or dict of account settings, e.g.
+        # {'U1234567': 'Assets:Invest:IB', 'U7654321': {'Mainaccount': 'Assets:Invest:IBKid',
+        #                                               'WHTAccount': 'Expenses:Kid:WTax'}}
+        # for flex queries over several accounts. see forAccount
+        self.accountMap = accountMap
+        self.maxWorkers = maxWorkers    # threads downloading the chunks of a long period
+        # keyword arguments of the FlexDownloader, e.g. {'state_path': ..., 'max_tries': ...}.
+        # the reference codes of pending queries are kept next to the credentials file by default
+        self.downloadOptions = downloadOptions or {}
+        # a flexarchive.StatementArchive: new statements are added to it, and the
+        # entries are built from the archived rows of the fromDate - toDate period
+        # of the credentials file. with archiveOnly, IB isn't asked at all
+        self.archive = archive
+        self.archiveOnly = archiveOnly
+        # book the closed lots of sales at the cost the existing entries hold them at,
+        # and sales without closed lots from the oldest lots in the ledger. see Panic
+        self.ledgerLots = ledgerLots
+
+    @profile_method
     def identify(self, file):
         return self.configFile == path.basename(file.name)
 
@@ -124,8 +160,14 @@ class IBKRImporter(importer.ImporterProtocol):
     def file_account(self, _):
         return self.Mainaccount
 
+    @profile_method
     def extract(self, credsfile, existing_entries=None):
-        # the actual processing of the flex query
+        return list(self.iter_extract(credsfile, existing_entries))
+
+    def iter_extract(self, credsfile, existing_entries=None):
+        # the actual processing of the flex query. yields the entries one
+        # section (trades, cash transactions, balances) at a time, as dividends
+        # and withholding taxes are matched across rows
 
         # get the IBKR creentials ready
         try:
@@ -135,57 +177,144 @@ class IBKRImporter(importer.ImporterProtocol):
                 queryId = config['queryId']
         except:
             warnings.warn('cannot read IBKR credentials file. Check filepath.')
-            return []
+            return
 
-        # get prices of existing transactions, in case we sell something
-        # priceLookup = PriceLookup(existing_entries, config['baseCcy'])
-
-        if self.filepath is None:
+        if self.archive is not None and self.archiveOnly:
+            statement = None
+        elif self.filepath is None:
             # get the report from IB. might take a while, when IB is queuing due to
             # traffic
             try:
                 # try except in case of connection interrupt
                 # Warning: queries sometimes take a few minutes until IB provides
                 # the data due to busy servers
-                response = client.download(token, queryId)
-                statement = parser.parse(response)
+                # a query still pending from an interrupted run is resumed.
+                # with fromDate and toDate in the credentials file, the period
+                # is fetched in chunks of chunkDays days, in parallel
+                options = dict({'state_path': path.join(path.dirname(credsfile.name),
+                                                        '.ibkr_flexstate.json'),
+                                'max_workers': self.maxWorkers},
+                               **self.downloadOptions)
+                downloader = FlexDownloader(token, queryId, **options)
+                with phase('IBKRImporter.download'):
+                    responses = downloader.download(config.get('fromDate'), config.get('toDate'),
+                                                    config.get('chunkDays'))
+                with phase('IBKRImporter.parse'):
+                    statement = merge_responses([parser.parse(response)
+                                                 for response in responses])
+                    del responses
             except ResponseCodeError as E:
                 logging.exception('Error fetching report, aborting')
-                return []
+                return
             except Exception as E:
                 warnings.warn(f'could not fetch IBKR Statement. exiting. {E}')
                 # another option would be to try again
-                return []
+                return
             assert isinstance(statement, Types.FlexQueryResponse)
         else:
             print('**** loading from pickle')
-            with open(self.filepath, 'rb') as pf:
+            with phase('IBKRImporter.parse'), open(self.filepath, 'rb') as pf:
                 statement = pickle.load(pf)
 
-        # convert to dataframes
-        poi = statement.FlexStatements[0]  # point of interest
-        # relevant items from report
-        reports = ['CashReport', 'Trades', 'CashTransactions']
-        tabs = {report: pd.DataFrame([{key: val for key, val in entry.__dict__.items()}
-                                      for entry in poi.__dict__[report]])
-                for report in reports}
-
-        # get single dataFrames
-        ct = tabs['CashTransactions']
-        tr = tabs['Trades']
-        cr = tabs['CashReport']
-
-        # throw out IBKR jitter, mostly None
-        ct.drop(columns=[col for col in ct if all(
-            ct[col].isnull())], inplace=True)
-        tr.drop(columns=[col for col in tr if all(
-            tr[col].isnull())], inplace=True)
-        cr.drop(columns=[col for col in cr if all(
-            cr[col].isnull())], inplace=True)
-        transactions = self.Trades(
-            tr) + self.CashTransactions(ct) + self.Balances(cr)
-
-        return transactions
+        if self.archive is not None:
+            if statement is not None:
+                with phase('IBKRImporter.archive.ingest'):
+                    self.archive.ingest(statement)
+            # the period of the credentials file, else of the new statement
+            fromDate, toDate = config.get('fromDate'), config.get('toDate')
+            if statement is not None and statement.FlexStatements:
+                fromDate = fromDate or min(poi.fromDate for poi in statement.FlexStatements)
+                toDate = toDate or max(poi.toDate for poi in statement.FlexStatements)
+            del statement
+            with phase('IBKRImporter.archive.query'):
+                statements = list(self.archive.tables(fromDate, toDate, self.reportColumns()).items())
+            project = dict  # the archive returns the tables already
+        else:
+            statements = [(poi.accountId, poi) for poi in statement.FlexStatements]
+            del statement  # only the tables are needed from here on
+            project = self.ProjectStatement
+
+        # one importer per FlexStatement (or archived account), booking to the
+        # accounts of its IB account
+        workers = [(worker, source) for worker, source in
+                   ((self.forAccount(accountId), source) for accountId, source in statements)
+                   if worker is not None]
+        if len(statements) > 1 and not self.accountMap:
+            warnings.warn(f'{len(statements)} FlexStatements and no accountMap, '
+                          f'booking all of them to {self.Mainaccount}')
+        del statements
+
+        # the lots held in the ledger, in case we sell something
+        lotIndex = None
+        if self.ledgerLots and existing_entries:
+            with phase('IBKRImporter.lotindex') as record:
+                lotIndex = LotIndex(existing_entries,
+                                    tuple({worker.Mainaccount for worker, _ in workers}))
+                record['entries_out'] = len(lotIndex)
+
+        # the statements are built one after the other, in the order of the
+        # query: the builders hold the GIL, so threads would not speed them up,
+        # and statements booking to the same accounts take their lots from the
+        # one lotIndex in a fixed order
+        tables = []
+        for worker, source in workers:
+            tabs = project(source)
+            yield from worker.StatementEntries(tabs, lotIndex)
+            if self.priceEntries:
+                tables.append({report: tabs[report] for report in PRICE_TABLE_COLUMNS})
+            del tabs
+        del workers
+
+        if self.priceEntries and tables:
+            with phase('IBKRImporter.prices') as record:
+                prices = self.Prices(pd.concat([tabs['OpenPositions'] for tabs in tables]),
+                                     pd.concat([tabs['ConversionRates'] for tabs in tables]),
+                                     existing_entries)
+                record['entries_out'] = len(prices)
+            yield from prices
+
+    def forAccount(self, accountId):
+        """
+        the importer for the FlexStatement of IB account accountId: a copy with
+        the settings from accountMap, this importer itself without accountMap,
+        None for an account missing in accountMap
+        """
+        if not self.accountMap:
+            return self
+        settings = self.accountMap.get(accountId)
+        if settings is None:
+            warnings.warn(f'IB account {accountId} is not in accountMap, skipping its statement')
+            return None
+        if isinstance(settings, str):
+            settings = {'Mainaccount': settings}
+        worker = copy.copy(self)
+        for key, val in settings.items():
+            setattr(worker, key, val)
+        return worker
+
+    def reportColumns(self):
+        # {report: columns} of the tables read from a statement
+        return dict(TABLE_COLUMNS, **(PRICE_TABLE_COLUMNS if self.priceEntries else {}))
+
+    def ProjectStatement(self, poi):
+        # DataFrames of the relevant items of a FlexStatement, only the columns the builders use
+        return {report: ProjectTable(getattr(poi, report), columns)
+                for report, columns in self.reportColumns().items()}
+
+    def StatementEntries(self, tabs, lotIndex=None):
+        # the transactions and balances of one FlexStatement, section by section
+        with phase('IBKRImporter.build.Trades') as record:
+            transactions = self.Trades(tabs['Trades'], lotIndex)
+            record['entries_out'] = len(transactions)
+        yield from transactions
+        with phase('IBKRImporter.build.CashTransactions') as record:
+            transactions = self.CashTransactions(tabs['CashTransactions'])
+            record['entries_out'] = len(transactions)
+        yield from transactions
+        with phase('IBKRImporter.balances') as record:
+            balances = self.Balances(tabs['CashReport'])
+            record['entries_out'] = len(balances)
+        yield from balances
 
     def CashTransactions(self, ct):
         """
@@ -202,8 +331,8 @@ class IBKRImporter(importer.ImporterProtocol):
         # Cash dividend is split from payment in lieu of a dividend.
         # Match them accordingly with the corresponding wht rows.
         # Make a copy of dataframe prior to append a column to avoid SettingWithCopyWarning
-        dist = ct[ct['type'].map(lambda t: t == CashAction.DIVIDEND
-                                or t == CashAction.PAYMENTINLIEU)].copy()   # dividends only (both cash and payment in lieu of d.)
+        dist = ct[ct['type'].isin([CashAction.DIVIDEND,
+                                   CashAction.PAYMENTINLIEU])].copy()   # dividends only (both cash and payment in lieu of d.)
         
          # special swiss thing that looks like a dividend but legally isnt
         dist["roc"] = dist.description.str.contains(self.roc_str)
@@ -238,8 +367,8 @@ class IBKRImporter(importer.ImporterProtocol):
         else:
             deps = []
 
-        int_ = ct[ct['type'].map(lambda t: t == CashAction.BROKERINTRCVD
-                                 or t == CashAction.BROKERINTPAID)]     # interest only
+        int_ = ct[ct['type'].isin([CashAction.BROKERINTRCVD,
+                                   CashAction.BROKERINTPAID])]     # interest only
         if len(int_) > 0:
             ints = self.Interest(int_)
         else:
@@ -415,21 +544,26 @@ class IBKRImporter(importer.ImporterProtocol):
                                  ))
         return depTransactions
 
-    def Trades(self, tr):
+    def Trades(self, tr, lotIndex=None):
         """
         This function turns the IBKR Trades table into beancount transactions
         for Trades
         arg tr: pandas DataFrame with the according data
+        arg lotIndex: optional util.LotIndex of the existing entries, see Panic
         returns: list of Beancount transactions 
         """
         if len(tr) == 0:  # catch the case of no transactions
             return []
+        if self.collapseTradeSplits:
+            tr = CollapseTradeSplits(tr)
+        # a plain bool mask: on the symbol categoricals, apply maps the categories
+        forex = tr['symbol'].astype(object).map(isForex).astype(bool).values
         # forex transactions
-        fx = tr[tr['symbol'].apply(isForex)]
+        fx = tr[forex]
         # Stocks transactions
-        stocks = tr[~tr['symbol'].apply(isForex)]
+        stocks = tr[~forex]
 
-        trTransactions = self.Forex(fx) + self.Stocktrades(stocks)
+        trTransactions = self.Forex(fx) + self.Stocktrades(stocks, lotIndex)
 
         return trTransactions
 
@@ -481,7 +615,7 @@ class IBKRImporter(importer.ImporterProtocol):
                                  ))
         return fxTransactions
 
-    def Stocktrades(self, stocks):
+    def Stocktrades(self, stocks, lotIndex=None):
         # return the stocks transactions
 
         stocktrades = stocks[stocks['levelOfDetail']
@@ -493,7 +627,7 @@ class IBKRImporter(importer.ImporterProtocol):
         # closed lots; keep index to match with sales
         lots = stocks[stocks['levelOfDetail'] == 'CLOSED_LOT']
 
-        stockTransactions = self.Panic(sale, lots) + self.Shopping(buy)
+        stockTransactions = self.Panic(sale, lots, lotIndex) + self.Shopping(buy)
 
         return stockTransactions
 
@@ -547,8 +681,12 @@ class IBKRImporter(importer.ImporterProtocol):
                                  ))
         return Shoppingbag
 
-    def Panic(self, sale, lots):
+    def Panic(self, sale, lots, lotIndex=None):
         # OMG, IT is happening!!
+        # with a lotIndex of the existing entries, closed lots are booked at the
+        # cost the ledger holds them at, and the part of a sale without closed
+        # lot rows (e.g. lots bought before the statement period) from the
+        # oldest lots in the ledger
 
         Doom = []
         for idx, row in sale.iterrows():
@@ -588,6 +726,12 @@ class IBKRImporter(importer.ImporterProtocol):
                     date=clo['openDateTime'].date(),
                     label=None,
                     merge=False)
+                if lotIndex is not None:
+                    held = lotIndex.find(self.getAssetAccount(symbol), self.mapSymbol(clo['symbol']),
+                                         cost.date, clo['quantity'], clo['tradePrice'])
+                    if held is not None:
+                        cost = position.CostSpec(held.number, None, held.currency,
+                                                 held.date, None, False)
 
                 lotpostings.append(data.Posting(self.getAssetAccount(symbol),
                                                 amount.Amount(-clo['quantity'], clo['symbol']), cost, price, None, None))
@@ -597,6 +741,15 @@ class IBKRImporter(importer.ImporterProtocol):
                     # all lots found for this sell transaction
                     break
 
+            if lotIndex is not None and sum_lots_quantity < -row['quantity']:
+                for held, units in lotIndex.take(self.getAssetAccount(symbol), self.mapSymbol(symbol),
+                                                 -row['quantity'] - sum_lots_quantity):
+                    sum_lots_quantity += units
+                    cost = position.CostSpec(held.number, None, held.currency, held.date, None, False)
+                    lotpostings.append(data.Posting(self.getAssetAccount(symbol),
+                                                    amount.Amount(-units, self.mapSymbol(symbol)),
+                                                    cost, price, None, None))
+
             if sum_lots_quantity != -row['quantity']:
                 warnings.warn(f"Lots matching failure: sell index={idx}")
 
@@ -655,14 +808,145 @@ class IBKRImporter(importer.ImporterProtocol):
                 None))
         return crTransactions
 
+    def Prices(self, op, rates, existing_entries=None):
+        """
+        This function turns the mark prices of the open positions and the
+        currency conversion rates of the statement into beancount Price entries,
+        one per date, commodity and quote currency. prices already in
+        existing_entries and duplicates within the statement are left out.
+        arg op, rates: pandas DataFrames of OpenPositions and ConversionRates
+        returns: list of beancount Price entries
+        """
+        known = {(entry.date, entry.currency, entry.amount.currency)
+                 for entry in existing_entries or []
+                 if isinstance(entry, data.Price)}
+
+        # date, commodity, quote currency, price
+        marks = op[op['markPrice'].notnull()
+                   & ~op['symbol'].astype(str).map(isForex)]
+        marks = pd.DataFrame({'date': marks['reportDate'].values,
+                              'commodity': marks['symbol'].astype(str).map(self.mapSymbol).values,
+                              'quote': marks['currency'].astype(str).values,
+                              'number': marks['markPrice'].values})
+        fx = pd.DataFrame({'date': rates['reportDate'].values,
+                           'commodity': rates['fromCurrency'].astype(str).values,
+                           'quote': rates['toCurrency'].astype(str).values,
+                           'number': rates['rate'].values})
+        # IB reports unavailable rates as -1
+        fx = fx[(fx['commodity'] != fx['quote'])
+                & fx['number'].map(lambda rate: rate is not None and rate > 0)]
+        candidates = pd.concat([marks, fx])
+        candidates = candidates.drop_duplicates(['date', 'commodity', 'quote'])
+
+        priceEntries = []
+        for date, commodity, quote, number in zip(candidates['date'], candidates['commodity'],
+                                                  candidates['quote'], candidates['number']):
+            if (date, commodity, quote) in known:
+                continue
+            priceEntries.append(data.Price(data.new_metadata('price', 0),
+                                           date,
+                                           commodity,
+                                           amount.Amount(number, quote)))
+        return priceEntries
+
+
+# the columns of the FlexQuery tables the builders use, see ProjectTable.
+# all other attributes of the ibflex objects are never looked at
+TABLE_COLUMNS = {
+    'Trades': ['symbol', 'description', 'currency', 'buySell', 'levelOfDetail',
+               'ibOrderID', 'tradeDate', 'dateTime', 'openDateTime', 'quantity',
+               'tradePrice', 'proceeds', 'ibCommission', 'ibCommissionCurrency',
+               'netCash', 'tradeMoney', 'cost', 'fifoPnlRealized', 'taxes'],
+    'CashTransactions': ['type', 'symbol', 'description', 'currency', 'amount',
+                         'reportDate'],
+    'CashReport': ['currency', 'endingCash', 'toDate'],
+}
+# read only with priceEntries, see IBKRImporter.Prices
+PRICE_TABLE_COLUMNS = {
+    'OpenPositions': ['symbol', 'currency', 'markPrice', 'reportDate'],
+    'ConversionRates': ['reportDate', 'fromCurrency', 'toCurrency', 'rate'],
+}
+# few distinct values, stored as pandas categoricals
+CATEGORICAL_COLUMNS = {'symbol', 'currency', 'ibCommissionCurrency', 'buySell',
+                       'levelOfDetail', 'type', 'fromCurrency', 'toCurrency'}
+
+
+def ProjectTable(entries, columns, optional=()):
+    """
+    This function turns a list of ibflex objects into a DataFrame with just the
+    given columns, read column by column. repeated values become categoricals,
+    the rest keeps its python objects (Decimal, date, enums).
+    A column the objects don't have raises an AttributeError, unless it is one
+    of the optional columns, which are None then.
+    """
+    for entry in {type(entry): entry for entry in entries}.values():
+        missing = [col for col in columns
+                   if col not in optional and not hasattr(entry, col)]
+        if missing:
+            raise AttributeError(f"{type(entry).__name__} has no column(s) {missing}")
+    table = {}
+    for col in columns:
+        # an object array up front spares pandas the conversion of a list
+        values = np.fromiter((getattr(entry, col, None) for entry in entries),
+                             dtype=object, count=len(entries))
+        table[col] = pd.Categorical(values) if col in CATEGORICAL_COLUMNS else values
+    return pd.DataFrame(table, columns=columns)
+
+
+# executions that agree in these columns are parts of the same order
+SPLIT_KEYS = ['ibOrderID', 'tradeDate', 'symbol', 'buySell', 'tradePrice',
+              'currency', 'ibCommissionCurrency']
+# columns added up over the parts of an order
+SPLIT_SUMS = ['quantity', 'proceeds', 'ibCommission', 'netCash', 'tradeMoney',
+              'cost', 'fifoPnlRealized', 'taxes']
+
 
 def CollapseTradeSplits(tr):
-    # to be implemented
     """
-    This function collapses two trades into once if they have same date,symbol
-    and trade price. IB sometimes splits up trades.
+    This function collapses trades into one if they have same order, date, symbol
+    and trade price. IB sometimes splits up trades into many partial executions.
+    Quantity, proceeds, commission and the other amounts are summed up, the
+    other columns are those of the first execution. The closed lots of all
+    parts of a sale are moved right behind the collapsed sale, where Panic
+    looks for them.
+    arg tr: pandas DataFrame of the IBKR Trades table
+    returns: the collapsed DataFrame, with a fresh index
     """
-    pass
+    if len(tr) == 0:
+        return tr
+    tr = tr.reset_index(drop=True)
+    is_execution = tr['levelOfDetail'] == 'EXECUTION'
+    executions = tr[is_execution]
+    keys = [key for key in SPLIT_KEYS if key in tr]
+
+    # first execution of each order, and the execution every row belongs to:
+    # closed lots follow the sale they close
+    leader = executions.index.to_series().groupby(
+        [executions[key] for key in keys], sort=False, dropna=False,
+        observed=True).transform('min')
+    parent = pd.Series(tr.index.where(is_execution), index=tr.index).ffill()
+    parent = parent.fillna(pd.Series(tr.index, index=tr.index)).astype(int)
+    order = leader.reindex(parent.values).fillna(parent).astype(int).values
+
+    # the first execution of each order as it is, nulls included, with the
+    # quantities and amounts of all its executions added up. null if they
+    # are null in all of them
+    leaders = pd.unique(leader.values)
+    collapsed = executions.loc[leaders].copy()
+    sums = [col for col in SPLIT_SUMS if col in tr]
+    collapsed[sums] = executions[sums].groupby(leader.values, sort=False).sum(
+        min_count=1).loc[leaders].values
+    collapsed['__order__'] = collapsed.index
+    collapsed['__lot__'] = 0
+
+    others = tr[~is_execution].copy()
+    others['__order__'] = order[~is_execution.values]
+    others['__lot__'] = 1
+
+    result = pd.concat([collapsed, others])
+    result['__row__'] = result.index
+    result = result.sort_values(['__order__', '__lot__', '__row__'], kind='stable')
+    return result.drop(columns=['__order__', '__lot__', '__row__'])[tr.columns].reset_index(drop=True)
 
 
 def isForex(symbol):
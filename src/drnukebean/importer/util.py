@@ -1,11 +1,330 @@
 #! python
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from collections.abc import MutableMapping
+
+import codecs
+import datetime
+import functools
+import mmap
+import os
 import re
+import threading
+import warnings
+
+from beancount.core import data, position
 
 # a collection of commonly used functions
 
+# rows the streaming importers parse and build at a time, see PFGImporter.iter_extract
+BATCH_ROWS = 1000
+
+
 def remove_spaces(s):
     # removes leading and trailing spaces, and collapses multiple space
     # characters into one space character. 
     # i.e. " Hello   this is      my   ledger  " -> "Hello this is my ledger"
     # used to combat bloated bank statement strings (payyee & narration)
-    return re.sub(' +', ' ', s.strip())
\ No newline at end of file
+    return re.sub(' +', ' ', s.strip())
+
+
+def currency_accounts(account, currency):
+    """
+    {currency: account} of an importer's account argument, which is either
+    a single account for statements in currency, or already a dict of the
+    accounts per statement currency
+    """
+    if isinstance(account, dict):
+        return dict(account)
+    return {currency: account}
+
+
+class RawTxn(MutableMapping):
+    """
+    the intermediate record of one statement row, before it becomes a
+    data.Transaction. it is what the importers hand to their manual_fixes hook.
+
+    fields: date, flag, payee, narration, account, amount, meta, postings,
+    tags, links. they can be read and assigned as attributes (txn.narration)
+    or, like the dicts older fix functions expect, by key (txn['narration']),
+    with the usual mapping methods (get, in, keys, items, update, ...).
+    new fields can't be added, unknown keys raise a KeyError, and fields
+    can't be deleted.
+
+    a fix function may modify the record in place and return it (or None),
+    or return a new one (a dict with the same keys is accepted too).
+    """
+    __slots__ = ('date', 'flag', 'payee', 'narration', 'account', 'amount',
+                 'meta', 'postings', 'tags', 'links')
+
+    def __init__(self, date, flag, narration, account, amount, meta,
+                 payee='', postings=None, tags=data.EMPTY_SET, links=data.EMPTY_SET):
+        self.date = date
+        self.flag = flag
+        self.payee = payee
+        self.narration = narration
+        self.account = account
+        self.amount = amount
+        self.meta = meta
+        if postings is None:
+            # the default single leg, balanced by the user or the smart importer
+            postings = [data.Posting(account, amount, None, None, None, None)]
+        self.postings = postings
+        self.tags = tags
+        self.links = links
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError(f"RawTxn fields can't be deleted: {key}")
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{key}={getattr(self, key)!r}" for key in self.__slots__)
+        return f"RawTxn({fields})"
+
+    def add_posting(self, account, units=None, cost=None, price=None, flag=None, meta=None):
+        # e.g. the counter leg: txn.add_posting('Expenses:Food', -txn.amount)
+        self.postings.append(data.Posting(account, units, cost, price, flag, meta))
+
+    def to_transaction(self):
+        return data.Transaction(self.meta,
+                                self.date,
+                                self.flag,
+                                remove_spaces(self.payee),
+                                remove_spaces(self.narration),
+                                self.tags,
+                                self.links,
+                                self.postings)
+
+
+def apply_fixes(txn, manual_fixes):
+    # run the user's manual_fixes hook on a RawTxn, see RawTxn for the contract
+    if manual_fixes is None:
+        return txn
+    fixed = manual_fixes(txn)
+    if fixed is None:
+        return txn
+    if isinstance(fixed, dict):
+        # fix functions written for the former dict records, which may carry
+        # keys of their own
+        unknown = set(fixed).difference(RawTxn.__slots__)
+        if unknown:
+            warnings.warn(f"manual_fixes returned unknown keys, ignored: {sorted(unknown)}")
+        return RawTxn(**{key: value for key, value in fixed.items() if key not in unknown})
+    return fixed
+
+
+class MappedStatement:
+    """
+    a read-only memory map of a (csv) statement file. lines are located by
+    byte offset on demand and only decoded when they are read, so identify
+    can check the header block without reading a multi-year export, and
+    extract can run its csv reader over the same mapping.
+
+    the file is mapped while the statement is used as context manager, so
+    that it is never held open beyond an identify or extract call (an open
+    mapping keeps the file from being moved on windows). the offsets of the
+    lines located so far are kept for the next call.
+
+    the encoding has to be ascii compatible (utf-8, latin-1, cp1252, ...),
+    as lines are split on the newline byte.
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = codecs.lookup(encoding).name
+        # like text mode, skip the byte order mark
+        self._skip_bom = self.encoding == 'utf-8-sig'
+        if self._skip_bom:
+            self.encoding = 'utf-8'
+        self._map = None
+        self._users = 0
+        self._lock = threading.Lock()
+        self._offsets = None  # start offsets of the lines located so far
+
+    def __enter__(self):
+        with self._lock:
+            if not self._users:
+                self._open()
+            self._users += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._users -= 1
+            if not self._users:
+                self.close()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # an empty file can't be mapped
+                self._map = b''
+        if self._offsets is None:
+            start = 0
+            if self._skip_bom and self._map[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+                start = len(codecs.BOM_UTF8)
+            self._offsets = [start]
+
+    def __len__(self):
+        return len(self._map)
+
+    def _locate(self, index):
+        # extend the offsets until line index is located, False past the end
+        size = len(self._map)
+        while len(self._offsets) <= index + 1:
+            start = self._offsets[-1]
+            if start >= size:
+                return False
+            end = self._map.find(b'\n', start)
+            self._offsets.append(size if end < 0 else end + 1)
+        return self._offsets[index] < size
+
+    def offset(self, index):
+        # byte offset of line index, None past the end
+        return self._offsets[index] if self._locate(index) else None
+
+    def line(self, index):
+        # line index decoded, without line terminator. None past the end
+        if not self._locate(index):
+            return None
+        raw = self._map[self._offsets[index]:self._offsets[index + 1]]
+        return raw.decode(self.encoding).rstrip('\r\n')
+
+    def lines(self, start=0):
+        # lazily decoded lines from line start on, e.g. for csv.reader.
+        # scans the mapping directly, the offsets are only kept for line()
+        pos = self.offset(start)
+        if pos is None:
+            return
+        data_, find, encoding = self._map, self._map.find, self.encoding
+        size = len(data_)
+        while pos < size:
+            end = find(b'\n', pos) + 1 or size
+            yield data_[pos:end].decode(encoding).rstrip('\r\n')
+            pos = end
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._map = None
+
+
+def mapped_statement(path, encoding='utf-8'):
+    """
+    the MappedStatement of path, shared between the identify, file_date and
+    extract calls on the same file. a changed file is mapped anew. use it as
+    context manager, which maps the file for the duration of the block:
+
+      with mapped_statement(file_.name, encoding) as statement:
+          header = statement.line(0)
+    """
+    stat = os.stat(path)
+    return _mapped_statement(path, encoding, stat.st_mtime_ns, stat.st_size)
+
+
+# the statements only hold their line offsets between the calls, not the mapping
+@functools.lru_cache(maxsize=16)
+def _mapped_statement(path, encoding, mtime, size):
+    return MappedStatement(path, encoding)
+
+
+class LotIndex:
+    """
+    the lots held at cost in the existing entries, per (account, commodity)
+    sorted by acquisition date. built by adding up the booked postings of the
+    ledger, without a realization pass.
+
+    find() looks up the lots of an acquisition date by bisection, take()
+    hands out the oldest lots first. both take the returned units off the
+    index, so that the sales of one statement don't close the same units twice.
+    """
+
+    def __init__(self, entries=None, accounts=None):
+        # accounts: optional account or tuple of accounts to index, with their subaccounts
+        if isinstance(accounts, str):
+            accounts = (accounts,)
+        prefixes = tuple(account + ':' for account in accounts or ())
+        held = defaultdict(int)  # (account, commodity, Cost) -> units
+        for entry in entries or ():
+            if not isinstance(entry, data.Transaction):
+                continue
+            for posting in entry.postings:
+                # unbooked postings still carry a CostSpec
+                if not isinstance(posting.cost, position.Cost) or posting.units is None:
+                    continue
+                if accounts and not (posting.account in accounts
+                                     or posting.account.startswith(prefixes)):
+                    continue
+                held[(posting.account, posting.units.currency, posting.cost)] += posting.units.number
+
+        self._lots = defaultdict(list)  # (account, commodity) -> [[date, Cost, units]]
+        for (account, commodity, cost), units in held.items():
+            if units > 0:
+                self._lots[(account, commodity)].append(
+                    [cost.date or datetime.date.min, cost, units])
+        self._dates = {}
+        self._first = {}  # index of the oldest lot with units left
+        for key, lots in self._lots.items():
+            lots.sort(key=lambda lot: (lot[0], lot[1].number))
+            self._dates[key] = [lot[0] for lot in lots]
+            self._first[key] = 0
+
+    def __len__(self):
+        return sum(len(lots) for lots in self._lots.values())
+
+    def find(self, account, commodity, date, units, number=None):
+        """
+        the Cost of a lot acquired on date with at least units left, the one
+        closest to the cost number if given. None if there is none
+        """
+        key = (account, commodity)
+        if key not in self._lots:
+            return None
+        dates = self._dates[key]
+        lots = self._lots[key][bisect_left(dates, date):bisect_right(dates, date)]
+        lots = [lot for lot in lots if lot[2] >= units]
+        if not lots:
+            return None
+        lot = lots[0] if number is None else min(lots, key=lambda lot: abs(lot[1].number - number))
+        lot[2] -= units
+        return lot[1]
+
+    def take(self, account, commodity, units):
+        """
+        [(Cost, units)] of the oldest lots making up units, fewer if the
+        ledger doesn't hold enough
+        """
+        key = (account, commodity)
+        if key not in self._lots:
+            return []
+        lots = self._lots[key]
+        taken = []
+        i = self._first[key]
+        while units > 0 and i < len(lots):
+            lot = lots[i]
+            if lot[2] > 0:
+                n = min(units, lot[2])
+                lot[2] -= n
+                units -= n
+                taken.append((lot[1], n))
+            if lot[2] <= 0 and i == self._first[key]:
+                self._first[key] = i + 1
+            i += 1
+        return taken
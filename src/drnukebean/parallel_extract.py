@@ -0,0 +1,227 @@
+"""
+A parallel drop-in for bean-extract.
+
+beancount's ingest loop identifies and extracts one file after the other. This
+driver identifies all files in threads, with one cached file memo per file
+shared by all importers, runs the extractions in a process pool and the
+network bound ones (IBKR flex queries) in threads, and then writes the output
+exactly like bean-extract: one section per file, in the order the files were
+given, entries sorted and checked for duplicates.
+
+  python -m drnukebean.parallel_extract config.py ~/Downloads -e main.bean
+  python -m drnukebean.parallel_extract config.py statements/ -j 8 > new.bean
+
+config.py is a regular bean-extract config with a CONFIG list of importers.
+Worker processes are forked, so importers and the existing ledger are
+inherited instead of pickled, and fix functions defined in the config work as
+usual. Where fork is not available, or with a single job, all extractions run
+in threads, and the files of one importer one after the other.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import argparse
+import logging
+import multiprocessing
+import os
+import runpy
+import sys
+import threading
+
+from beancount import loader
+from beancount.core import data
+from beancount.ingest import cache, identify
+from beancount.ingest import extract as ingest_extract
+from beancount.utils import file_utils
+
+from drnukebean.importer.ibkr import IBKRImporter
+
+# importers whose extract mostly waits on the network, run in threads
+THREADED_IMPORTERS = (IBKRImporter,)
+
+# state inherited by the forked workers, see _extract_in_worker
+_worker_state = {}
+
+
+def find_imports(importers, files_or_directories, max_workers=None):
+    """
+    [(filename, [matching importers])] for all files, in the order of
+    beancount's file walk. files without a matching importer are left out.
+    """
+    # the file memo cache only accepts absolute paths
+    filenames = list(file_utils.find_files([os.path.abspath(path)
+                                            for path in files_or_directories]))
+
+    def identify_file(filename):
+        file_ = cache.get_file(filename)
+        matching = []
+        for importer in importers:
+            try:
+                if importer.identify(file_):
+                    matching.append(importer)
+            except Exception as exc:
+                logging.exception("Importer %s.identify() raised an unexpected error: %s",
+                                  importer.name(), exc)
+        return filename, matching
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        return [(filename, matching)
+                for filename, matching in pool.map(identify_file, filenames)
+                if matching]
+
+
+def _extract(filename, importer, existing_entries, min_date, allow_none):
+    return ingest_extract.extract_from_file(
+        filename, importer,
+        existing_entries=existing_entries,
+        min_date=min_date,
+        allow_none_for_tags_and_links=allow_none)
+
+
+def _extract_locked(lock, filename, importer, *args):
+    # importers keep per-file state on themselves (e.g. FinPensionImporter's
+    # accounts), so the thread jobs of one importer run one after the other
+    with lock:
+        return _extract(filename, importer, *args)
+
+
+def _extract_in_worker(filename, importer_index):
+    # runs in a forked process; only the index and the entries are pickled
+    state = _worker_state
+    return _extract(filename, state['importers'][importer_index],
+                    state['existing_entries'], state['min_date'], state['allow_none'])
+
+
+def _process_pool(max_workers):
+    # shipping the entries back from a worker costs about as much as building
+    # them, so a single worker, or a single CPU, doesn't pay off
+    if min(max_workers or os.cpu_count() or 1, os.cpu_count() or 1) < 2:
+        return None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('fork'))
+
+
+def extract_files(importers, files_or_directories,
+                  existing_entries=None,
+                  options_map=None,
+                  min_date=None,
+                  max_workers=None,
+                  threaded=THREADED_IMPORTERS):
+    """
+    identify and extract all files in parallel.
+    returns [(filename, entries)] in the order of the files, as the hooks of
+    bean-extract expect it. a failing importer is logged and skipped, like
+    bean-extract does.
+    """
+    allow_none = bool(options_map and options_map["allow_deprecated_none_for_tags_and_links"])
+    jobs = [(filename, importer)
+            for filename, matching in find_imports(importers, files_or_directories, max_workers)
+            for importer in matching]
+    if not jobs:
+        return []
+
+    importers = list(importers)
+    _worker_state.update(importers=importers,
+                         existing_entries=existing_entries,
+                         min_date=min_date,
+                         allow_none=allow_none)
+    processes = _process_pool(max_workers)
+    locks = {id(importer): threading.Lock() for importer in importers}
+    futures = {}
+    try:
+        with ThreadPoolExecutor(max_workers) as threads:
+            # the process jobs go first, so the workers are forked before any
+            # extraction thread runs
+            for job, (filename, importer) in enumerate(jobs):
+                if processes is not None and not isinstance(importer, tuple(threaded)):
+                    futures[job] = processes.submit(_extract_in_worker, filename,
+                                                    importers.index(importer))
+            for job, (filename, importer) in enumerate(jobs):
+                if job not in futures:
+                    futures[job] = threads.submit(_extract_locked, locks[id(importer)],
+                                                  filename, importer,
+                                                  existing_entries, min_date, allow_none)
+
+            new_entries_list = []
+            for job, (filename, importer) in enumerate(jobs):
+                try:
+                    new_entries_list.append((filename, futures[job].result()))
+                except Exception as exc:
+                    logging.exception("Importer %s.extract() raised an unexpected error: %s",
+                                      importer.name(), exc)
+    finally:
+        if processes is not None:
+            processes.shutdown()
+        _worker_state.clear()
+    return new_entries_list
+
+
+def extract_entries(importers, files_or_directories, **kwargs):
+    # all extracted entries of all files merged into one sorted list
+    entries = [entry
+               for _, new_entries in extract_files(importers, files_or_directories, **kwargs)
+               for entry in new_entries]
+    entries.sort(key=data.entry_sortkey)
+    return entries
+
+
+def extract(importers, files_or_directories, output,
+            entries=None,
+            options_map=None,
+            mindate=None,
+            ascending=True,
+            hooks=None,
+            max_workers=None):
+    """
+    the parallel counterpart of beancount.ingest.extract.extract, with the
+    same arguments and output
+    """
+    new_entries_list = extract_files(importers, files_or_directories,
+                                     existing_entries=entries,
+                                     options_map=options_map,
+                                     min_date=mindate,
+                                     max_workers=max_workers)
+    if hooks is None:
+        hooks = [ingest_extract.find_duplicate_entries]
+    for hook_fn in hooks:
+        new_entries_list = hook_fn(new_entries_list, entries)
+
+    output.write(ingest_extract.HEADER)
+    for key, new_entries in new_entries_list:
+        output.write(identify.SECTION.format(key))
+        output.write('\n')
+        if not ascending:
+            new_entries.reverse()
+        ingest_extract.print_extracted_entries(new_entries, output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config', help='bean-extract config file with a CONFIG list of importers')
+    parser.add_argument('files_or_directories', nargs='+')
+    parser.add_argument('-e', '-f', '--existing', metavar='BEANCOUNT_FILE', default=None,
+                        help='Beancount file or existing entries for de-duplication (optional)')
+    parser.add_argument('-r', '--reverse', '--descending', action='store_const',
+                        dest='ascending', default=True, const=False,
+                        help='Write out the entries in descending order')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes and threads')
+    args = parser.parse_args(argv)
+
+    importers = runpy.run_path(args.config)['CONFIG']
+    if args.existing:
+        entries, _, options_map = loader.load_file(args.existing)
+    else:
+        entries, options_map = None, None
+
+    extract(importers, args.files_or_directories, sys.stdout,
+            entries=entries,
+            options_map=options_map,
+            ascending=args.ascending,
+            max_workers=args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
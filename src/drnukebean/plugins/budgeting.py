@@ -14,12 +14,15 @@ import datetime
 import pandas as pd
 from copy import deepcopy
 
+from drnukebean.profiling import profile_plugin
+
 
 __plugins__ = ['budgeting']
 
 NOW = datetime.datetime.now()
 
 
+@profile_plugin
 def budgeting(entries, options_map, config_str):
     new_entries = []
     errors = []
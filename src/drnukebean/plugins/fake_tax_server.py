@@ -0,0 +1,132 @@
+"""
+A local stand-in for the ZH tax calculator web service (webcalc.services.zh.ch)
+used by the tax_forecast plugin, to test and benchmark the plugin offline.
+
+It answers the cantonal (INCOME_ASSETS) and federal (FEDERAL) endpoints with
+responses of the same shape as the real service, computed from flat rates.
+The numbers are made up, only the shape and the latency matter.
+
+run it standalone with
+python -m drnukebean.plugins.fake_tax_server --port 8080 --latency 0.2
+
+and point the plugin to it with the config keys
+"api_host": "localhost:8080", "api_https": False
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import argparse
+import json
+import threading
+import time
+
+from drnukebean.plugins.tax_tables import URL_STAAT, URL_BUND
+
+# flat rates of the fake tariff
+RATE_CANTONAL = 0.05
+RATE_MUNICIPAL = 0.06
+RATE_ASSETS = 0.001
+RATE_FEDERAL = 0.03
+PERSONAL_TAX = 24
+
+
+def calculate_staat(payload):
+    income = float(payload.get("taxableIncome") or 0)
+    assets = float(payload.get("taxableAssets") or 0)
+    return {"cantonalBaseTax": {"value": round(income * RATE_CANTONAL, 2)},
+            "municipalityTax": {"value": round(income * RATE_MUNICIPAL, 2)},
+            "personalTax": {"value": PERSONAL_TAX},
+            "assetsTax": {"value": round(assets * RATE_ASSETS, 2)}}
+
+
+def calculate_bund(payload):
+    income = float(payload.get("taxableIncome") or 0)
+    return {"totalFederalTax": {"value": round(income * RATE_FEDERAL, 2)}}
+
+
+class FakeTaxCalculatorHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests, like the real service
+    protocol_version = "HTTP/1.1"
+    calculators = {URL_STAAT: calculate_staat,
+                   URL_BUND: calculate_bund}
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        calculator = self.calculators.get(self.path)
+        if calculator is None:
+            self.respond(404, {"error": f"unknown calculator {self.path}"})
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.respond(400, {"error": "invalid json"})
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.failures > 0
+            self.server.failures -= failing
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if failing:
+            self.respond(503, {"error": "service unavailable"})
+            return
+        self.respond(200, calculator(payload))
+
+    def respond(self, status, answer):
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep the test & benchmark output clean
+        pass
+
+
+def make_server(host="127.0.0.1", port=0, latency=0.0):
+    # port 0 picks a free port, see server.server_address.
+    # server.requests and server.connections count the answered requests and
+    # the connections opened, set server.failures to answer that many of the
+    # next requests with a 503
+    server = ThreadingHTTPServer((host, port), FakeTaxCalculatorHandler)
+    server.latency = latency
+    server.requests = 0
+    server.connections = 0
+    server.failures = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def serve_in_background(host="127.0.0.1", port=0, latency=0.0):
+    # starts the server in a daemon thread, stop it with server.shutdown()
+    server = make_server(host, port, latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds to wait before answering a request")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency)
+    print(f"fake tax calculator listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
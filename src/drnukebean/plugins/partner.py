@@ -18,10 +18,13 @@ import datetime
 import pandas as pd
 from copy import deepcopy
 
+from drnukebean.profiling import profile_plugin
+
 
 __plugins__ = ['partner']
 
 
+@profile_plugin
 def partner(entries, options_map):
     return_entries = []
     errors = []
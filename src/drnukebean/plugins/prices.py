@@ -0,0 +1,94 @@
+"""
+A price lookup for beancount plugins.
+
+Collects all Price directives of a ledger once, sorted per commodity, so that
+plugins can query the price known at an arbitrary date with a binary search
+instead of scanning all entries again:
+
+    index = PriceIndex(entries)
+    rate = index.nearest('USD', datetime.date(2022, 12, 31), 'CHF')
+
+this is not a plugin itself, but a helper to be imported by other plugins.
+"""
+
+from beancount.core import data
+
+from bisect import bisect_right
+from collections import defaultdict
+
+
+class PriceIndex:
+    """
+    Per-commodity sorted price history, built in a single pass over the entries.
+    Prices are indexed both per commodity and per (commodity, quote currency).
+    """
+
+    def __init__(self, entries):
+        collected = defaultdict(list)
+        for entry in entries:
+            if isinstance(entry, data.Price):
+                record = (entry.date.toordinal(), entry.amount.number)
+                collected[(entry.currency, None)].append(record)
+                collected[(entry.currency, entry.amount.currency)].append(record)
+
+        # dates and values as separate, sorted arrays for bisecting
+        self._dates = {}
+        self._values = {}
+        for key, records in collected.items():
+            # stable sort: among prices of the same date, the first one wins
+            records.sort(key=lambda record: record[0])
+            dates, values = [], []
+            for day, value in records:
+                if not dates or dates[-1] != day:
+                    dates.append(day)
+                    values.append(value)
+            self._dates[key] = dates
+            self._values[key] = values
+
+    def __contains__(self, currency):
+        return (currency, None) in self._dates
+
+    def currencies(self):
+        return {currency for currency, quote in self._dates if quote is None}
+
+    def nearest(self, currency, date, quote_currency=None):
+        # returns the last price on or before date, like beancount's price
+        # database does, so that a conversion never uses a rate from after the
+        # transaction. only before the first price, the first one is used.
+        # None if there are no prices for the currency
+        key = (currency, quote_currency)
+        if key not in self._dates:
+            return None
+        idx = bisect_right(self._dates[key], date.toordinal())
+        return self._values[key][max(idx - 1, 0)]
+
+    def latest(self, currency, date, quote_currency=None):
+        # returns the last known price on or before date, None if there is none
+        key = (currency, quote_currency)
+        if key not in self._dates:
+            return None
+        idx = bisect_right(self._dates[key], date.toordinal())
+        if idx == 0:
+            return None
+        return self._values[key][idx - 1]
+
+    def quotes(self, currency):
+        # the currencies the prices of currency are quoted in
+        return {quote for commodity, quote in self._dates
+                if commodity == currency and quote is not None}
+
+    def convert(self, number, currency, quote_currency, date):
+        # converts number of currency to quote_currency using the nearest price,
+        # via one intermediate currency if there is no direct price,
+        # e.g. a stock priced in USD to CHF
+        if currency == quote_currency:
+            return number
+        price = self.nearest(currency, date, quote_currency)
+        if price is not None:
+            return number * price
+        for quote in sorted(self.quotes(currency)):
+            fx_rate = self.nearest(quote, date, quote_currency)
+            if fx_rate is not None:
+                return number * self.nearest(currency, date, quote) * fx_rate
+        raise KeyError(
+            f"no price found to convert {currency} to {quote_currency}")
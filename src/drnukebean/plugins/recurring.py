@@ -28,9 +28,13 @@ import pandas as pd
 import io
 from contextlib import redirect_stdout
 
+from drnukebean.profiling import profile_plugin
+
+
 __plugins__ = ['recurring']
 
 
+@profile_plugin
 def recurring(entries, options_map, config_str):
     errors = []
     new_entries = []
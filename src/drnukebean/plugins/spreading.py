@@ -28,12 +28,15 @@ from beancount.parser import options
 import datetime
 import pandas as pd
 
+from drnukebean.profiling import profile_plugin
+
 
 __plugins__ = ['spreading']
 
 
 
 
+@profile_plugin
 def spreading(entries, options_map, config_str):
     new_entries = []
     errors = []
@@ -7,7 +7,41 @@ it uses a very messy config string like
 
 that can be generated with json.dumps(<config_dict>)
 
+the wealth tax is based on the year-end balances of the accounts matching
+"taxable_assets_accounts", valued in the operating currency with the ledger's prices.
+
 use the plugin in your ledger file like: plugin "drnukebean.plugins.tax_forecast" <config_string>
+
+api responses are cached in 'api_cache.sqlite' in the directory given by the
+optional "cache_dir" config key (default: the current working directory).
+"cache_retention_seconds" and "cache_max_entries" tune expiry and size of the cache.
+"api_host", "api_https", "api_timeout", "api_retries" and "api_backoff" control
+the connection to the tax calculator, see fake_tax_server for a local stand-in.
+
+what-if scenarios can be computed in the same run with the optional "scenarios"
+key, a list of dicts with a "name" and overrides of "municipality",
+"marial_srtatus", "n_children" and "api_year", plus either a fixed
+"taxable_income" or an "income_factor" on the projected income, e.g.
+
+"scenarios": [{"name": "married", "marial_srtatus": "married"}, {"name": "raise", "income_factor": 1.1}]
+
+all scenarios share the taxable income computed from the ledger, and their api
+queries are issued in parallel. by default the scenario results are logged as
+a summary table; with "scenario_output": "transactions" they are added as
+forecast transactions tagged #tax-scenario-<name>, booked to accounts of their
+own (<tax_expenses_main_account>:Scenario:<Name>:<kind> and
+<liability_account>:Scenario:<Name>) so they do not add up with the forecast.
+characters of the name not allowed in tags and accounts are replaced by "-".
+
+with "forecast_mode": "rolling" every month is forecast from the income up to
+that month, and its transaction books the difference to the taxes booked in the
+months before (a true-up) instead of the same annualized amount every month.
+the per-month incomes are cached by their postings and fx rates, so unchanged
+months are not converted again on reload.
+
+with "tax_engine": "local" the taxes are computed offline from the tariff tables
+in tax_tables instead of the web calculator, with "tax_engine": "fallback" only
+when the web calculator cannot be reached.
 """
 
 from beancount.core import data
@@ -15,30 +49,46 @@ from beancount.core.amount import Amount
 from beancount.core.data import Transaction
 from beancount.core.number import Decimal
 
-from beancount.query.query import run_query
-
 import datetime
+import hashlib
 import pandas as pd
 import json
 import re
 import http.client as httplib
 import traceback
-import pickle
 import os
-import hashlib
+import queue
+import sqlite3
 import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
+from drnukebean.plugins.prices import PriceIndex
+from drnukebean.plugins import tax_tables
+from drnukebean.plugins.tax_tables import URL_STAAT, URL_BUND
+from drnukebean.profiling import profile_plugin
+
 
 __plugins__ = ['tax_forecast']
 
-CACHE_FILENAME = 'api_cache.pkl'
+CACHE_FILENAME = 'api_cache.sqlite'
 CACHE_RETENTION_SECONDS = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 1000
+CACHE_LOCK_TIMEOUT = 30
+API_HOST = "webcalc.services.zh.ch"
+API_TIMEOUT = 10
+API_RETRIES = 2
+API_BACKOFF = 0.5
+API_MAX_WORKERS = 4
+MONTHLY_INCOME_KEY = "monthly_income"
 
 class APIError(Exception):
     pass
 
 
+@profile_plugin
 def tax_forecast(entries, options, config_str):
     try:
 
@@ -46,7 +96,6 @@ def tax_forecast(entries, options, config_str):
         config = eval(config_str, {}, {})
         today = datetime.datetime.today().date()
         year = config.get("year")
-        api_year = config.get("api_year")
 
         # get accounts (via open directives)
         accounts = {entry.account
@@ -59,84 +108,115 @@ def tax_forecast(entries, options, config_str):
         # from accounts, aggregate positions
         taxable_incomes = get_income_expenses_from_accounts(
             entries, options, config, taxable_accounts)
-        last_month_of_income = taxable_incomes.date.max().month
-        taxable_incomes_by_currency = taxable_incomes.groupby(
-            'currency').agg({'position': 'sum'}).reset_index()
-
-        # add fx info
-        taxable_incomes_by_currency = add_fx_info(entries,
-                                                  options,
-                                                  taxable_incomes_by_currency,
-                                                  today)
-
-        # aggregate and scale to 12 months
-        taxable_income = taxable_incomes_by_currency.in_base_curr.sum() / \
-            last_month_of_income*12
-
-        assets = 0
-        taxable_income_float = abs(float(taxable_income))
+        last_month_of_income = int(taxable_incomes.month.max())
+        price_index = PriceIndex(entries)
+        cache = ApiCache(config.get("cache_dir", "."),
+                         config.get("cache_retention_seconds",
+                                    CACHE_RETENTION_SECONDS),
+                         config.get("cache_max_entries", CACHE_MAX_ENTRIES))
+        rolling = config.get("forecast_mode") == "rolling"
+
+        if rolling:
+            # annualize the income up to every month, the latest one is the
+            # forecast's taxable income
+            monthly_incomes = get_monthly_incomes(options, config,
+                                                  taxable_incomes, today,
+                                                  price_index, cache)
+            annualized_incomes = []
+            cumulative_income = 0
+            for month in range(1, last_month_of_income + 1):
+                cumulative_income += monthly_incomes.get(month, 0)
+                annualized_incomes.append(
+                    abs(float(cumulative_income / month * 12)))
+            taxable_income_float = annualized_incomes[-1]
+        else:
+            taxable_incomes_by_currency = taxable_incomes.groupby(
+                'currency').agg({'position': 'sum'}).reset_index()
+
+            # add fx info
+            taxable_incomes_by_currency = add_fx_info(entries,
+                                                      options,
+                                                      taxable_incomes_by_currency,
+                                                      today,
+                                                      price_index)
+
+            # aggregate and scale to 12 months
+            taxable_income = taxable_incomes_by_currency.in_base_curr.sum() / \
+                last_month_of_income*12
+            taxable_income_float = abs(float(taxable_income))
+            annualized_incomes = [taxable_income_float]
+
+        assets = get_taxable_assets(entries, options, config, asset_accounts,
+                                    price_index)
         witholding = 0
-        municipality = config.get("municipality")
-        marial_srtatus = config.get("marial_srtatus")
-        n_children = config.get("n_children")
 
-        # query tax calculator api
-        url_staat = "/ZH-Web-Calculators/calculators/INCOME_ASSETS/calculate"
-        url_bund = "/ZH-Web-Calculators/calculators/FEDERAL/calculate"
-
-        data_staat = {
-            "isLiabilityLessThanAYear": False,
-            "hasTaxSeparation": False,
-            "hasQualifiedInvestments": False,
-            "taxYear": str(api_year),
-            "liabilityBegin": None,
-            "liabilityEnd": None,
-            "name": "",
-            "maritalStatus": str(marial_srtatus).lower(),
-            "taxScale": "BASIC",
-            "religionP1": "OTHERS",
-            "religionP2": "OTHERS",
-            "municipality": str(municipality),
-            "taxableIncome": str(taxable_income_float),
-            "ascertainedTaxableIncome": None,
-            "qualifiedInvestmentsIncome": None,
-            "taxableAssets": str(assets),
-            "ascertainedTaxableAssets": None,
-            "withholdingTax": str(witholding)
-        }
+        # the main forecast (one per month in rolling mode) plus optional
+        # what-if scenarios, all based on the taxable income computed above
+        requests = []
+        for income in annualized_incomes:
+            requests.extend(make_api_requests(config, income,
+                                              assets, witholding))
+        scenarios = [dict(config, **scenario)
+                     for scenario in config.get("scenarios", [])]
+        for scenario, overrides in zip(scenarios, config.get("scenarios", [])):
+            requests.extend(make_api_requests(
+                scenario, get_scenario_income(overrides, taxable_income_float),
+                assets, witholding))
 
-        data_bund = {
-            "isLiabilityLessThanAYearOrHasTaxSeparation": False,
-            "taxYear": str(api_year),
-            "name": "",
-            "taxScale": str(marial_srtatus).upper(),
-            "childrenNo": str(n_children),
-            "taxableIncome": str(taxable_income_float),
-            "ascertainedTaxableIncome": None,
-        }
+        # query tax calculator api
+        engine = config.get("tax_engine", "api")
+        client = make_client(config, cache)
         try:
-            response_staat = query_zh_tax_api(url_staat, data_staat)
-            response_bund = query_zh_tax_api(url_bund, data_bund)
+            if engine == "local":
+                responses = tax_tables.answer_requests(requests)
+            else:
+                responses = client.query_many(requests)
         except APIError:
-            logger.info("could not fetch tax info from API. Not providing tax forecast")
-            return entries, errors
-        # extract relevant info and convert to monthly taxes
-        taxes = {"Staats": response_staat.get('cantonalBaseTax').get('value'),
-                 "Gemeinde": response_staat.get('municipalityTax').get('value'),
-                 "Personal": response_staat.get('personalTax').get('value'),
-                 "Vermoegen": response_staat.get('assetsTax').get('value'),
-                 "Bundes": response_bund.get('totalFederalTax').get('value')
-                 }
+            if engine != "fallback":
+                logger.info("could not fetch tax info from API. Not providing tax forecast")
+                return entries, errors
+            logger.info("could not fetch tax info from API. Using local tax tables")
+            responses = tax_tables.answer_requests(requests)
+        finally:
+            client.close()
+            cache.close()
+        n_main = 2 * len(annualized_incomes)
+        main_responses, scenario_responses = responses[:n_main], responses[n_main:]
 
+        # extract relevant info and convert to monthly taxes
         precision = config.get("precision")
-        taxes_per_month = {kind: Decimal(
-            value/12).__round__(precision) for kind, value in taxes.items()}
+        taxes_per_month = get_taxes_per_month(*main_responses[-2:], precision)
 
         # create postings & transactions
-        tax_transactions = make_transactions(config,
-                                             options,
-                                             taxes_per_month,
-                                             last_month_of_income)
+        if rolling:
+            tax_transactions = make_rolling_transactions(config,
+                                                         options,
+                                                         main_responses,
+                                                         precision)
+        else:
+            tax_transactions = make_transactions(config,
+                                                 options,
+                                                 taxes_per_month,
+                                                 last_month_of_income)
+
+        scenario_taxes = {}
+        for i, scenario in enumerate(scenarios):
+            scenario_taxes[scenario["name"]] = get_taxes_per_month(
+                *scenario_responses[2 * i:2 * i + 2], precision)
+        if scenario_taxes and config.get("scenario_output") == "transactions":
+            for name, taxes in scenario_taxes.items():
+                slug = scenario_slug(name)
+                tax_transactions.extend(make_scenario_opens(
+                    config, taxes, slug))
+                tax_transactions.extend(make_transactions(
+                    config, options, taxes, last_month_of_income,
+                    name=name, tags=frozenset([f"tax-scenario-{slug}"]),
+                    scenario=slug))
+        elif scenario_taxes:
+            summary = pd.DataFrame(
+                {"forecast": taxes_per_month, **scenario_taxes}).T
+            summary["Total"] = summary.sum(axis=1)
+            logger.info(f"monthly taxes per scenario:\n{summary.to_string()}")
 
         entries.extend(tax_transactions)
     except Exception as e:
@@ -146,119 +226,414 @@ def tax_forecast(entries, options, config_str):
     return entries, errors
 
 
-def load_cache():
-    if os.path.exists(CACHE_FILENAME):
-        with open(CACHE_FILENAME, 'rb') as f:
-            cache = pickle.load(f)
-        retention = time.time() - CACHE_RETENTION_SECONDS
-        cache = {k: v for k, v in cache.items() if v['timestamp'] > retention}
-        return cache
-    return {}
-
-
-def is_cache_entry_valid(entry_timestamp):
-    current_timestamp = time.time()
-    return (current_timestamp - entry_timestamp) < CACHE_RETENTION_SECONDS
-
-
-def get_payload_hash(payload):
-    return hashlib.md5(str(payload).encode()).hexdigest()
+def make_api_requests(config, taxable_income_float, assets, witholding):
+    # (url, payload) for the cantonal and federal calculator
+    api_year = config.get("api_year")
+    municipality = config.get("municipality")
+    marial_srtatus = config.get("marial_srtatus")
+    n_children = config.get("n_children")
+
+    data_staat = {
+        "isLiabilityLessThanAYear": False,
+        "hasTaxSeparation": False,
+        "hasQualifiedInvestments": False,
+        "taxYear": str(api_year),
+        "liabilityBegin": None,
+        "liabilityEnd": None,
+        "name": "",
+        "maritalStatus": str(marial_srtatus).lower(),
+        "taxScale": "BASIC",
+        "religionP1": "OTHERS",
+        "religionP2": "OTHERS",
+        "municipality": str(municipality),
+        "taxableIncome": str(taxable_income_float),
+        "ascertainedTaxableIncome": None,
+        "qualifiedInvestmentsIncome": None,
+        "taxableAssets": str(assets),
+        "ascertainedTaxableAssets": None,
+        "withholdingTax": str(witholding)
+    }
 
+    data_bund = {
+        "isLiabilityLessThanAYearOrHasTaxSeparation": False,
+        "taxYear": str(api_year),
+        "name": "",
+        "taxScale": str(marial_srtatus).upper(),
+        "childrenNo": str(n_children),
+        "taxableIncome": str(taxable_income_float),
+        "ascertainedTaxableIncome": None,
+    }
+    return [(URL_STAAT, data_staat), (URL_BUND, data_bund)]
 
-def save_cache(cache):
-    with open(CACHE_FILENAME, 'wb') as f:
-        pickle.dump(cache, f)
 
+def get_scenario_income(scenario, taxable_income_float):
+    # a scenario either fixes the taxable income or scales the projected one
+    if "taxable_income" in scenario:
+        return abs(float(scenario["taxable_income"]))
+    return taxable_income_float * scenario.get("income_factor", 1)
 
-def query_zh_tax_api(url, data):
-    cache = load_cache()
-    payload_hash = get_payload_hash(data)
 
-    # Check if the response for this payload is already cached and valid
-    if payload_hash in cache:
-        if is_cache_entry_valid(cache[payload_hash]['timestamp']):
-            logger.info("Returning cached tax api response")
-            return cache[payload_hash]['data']
+def scenario_slug(name):
+    # the scenario name as tag and account component: runs of characters
+    # other than letters, digits and "-" become "-"
+    slug = re.sub(r'[^A-Za-z0-9-]+', '-', str(name)).strip('-')
+    if not slug:
+        raise ValueError(f"tax scenario name {name!r} has no letters or digits")
+    return slug
 
-    logger.info("payload not in cache, querying tax api")
 
-    host = "webcalc.services.zh.ch"
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    conn = httplib.HTTPSConnection(host)
-    conn.request("POST", url, json.dumps(data), headers)
-    response = conn.getresponse()
-
-    if response.status == 200:
-        logger.info('tax api query successful')
-
-        answer = json.loads(response.read())
-        cache[payload_hash] = {
-            'data': answer,
-            'timestamp': time.time()  # Record the current time as the timestamp of the cache entry
+def get_accounts_of_forecast(config, scenario=None):
+    # (tax expenses main account, liability account), the scenario's own
+    # accounts for a what-if scenario
+    tax_base_account = config.get("tax_expenses_main_account")
+    liability_account = config.get("liability_account")
+    if scenario is None:
+        return tax_base_account, liability_account
+    component = scenario[0].upper() + scenario[1:]
+    return (":".join([tax_base_account, "Scenario", component]),
+            ":".join([liability_account, "Scenario", component]))
+
+
+def make_scenario_opens(config, taxes, scenario):
+    # open directives for the accounts of a scenario, they are not in the ledger
+    tax_base_account, liability_account = get_accounts_of_forecast(config,
+                                                                   scenario)
+    accounts = [":".join([tax_base_account, tax_type]) for tax_type in taxes]
+    accounts.append(liability_account)
+    return [data.Open(data.new_metadata(None, 0),
+                      datetime.date(config.get("year"), 1, 1),
+                      account, None, None)
+            for account in accounts]
+
+
+def get_taxes(response_staat, response_bund):
+    # yearly taxes per kind
+    return {"Staats": response_staat.get('cantonalBaseTax').get('value'),
+            "Gemeinde": response_staat.get('municipalityTax').get('value'),
+            "Personal": response_staat.get('personalTax').get('value'),
+            "Vermoegen": response_staat.get('assetsTax').get('value'),
+            "Bundes": response_bund.get('totalFederalTax').get('value')
+            }
+
+
+def get_taxes_per_month(response_staat, response_bund, precision):
+    taxes = get_taxes(response_staat, response_bund)
+    return {kind: Decimal(value/12).__round__(precision)
+            for kind, value in taxes.items()}
+
+
+def get_monthly_incomes(options, config, taxable_incomes, today, price_index,
+                        cache):
+    # taxable income per month in the base currency. a month is cached under
+    # a hash of its postings (summed per account and currency) and of the fx
+    # rates of its currencies, and looked up before it is converted. so only
+    # the months whose postings or rates changed are converted again
+    base_currency = options.get("operating_currency")[0]
+    monthly_incomes = {}
+    for month, positions in taxable_incomes.groupby('month'):
+        month = int(month)
+        fx_rates = {currency: get_fx_rate(price_index, currency, base_currency, today)
+                    for currency in positions.currency.unique()}
+        state = {"year": config.get("year"),
+                 "month": month,
+                 "base_currency": base_currency,
+                 "hash": hashlib.sha256(json.dumps(
+                     [sorted([row.account, row.currency, str(row.position)]
+                             for row in positions.itertuples()),
+                      sorted([currency, str(rate)] for currency, rate in fx_rates.items())]
+                 ).encode()).hexdigest()}
+        cached = cache.get(MONTHLY_INCOME_KEY, state)
+        if cached is not None:
+            monthly_incomes[month] = Decimal(cached['income'])
+            continue
+
+        by_currency = positions.groupby('currency').agg(
+            {'position': 'sum'}).reset_index()
+        by_currency = add_fx_info(None, options, by_currency, today, price_index)
+        income = Decimal(by_currency.in_base_curr.sum())
+        cache.put(MONTHLY_INCOME_KEY, state, {'income': str(income)})
+        monthly_incomes[month] = income
+    return monthly_incomes
+
+
+class ApiCache:
+    """
+    Persistent cache for tax api responses, backed by a SQLite file so that
+    several processes (fava, bean-check, ...) can share it. Entries are keyed
+    by the canonical JSON of url and payload, expire after ttl seconds and
+    the least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, cache_dir='.', ttl=CACHE_RETENTION_SECONDS,
+                 max_entries=CACHE_MAX_ENTRIES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILENAME)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # sqlite takes care of file locking and atomic commits
+        self.conn = sqlite3.connect(self.path, timeout=CACHE_LOCK_TIMEOUT)
+        with self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                              'key TEXT PRIMARY KEY, '
+                              'response TEXT NOT NULL, '
+                              'expires REAL NOT NULL, '
+                              'last_access REAL NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access '
+                              'ON responses (last_access)')
+
+    @staticmethod
+    def make_key(url, payload):
+        return json.dumps({'url': url, 'payload': payload},
+                          sort_keys=True, separators=(',', ':'))
+
+    def get(self, url, payload):
+        key = self.make_key(url, payload)
+        now = time.time()
+        row = self.conn.execute('SELECT response FROM responses '
+                                'WHERE key = ? AND expires > ?',
+                                (key, now)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?',
+                              (now, key))
+        return json.loads(row[0])
+
+    def put(self, url, payload, response, ttl=None):
+        key = self.make_key(url, payload)
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO responses '
+                              'VALUES (?, ?, ?, ?)',
+                              (key, json.dumps(response), now + ttl, now))
+            self.conn.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+            self.conn.execute('DELETE FROM responses WHERE key IN ('
+                              'SELECT key FROM responses '
+                              'ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                              (self.max_entries,))
+
+    def close(self):
+        self.conn.close()
+
+
+class TaxApiClient:
+    """
+    Client for the ZH tax calculator api. Requests are issued concurrently from
+    a small thread pool over one pool of keep-alive connections, which every
+    request of the client takes its connection from and returns it to, so at
+    most max_workers connections are ever opened. Failed requests are retried
+    with exponential backoff.
+    """
+
+    def __init__(self, host=API_HOST, https=True, timeout=API_TIMEOUT,
+                 retries=API_RETRIES, backoff=API_BACKOFF,
+                 max_workers=API_MAX_WORKERS, cache=None):
+        self.host = host
+        self.https = https
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._idle = queue.LifoQueue()  # connections not in use by a request
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self.https:
+            conn = httplib.HTTPSConnection(self.host, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(self.host, timeout=self.timeout)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _discard(self, conn):
+        conn.close()
+        with self._lock:
+            self._connections.remove(conn)
+
+    def _post(self, url, data):
+        headers = {
+            'Content-Type': 'application/json'
         }
-        save_cache(cache)
-        return answer
-    else:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            conn = self._acquire()
+            try:
+                conn.request("POST", url, json.dumps(data), headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, httplib.HTTPException) as e:
+                # broken keep-alive connection or timeout, reconnect and retry
+                logger.info(f"tax api request failed ({e}), attempt {attempt + 1}")
+                self._discard(conn)
+                continue
+            if response.will_close:
+                self._discard(conn)
+            else:
+                self._idle.put(conn)
+            if response.status == 200:
+                return json.loads(body)
+            if response.status < 500:
+                break  # client errors will not go away by retrying
+            logger.info(f"tax api returned {response.status}, attempt {attempt + 1}")
         logger.info("tax api was called but did not return 200")
-        raise APIError("Tax API did not return 200 but {response.status} ")
+        raise APIError(f"Tax API request to {url} failed after {attempt + 1} attempts")
+
+    def query(self, url, data):
+        # Check if the response for this payload is already cached and valid
+        if self.cache is not None:
+            answer = self.cache.get(url, data)
+            if answer is not None:
+                logger.info("Returning cached tax api response")
+                return answer
+
+        logger.info("payload not in cache, querying tax api")
+        answer = self._post(url, data)
+        logger.info('tax api query successful')
+        if self.cache is not None:
+            self.cache.put(url, data, answer)
+        return answer
+
+    def query_many(self, requests):
+        # query a list of (url, data) concurrently, answers in the same order.
+        # cache lookups stay in the calling thread, sqlite connections are
+        # bound to the thread that opened them
+        answers = [self.cache.get(url, data) if self.cache is not None else None
+                   for url, data in requests]
+        missing = [i for i, answer in enumerate(answers) if answer is None]
+        if missing:
+            logger.info(f"{len(missing)} payloads not in cache, querying tax api")
+        futures = {i: self.executor.submit(self._post, *requests[i])
+                   for i in missing}
+        for i, future in futures.items():
+            answers[i] = future.result()
+            if self.cache is not None:
+                self.cache.put(*requests[i], answers[i])
+        return answers
+
+    def close(self):
+        self.executor.shutdown()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+
+
+def make_client(config, cache=None):
+    return TaxApiClient(host=config.get("api_host", API_HOST),
+                        https=config.get("api_https", True),
+                        timeout=config.get("api_timeout", API_TIMEOUT),
+                        retries=config.get("api_retries", API_RETRIES),
+                        backoff=config.get("api_backoff", API_BACKOFF),
+                        cache=cache)
+
+
+def query_zh_tax_api(url, data, cache=None):
+    # single, one-off query. use a TaxApiClient for several queries
+    client = TaxApiClient(cache=cache)
+    try:
+        return client.query(url, data)
+    finally:
+        client.close()
 
 
 def get_accounts(config, accounts):
     # Make a regex that matches if any of our regexes match for taxable accounts.
     if config['taxable_accounts']:
-        combined = "(" + ")|(".join(config['taxable_accounts']) + ")"
-        taxable_accounts = [acc for acc in accounts if bool(
-            re.search(combined, acc, re.IGNORECASE))]
+        combined = re.compile(
+            "(" + ")|(".join(config['taxable_accounts']) + ")", re.IGNORECASE)
+        taxable_accounts = [acc for acc in accounts if combined.search(acc)]
     else:
         taxable_accounts = []
 
     if config['deductable_accounts']:
-        combined = "(" + ")|(".join(config['deductable_accounts']) + ")"
-        deductable_accounts = [acc for acc in accounts if bool(
-            re.search(combined, acc, re.IGNORECASE))]
+        combined = re.compile(
+            "(" + ")|(".join(config['deductable_accounts']) + ")", re.IGNORECASE)
+        deductable_accounts = [acc for acc in accounts if combined.search(acc)]
     else:
         deductable_accounts = []
 
-    asset_accounts = []  # Todo
+    if config.get('taxable_assets_accounts'):
+        combined = re.compile(
+            "(" + ")|(".join(config['taxable_assets_accounts']) + ")", re.IGNORECASE)
+        asset_accounts = [acc for acc in accounts if combined.search(acc)]
+    else:
+        asset_accounts = []
+
     taxcredit_accounts = []  # todo
 
     return taxable_accounts, deductable_accounts, asset_accounts, taxcredit_accounts
 
 
 def get_income_expenses_from_accounts(entries, options, config, taxable_accounts):
-    # monthly aggregated data for all income and expense accounts
+    # monthly aggregated data for all taxable accounts, collected in a single
+    # pass over the postings instead of one BQL query per account
     year = config.get("year")
-    dfs = []
-    for acc in taxable_accounts:
-        query = f'SELECT date, account, position, currency\nWHERE account = "{acc}"\nAND Year = {year}'
-        result = run_query(entries, options, query, numberify=True)
-
-        cols = [x[0] for x in result[0]]
-        df = pd.DataFrame(result[1], columns=cols)
-        df.columns = [
-            'position' if 'position' in col else col for col in df.columns]
-        dfs.append(df)
-
-    return pd.concat(dfs).fillna(0)
-
-
-def add_fx_info(entries, options, taxable_incomes_by_currency, today):
+    taxable_accounts = set(taxable_accounts)
+    positions = defaultdict(Decimal)
+    for entry in entries:
+        if not isinstance(entry, Transaction) or entry.date.year != year:
+            continue
+        for posting in entry.postings:
+            if posting.account in taxable_accounts:
+                key = (posting.account, entry.date.month, posting.units.currency)
+                positions[key] += posting.units.number
+
+    return pd.DataFrame([(*key, position) for key, position in positions.items()],
+                        columns=['account', 'month', 'currency', 'position'])
+
+
+def get_taxable_assets(entries, options, config, asset_accounts, price_index):
+    # year-end value of the taxable asset accounts in the base currency.
+    # the units of all lots are summed up per commodity in a single pass over
+    # the postings, and valued at the last price of the year
+    if not asset_accounts:
+        return 0
+    year_end = datetime.date(config.get("year"), 12, 31)
+    base_currency = options.get("operating_currency")[0]
+    asset_accounts = set(asset_accounts)
+    holdings = defaultdict(Decimal)
+    for entry in entries:
+        if not isinstance(entry, Transaction):
+            continue
+        if entry.date > year_end:
+            continue
+        for posting in entry.postings:
+            if posting.account in asset_accounts:
+                holdings[posting.units.currency] += posting.units.number
+
+    total = sum(price_index.convert(number, currency, base_currency, year_end)
+                for currency, number in holdings.items() if number)
+    return int(max(total, 0))
+
+
+def get_fx_rate(price_index, currency, base_currency, date):
+    if currency == base_currency:
+        return 1
+    price = price_index.nearest(currency, date)
+    if price is None:
+        raise ValueError(f"no price found for currency {currency}")
+    return price
+
+
+def add_fx_info(entries, options, taxable_incomes_by_currency, today,
+                price_index=None):
     # get forex rates
-    fx_rates = []
+    if price_index is None:
+        price_index = PriceIndex(entries)
     base_currency = options.get("operating_currency")[0]
-    for currency in taxable_incomes_by_currency.currency:
-        if currency == base_currency:
-            fx_rates.append(1)
-        else:
-            prices = [e for e in entries if isinstance(e, data.Price)]
-            prices_curr = [p for p in prices if p.currency == currency]
-            best_date = min([p.date for p in prices_curr],
-                            key=lambda x: abs(x - today))
-            price = [p for p in prices_curr if p.date ==
-                     best_date][0].amount.number
-            fx_rates.append(price)
+    fx_rates = [get_fx_rate(price_index, currency, base_currency, today)
+                for currency in taxable_incomes_by_currency.currency]
 
     # update the dataframe
     taxable_incomes_by_currency['fx_rate'] = fx_rates
@@ -268,34 +643,61 @@ def add_fx_info(entries, options, taxable_incomes_by_currency, today):
     return taxable_incomes_by_currency
 
 
-def make_transactions(config, options, taxes_per_month, last_month_of_income):
+def make_transaction(config, options, taxes, month, name=None,
+                     tags=data.EMPTY_SET, scenario=None):
     year = config.get("year")
     base_currency = options.get("operating_currency")[0]
-    tax_transactions = []
     day = config.get("tax_day_of_month")
-    tax_base_account = config.get("tax_expenses_main_account")
+    tax_base_account, liability_account = get_accounts_of_forecast(config,
+                                                                   scenario)
     postings = [data.Posting(":".join([tax_base_account, tax_type]),
                              Amount(value, base_currency),
                              None, None, None, None)
-                for tax_type, value in taxes_per_month.items()]
+                for tax_type, value in taxes.items()]
 
     postings.append(
         data.Posting(
-            config.get("liability_account"),
-            Amount(-sum([v for v in taxes_per_month.values()]),
+            liability_account,
+            Amount(-sum([v for v in taxes.values()]),
                    base_currency),
             None, None, None, None))
 
-    for month in range(1, last_month_of_income+1):
-        month_name = datetime.date(1900, month, 1).strftime('%b')
-        trans = data.Transaction(data.new_metadata(None, 0),
-                                 datetime.date(year, month, day),
-                                 '*',
-                                 "Tax Authority",
-                                 f"Tax forecast {month_name} {year}",
-                                 data.EMPTY_SET,
-                                 data.EMPTY_SET,
-                                 postings
-                                 )
-        tax_transactions.append(trans)
+    month_name = datetime.date(1900, month, 1).strftime('%b')
+    narration = f"Tax forecast {month_name} {year}"
+    if name is not None:
+        narration += f" ({name})"
+    return data.Transaction(data.new_metadata(None, 0),
+                            datetime.date(year, month, day),
+                            '*',
+                            "Tax Authority",
+                            narration,
+                            tags,
+                            data.EMPTY_SET,
+                            postings
+                            )
+
+
+def make_transactions(config, options, taxes_per_month, last_month_of_income,
+                      name=None, tags=data.EMPTY_SET, scenario=None):
+    return [make_transaction(config, options, taxes_per_month, month, name, tags,
+                             scenario)
+            for month in range(1, last_month_of_income+1)]
+
+
+def make_rolling_transactions(config, options, responses, precision):
+    # one transaction per month, booking the difference between the taxes
+    # accrued so far according to this month's forecast and the ones booked
+    # in the months before (a true-up)
+    tax_transactions = []
+    booked = {}
+    for i in range(0, len(responses), 2):
+        month = i // 2 + 1
+        taxes = get_taxes(*responses[i:i + 2])
+        accrued = {kind: Decimal(value * month / 12).__round__(precision)
+                   for kind, value in taxes.items()}
+        true_up = {kind: value - booked.get(kind, 0)
+                   for kind, value in accrued.items()}
+        booked = accrued
+        tax_transactions.append(
+            make_transaction(config, options, true_up, month))
     return tax_transactions
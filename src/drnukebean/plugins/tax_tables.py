@@ -0,0 +1,187 @@
+"""
+A local engine for the Zurich cantonal, municipal and federal income and
+wealth taxes, as an offline alternative to the ZH web calculator used by the
+tax_forecast plugin.
+
+The progressive tariffs are read from versioned data files in the tariffs
+directory (tariffs/zh_<year>.json). A year without its own file uses the
+latest earlier one. All tariffs evaluate numpy arrays, so many incomes can be
+computed at once:
+
+    tables = TaxTables.load(2023)
+    tables.cantonal_income_tax([50000, 100000], 'single')
+
+the engine answers the same (url, payload) requests as the web calculator,
+see TaxTables.answer, and check_against_cache compares it with the responses
+in the tax_forecast api cache.
+"""
+
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+
+URL_STAAT = "/ZH-Web-Calculators/calculators/INCOME_ASSETS/calculate"
+URL_BUND = "/ZH-Web-Calculators/calculators/FEDERAL/calculate"
+TARIFF_DIR = os.path.join(os.path.dirname(__file__), 'tariffs')
+TARIFF_FILE_PATTERN = r"zh_(\d{4})\.json"
+
+
+class Tariff:
+    """
+    A progressive tariff given by brackets [[lower bound, marginal rate], ...],
+    optionally replaced by a flat rate on the whole amount above flat_above.
+    """
+
+    def __init__(self, brackets, flat_above=None, flat_rate=None):
+        self.bounds = np.array([b[0] for b in brackets], dtype=float)
+        self.rates = np.array([b[1] for b in brackets], dtype=float)
+        # tax owed at each lower bound
+        widths = np.diff(self.bounds)
+        self.base = np.concatenate([[0.0], np.cumsum(widths * self.rates[:-1])])
+        self.flat_above = flat_above
+        self.flat_rate = flat_rate
+
+    @classmethod
+    def from_dict(cls, spec):
+        if isinstance(spec, dict):
+            return cls(spec['brackets'], spec.get('flat_above'), spec.get('flat_rate'))
+        return cls(spec)
+
+    def __call__(self, amounts):
+        amounts = np.maximum(np.asarray(amounts, dtype=float), 0)
+        idx = np.searchsorted(self.bounds, amounts, side='right') - 1
+        tax = self.base[idx] + self.rates[idx] * (amounts - self.bounds[idx])
+        if self.flat_above is not None:
+            tax = np.where(amounts >= self.flat_above,
+                           amounts * self.flat_rate, tax)
+        return tax
+
+
+class TaxTables:
+    """
+    The tariffs of one tax year.
+    """
+
+    def __init__(self, spec):
+        self.year = spec['year']
+        self.rounding = spec.get('income_rounding', 1)
+        cantonal = spec['cantonal']
+        self.cantonal_multiplier = cantonal['multiplier']
+        self.personal_tax = cantonal['personal_tax']
+        self.cantonal_income = {status: Tariff.from_dict(brackets)
+                                for status, brackets in cantonal['income'].items()}
+        self.cantonal_assets = {status: Tariff.from_dict(brackets)
+                                for status, brackets in cantonal['assets'].items()}
+        self.municipal_multipliers = spec['municipal_multipliers']
+        federal = spec['federal']
+        self.child_deduction = federal['child_deduction']
+        self.federal_income = {status: Tariff.from_dict(brackets)
+                               for status, brackets in federal['income'].items()}
+
+    @classmethod
+    def load(cls, year, tariff_dir=TARIFF_DIR):
+        years = available_years(tariff_dir)
+        candidates = [y for y in years if y <= int(year)]
+        if not candidates:
+            raise KeyError(f"no tax tariff for year {year} in {tariff_dir}")
+        fname = os.path.join(tariff_dir, f"zh_{max(candidates)}.json")
+        with open(fname) as f:
+            return cls(json.load(f))
+
+    def round_down(self, amounts):
+        amounts = np.abs(np.asarray(amounts, dtype=float))
+        return np.floor(amounts / self.rounding) * self.rounding
+
+    def simple_tax(self, incomes, marital_status):
+        # the "einfache Staatssteuer", base for cantonal and municipal tax
+        return self.cantonal_income[marital_status](self.round_down(incomes))
+
+    def cantonal_income_tax(self, incomes, marital_status):
+        return self.simple_tax(incomes, marital_status) * self.cantonal_multiplier
+
+    def municipal_income_tax(self, incomes, marital_status, municipality):
+        multiplier = self.municipal_multipliers[str(municipality)]
+        return self.simple_tax(incomes, marital_status) * multiplier
+
+    def assets_tax(self, assets, marital_status, municipality):
+        multiplier = (self.cantonal_multiplier
+                      + self.municipal_multipliers[str(municipality)])
+        return self.cantonal_assets[marital_status](
+            self.round_down(assets)) * multiplier
+
+    def federal_income_tax(self, incomes, marital_status, n_children=0):
+        tax = self.federal_income[marital_status](self.round_down(incomes))
+        return np.maximum(tax - n_children * self.child_deduction, 0)
+
+    def answer(self, url, payload):
+        # a response of the same shape as the web calculator's
+        income = float(payload.get('taxableIncome') or 0)
+        if url == URL_STAAT:
+            status = payload['maritalStatus'].lower()
+            municipality = payload['municipality']
+            assets = float(payload.get('taxableAssets') or 0)
+            return {
+                'cantonalBaseTax': {'value': round(float(
+                    self.cantonal_income_tax(income, status)), 2)},
+                'municipalityTax': {'value': round(float(
+                    self.municipal_income_tax(income, status, municipality)), 2)},
+                'personalTax': {'value': self.personal_tax},
+                'assetsTax': {'value': round(float(
+                    self.assets_tax(assets, status, municipality)), 2)}}
+        if url == URL_BUND:
+            status = payload['taxScale'].lower()
+            n_children = int(payload.get('childrenNo') or 0)
+            return {'totalFederalTax': {'value': round(float(
+                self.federal_income_tax(income, status, n_children)), 2)}}
+        raise KeyError(f"no local calculator for {url}")
+
+
+def available_years(tariff_dir=TARIFF_DIR):
+    years = []
+    for fname in os.listdir(tariff_dir):
+        match = re.fullmatch(TARIFF_FILE_PATTERN, fname)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def answer_requests(requests, tariff_dir=TARIFF_DIR):
+    # local answers to a list of (url, payload) requests
+    tables = {}
+    answers = []
+    for url, payload in requests:
+        year = int(payload['taxYear'])
+        if year not in tables:
+            tables[year] = TaxTables.load(year, tariff_dir)
+        answers.append(tables[year].answer(url, payload))
+    return answers
+
+
+def check_against_cache(cache_path, tariff_dir=TARIFF_DIR, tolerance=1.0):
+    # compares the local engine with the api responses in a tax_forecast api
+    # cache file. returns a list of (url, payload, field, api value, local value)
+    # for all values differing by more than tolerance
+    conn = sqlite3.connect(cache_path)
+    try:
+        rows = conn.execute('SELECT key, response FROM responses').fetchall()
+    finally:
+        conn.close()
+    differences = []
+    for key, response in rows:
+        request = json.loads(key)
+        url, payload = request['url'], request['payload']
+        try:
+            local = answer_requests([(url, payload)], tariff_dir)[0]
+        except KeyError:
+            continue  # no tariff for that year, municipality or calculator
+        for field, value in local.items():
+            api_value = json.loads(response).get(field, {}).get('value')
+            if api_value is None:
+                continue
+            if abs(float(api_value) - value['value']) > tolerance:
+                differences.append((url, payload, field, api_value, value['value']))
+    return differences
@@ -0,0 +1,166 @@
+"""
+Opt-in timing instrumentation for the drnukebean plugins and importers.
+
+Set the environment variable DRNUKEBEAN_PROFILE to switch it on:
+  DRNUKEBEAN_PROFILE=1                  log one JSON record per plugin / importer phase
+  DRNUKEBEAN_PROFILE=/path/report.jsonl additionally append the records to that file
+
+e.g. DRNUKEBEAN_PROFILE=1 bean-check main.bean
+
+every record holds the phase name, wall time, number of entries in and out
+(where it applies) and the peak memory allocated on top of what was allocated
+when the phase started. tracemalloc can't reset its peak before python 3.9,
+there the memory still allocated at the end of the phase is reported instead.
+when switched off, the hooks cost a single flag check per call.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from loguru import logger
+
+
+ENV_VAR = 'DRNUKEBEAN_PROFILE'
+
+_enabled = False
+_report_path = None
+_records = []
+_local = threading.local()  # the stack of open phases, per thread
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)  # python 3.9+
+
+
+def enable(report_path=None):
+    # switch instrumentation on, e.g. from a bean-extract config file
+    global _enabled, _report_path
+    _enabled = True
+    _report_path = report_path
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _peak():
+    # the peak since the last reset, or the current size without reset_peak
+    current, peak = tracemalloc.get_traced_memory()
+    return peak if _reset_peak else current
+
+
+def records():
+    # all records collected in this process so far
+    return list(_records)
+
+
+@contextmanager
+def _measure(name, entries_in=None):
+    record = {'name': name, 'entries_in': entries_in, 'entries_out': None,
+              'child_peak': 0}
+    _stack = _local.__dict__.setdefault('stack', [])
+    if _stack:
+        # keep the parent's peak before resetting it for this phase
+        parent = _stack[-1]
+        parent['child_peak'] = max(parent['child_peak'], _peak())
+    if _reset_peak:
+        _reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    _stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        wall_time = time.perf_counter() - start
+        _stack.pop()
+        peak = max(_peak(), record.pop('child_peak'))
+        if _stack:
+            _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+        record.update(wall_time=round(wall_time, 6),
+                      peak_memory=max(peak - start_memory, 0),
+                      timestamp=time.time())
+        _emit(record)
+
+
+def _emit(record):
+    _records.append(record)
+    line = json.dumps(record)
+    logger.info(f"drnukebean profile: {line}")
+    if _report_path:
+        with open(_report_path, 'a') as f:
+            f.write(line + '\n')
+
+
+def _count(result):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+@contextmanager
+def _noop():
+    yield {}
+
+
+def phase(name):
+    """
+    context manager timing a block, e.g. a parsing step inside an extract.
+    the yielded dict takes an optional 'entries_out' count.
+    """
+    if not _enabled:
+        return _noop()
+    return _measure(name)
+
+
+def profile_plugin(func):
+    """
+    decorator for beancount plugin functions (entries, options_map, ...)
+    """
+    @wraps(func)
+    def wrapper(entries, *args, **kwargs):
+        if not _enabled:
+            return func(entries, *args, **kwargs)
+        with _measure(f"plugin.{func.__name__}", len(entries)) as record:
+            new_entries, errors = func(entries, *args, **kwargs)
+            record['entries_out'] = len(new_entries)
+        return new_entries, errors
+    return wrapper
+
+
+def profile_method(func):
+    """
+    decorator for importer methods (identify, extract, ...). records the
+    number of existing entries passed in and the number of entries returned
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not _enabled:
+            return func(self, *args, **kwargs)
+        existing_entries = kwargs.get('existing_entries')
+        if existing_entries is None and len(args) > 1:
+            existing_entries = args[1]
+        entries_in = len(existing_entries) if existing_entries else None
+        name = f"{type(self).__name__}.{func.__name__}"
+        with _measure(name, entries_in) as record:
+            result = func(self, *args, **kwargs)
+            if not isinstance(result, bool):
+                record['entries_out'] = _count(result)
+        return result
+    return wrapper
+
+
+if os.environ.get(ENV_VAR, '').lower() not in ('', '0', 'false', 'no'):
+    value = os.environ[ENV_VAR]
+    enable(None if value.lower() in ('1', 'true', 'yes') else value)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the fake services and statement generators of the benchmarks, see benchmarks/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
@@ -0,0 +1,47 @@
+import time
+
+from drnukebean.plugins.tax_forecast import ApiCache
+
+URL = '/calculate'
+
+
+def test_canonical_keys(tmp_path):
+    cache = ApiCache(str(tmp_path))
+    cache.put(URL, {'a': 1, 'b': 2}, {'value': 3})
+    assert cache.get(URL, {'b': 2, 'a': 1}) == {'value': 3}
+    assert cache.get(URL, {'a': 1}) is None
+    assert cache.get('/other', {'a': 1, 'b': 2}) is None
+
+
+def test_shared_between_processes(tmp_path):
+    # e.g. fava and bean-check, each with its own connection
+    writer, reader = ApiCache(str(tmp_path)), ApiCache(str(tmp_path))
+    writer.put(URL, {'a': 1}, {'value': 1})
+    assert reader.get(URL, {'a': 1}) == {'value': 1}
+    writer.close()
+    reader.close()
+    assert ApiCache(str(tmp_path)).get(URL, {'a': 1}) == {'value': 1}
+
+
+def test_ttl(tmp_path, monkeypatch):
+    cache = ApiCache(str(tmp_path), ttl=60)
+    cache.put(URL, {'a': 1}, {'value': 1})
+    cache.put(URL, {'a': 2}, {'value': 2}, ttl=3600)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert cache.get(URL, {'a': 1}) is None
+    assert cache.get(URL, {'a': 2}) == {'value': 2}
+
+
+def test_least_recently_used_evicted(tmp_path, monkeypatch):
+    cache = ApiCache(str(tmp_path), max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    cache.put(URL, {'a': 1}, {'value': 1})
+    cache.put(URL, {'a': 2}, {'value': 2})
+    # a hit counts as use
+    assert cache.get(URL, {'a': 1}) == {'value': 1}
+    cache.put(URL, {'a': 3}, {'value': 3})
+    assert cache.get(URL, {'a': 2}) is None
+    assert cache.get(URL, {'a': 1}) == {'value': 1}
+    assert cache.get(URL, {'a': 3}) == {'value': 3}
@@ -0,0 +1,17 @@
+import pytest
+
+import run
+
+
+@pytest.fixture(scope='module')
+def directory(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('benchmarks'))
+
+
+@pytest.mark.parametrize('name', sorted(run.BENCHMARKS))
+def test_benchmark_runs(directory, name):
+    # every benchmark works on its generated input, at a small size. an
+    # importer not recognising the statement format extracts nothing
+    result = run.BENCHMARKS[name](directory, 200)()
+    assert result
+
@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+import pytest
+from beancount.core import data, interpolate
+from beancount.ingest.cache import get_file
+
+from drnukebean.importer.finpension import FinPensionImporter
+
+ISIN = 'CH0429081620'
+HEADER = ('Date;Category;Asset Name;ISIN;Number of Shares;Asset Currency;Currency Rate;'
+          'Asset Price in CHF;Cash Flow;Balance')
+
+
+@pytest.fixture
+def statement(tmp_path):
+    rows = [
+        '2023-03-01;Deposit;;;;CHF;1;;2000.00;2000.00',
+        f'2023-03-02;Buy;CSIFWEXCH;{ISIN};0.123;CHF;1;1412.31;-173.71;1826.29',
+        f'2023-03-18;Buy;CSIFWEXCH;{ISIN};0.245;CHF;1;1412.29;-346.01;1480.28',
+        f'2023-03-20;Buy;CSIFWEXCH;{ISIN};0.007;CHF;1;1398.70;-9.79;1470.49',
+        f'2023-04-03;Buy;CSIFWEXCH;{ISIN};0.100;CHF;1;1400.00;-140.00;1330.49',
+    ]
+    path = tmp_path / 'finpension_S3a_Portfolio1.csv'
+    path.write_text('\n'.join([HEADER] + rows) + '\n', encoding='utf-8-sig')
+    return get_file(str(path))
+
+
+def buys(statement, aggregate_trades):
+    importer = FinPensionImporter(deposit_account='Assets:Bank',
+                                  root_account='Assets:Invest:S3a:Finpension:Portfolio1',
+                                  isin_lookup={ISIN: 'CSIFWEXCH'},
+                                  aggregate_trades=aggregate_trades)
+    return [entry for entry in importer.extract(statement)
+            if isinstance(entry, data.Transaction) and entry.payee == ISIN]
+
+
+def test_aggregated_trades_balance(statement):
+    march, april = buys(statement, 'month')
+    assert march.meta['source_rows'] == '3, 4, 5'
+    shares, cash = march.postings
+    assert shares.units.number == Decimal('0.375')
+    assert cash.units.number == Decimal('-529.51')
+    assert abs(shares.units.number * shares.price.number + cash.units.number) < Decimal('1e-20')
+    residual = interpolate.compute_residual(march.postings)
+    assert all(abs(position.units.number) < Decimal('1e-20') for position in residual)
+    assert '@ 1412.026667 CHF' in march.narration
+    # a single trade keeps its reported price
+    assert april.postings[0].price.number == Decimal('1400.00')
+
+
+def test_aggregated_by_day(statement):
+    assert len(buys(statement, 'day')) == len(buys(statement, None)) == 4
@@ -0,0 +1,68 @@
+import os
+import shutil
+from datetime import date
+
+import pytest
+from ibflex import parser
+
+from drnukebean.importer.flexarchive import StatementArchive
+
+
+def trade(i, day):
+    return (f'<Trade accountId="U1" currency="USD" symbol="VT" description="VT ETF" '
+            f'tradeID="{i}" transactionID="{i}" tradeDate="{day}" dateTime="{day};100000" '
+            f'quantity="10" tradePrice="100" proceeds="-1000" ibCommission="-1" '
+            f'ibCommissionCurrency="USD" buySell="BUY" levelOfDetail="EXECUTION" '
+            f'assetCategory="STK" ibOrderID="{i}"/>')
+
+
+def statement(*days):
+    trades = ''.join(trade(i, day) for i, day in enumerate(days))
+    return parser.parse(
+        '<FlexQueryResponse queryName="q" type="AF"><FlexStatements count="1">'
+        '<FlexStatement accountId="U1" fromDate="20180101" toDate="20191231" '
+        'period="Custom" whenGenerated="20200101;000000">'
+        f'<Trades>{trades}</Trades><CashTransactions/><CashReport/>'
+        '<OpenPositions/><ConversionRates/>'
+        '</FlexStatement></FlexStatements></FlexQueryResponse>'.encode())
+
+
+@pytest.fixture
+def response():
+    return statement('20181231', '20190102', '20190103')
+
+
+def test_reingest_adds_nothing(tmp_path, response):
+    archive = StatementArchive(str(tmp_path))
+    assert archive.ingest(response)['Trades'] == 3
+    assert StatementArchive(str(tmp_path)).ingest(response)['Trades'] == 0
+    assert len(archive.table('Trades')) == 3
+    assert len(archive.table('Trades', date(2019, 1, 1), date(2019, 12, 31))) == 2
+
+
+def test_index_lost_after_segments(tmp_path, response):
+    # a crash after writing the segments, before the index
+    StatementArchive(str(tmp_path)).ingest(response)
+    os.remove(tmp_path / 'keys.pkl')
+    archive = StatementArchive(str(tmp_path))
+    assert archive.ingest(response)['Trades'] == 0
+    assert len(archive.table('Trades')) == 3
+
+
+def test_stale_index(tmp_path, response):
+    # another process ingested since this one's index was cached
+    StatementArchive(str(tmp_path)).ingest(statement('20181231'))
+    shutil.copy(tmp_path / 'keys.pkl', tmp_path / 'old_keys.pkl')
+    StatementArchive(str(tmp_path)).ingest(response)
+    shutil.copy(tmp_path / 'old_keys.pkl', tmp_path / 'keys.pkl')
+    assert StatementArchive(str(tmp_path)).ingest(response)['Trades'] == 0
+
+
+def test_concurrent_appends(tmp_path, response):
+    # two processes appending the same rows, each unaware of the other
+    StatementArchive(str(tmp_path)).ingest(response)
+    partition = tmp_path / 'Trades' / '2019'
+    segment, = os.listdir(partition)
+    shutil.copy(partition / segment, partition / f'9{segment[1:]}')
+    assert len(StatementArchive(str(tmp_path)).table('Trades')) == 3
+    assert not [fname for fname in os.listdir(partition) if fname.endswith('.tmp')]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+from ibflex import parser
+from ibflex.client import StatementGenerationTimeout
+
+import generators
+from fake_flex import FakeFlexServer
+from drnukebean.importer import flexquery
+from drnukebean.importer.flexquery import FlexDownloader, date_chunks, merge_responses
+
+
+@pytest.fixture(scope='module')
+def xml():
+    return generators.ibkr_flex_xml(200)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # the backoff delays, without waiting for them
+    delays = []
+    monkeypatch.setattr(flexquery.time, 'sleep', delays.append)
+    return delays
+
+
+def test_chunks_merged(xml, sleeps):
+    whole = parser.parse(xml.encode()).FlexStatements[0]
+    from_date, to_date = whole.fromDate, whole.toDate
+    with FakeFlexServer(xml, pending=0) as server:
+        downloader = FlexDownloader('0000', '0000', request_url=server.request_url,
+                                    initial_delay=0)
+        responses = downloader.download(from_date, to_date, chunk_days=365)
+    assert len(responses) == len(date_chunks(from_date, to_date, 365)) > 1
+    assert server.requests['SendRequest'] == len(responses)
+    merged, = merge_responses([parser.parse(response) for response in responses]).FlexStatements
+    assert (merged.fromDate, merged.toDate) == (from_date, to_date)
+    assert len(merged.Trades) == len(whole.Trades)
+    assert len(merged.CashTransactions) == len(whole.CashTransactions)
+
+
+def test_backoff_while_generating(xml, sleeps):
+    with FakeFlexServer(xml, pending=3) as server:
+        downloader = FlexDownloader('0000', '0000', request_url=server.request_url,
+                                    initial_delay=1, max_delay=3)
+        response, = downloader.download()
+    assert b'FlexQueryResponse' in response[:1000]
+    # a pause after the SendRequest, then one per "in progress" answer
+    assert sleeps == [1, 1, 2, 3]
+    assert server.requests == {'SendRequest': 1, 'GetStatement': 4}
+
+
+def test_resume_from_state(xml, sleeps, tmp_path):
+    state_path = str(tmp_path / 'flexstate.json')
+    with FakeFlexServer(xml, pending=2) as server:
+        # killed before the statement was ready
+        with pytest.raises(StatementGenerationTimeout):
+            FlexDownloader('0000', '0000', state_path=state_path, request_url=server.request_url,
+                           initial_delay=0, max_tries=2).download()
+        with open(state_path) as f:
+            assert list(json.load(f)) == ['0000::']
+        FlexDownloader('0000', '0000', state_path=state_path, request_url=server.request_url,
+                       initial_delay=0).download()
+    # the second run polled the reference code of the first
+    assert server.requests == {'SendRequest': 1, 'GetStatement': 3}
+    with open(state_path) as f:
+        assert json.load(f) == {}
@@ -0,0 +1,105 @@
+from dataclasses import replace
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from beancount.core.amount import Amount
+from beancount.parser import printer
+from ibflex import parser
+
+from drnukebean.importer.ibkr import (CATEGORICAL_COLUMNS, TABLE_COLUMNS,
+                                      CollapseTradeSplits, IBKRImporter, ProjectTable)
+
+# a statement with a single purchase and a deposit: no sales, closed lots,
+# dividends or BASE_SUMMARY. the builders compare the categoricals with all
+# of those, which are not among their categories
+STATEMENT = (
+    '<FlexQueryResponse queryName="q" type="AF"><FlexStatements count="1">'
+    '<FlexStatement accountId="U1" fromDate="20190101" toDate="20191231" '
+    'period="Custom" whenGenerated="20200101;000000">'
+    '<Trades><Trade accountId="U1" currency="USD" symbol="VT" description="VT ETF" '
+    'tradeID="1" tradeDate="20190102" dateTime="20190102;100000" quantity="10" '
+    'tradePrice="100" proceeds="-1000" ibCommission="-1" ibCommissionCurrency="USD" '
+    'buySell="BUY" levelOfDetail="EXECUTION" assetCategory="STK" ibOrderID="1"/></Trades>'
+    '<CashTransactions><CashTransaction accountId="U1" currency="USD" '
+    'description="CASH RECEIPTS" amount="5000" type="Deposits/Withdrawals" '
+    'reportDate="20190101" dateTime="20190101"/></CashTransactions>'
+    '<CashReport><CashReportCurrency accountId="U1" currency="USD" endingCash="3999" '
+    'toDate="20191231"/></CashReport>'
+    '</FlexStatement></FlexStatements></FlexQueryResponse>')
+
+
+@pytest.fixture
+def poi():
+    return parser.parse(STATEMENT.encode()).FlexStatements[0]
+
+
+@pytest.fixture
+def importer():
+    return IBKRImporter(Mainaccount='Assets:Invest:IB', WHTAccount='Expenses:Invest:IB:WTax',
+                        depositAccount='Assets:Bank')
+
+
+def test_unknown_column(poi):
+    with pytest.raises(AttributeError):
+        ProjectTable(poi.Trades, ['symbol', 'tradeDat'])
+    tab = ProjectTable(poi.Trades, ['symbol', 'tradeDat'], optional=('tradeDat',))
+    assert tab['tradeDat'].isna().all()
+
+
+def test_categories_without_compared_values(poi, importer):
+    tabs = importer.ProjectStatement(poi)
+    assert not (tabs['Trades']['levelOfDetail'] == 'CLOSED_LOT').any()
+    assert not tabs['CashTransactions']['type'].isin(['Dividends']).any()
+    # the same entries as from the tables without categoricals
+    plain = {report: tab.astype({col: object for col in CATEGORICAL_COLUMNS.intersection(tab)})
+             for report, tab in tabs.items()}
+    entries = list(importer.StatementEntries(tabs))
+    assert len(entries) == 3  # purchase, deposit, balance
+    assert [printer.format_entry(entry) for entry in entries] == \
+        [printer.format_entry(entry) for entry in importer.StatementEntries(plain)]
+
+
+def test_collapse_keeps_first_execution(poi):
+    trade, = poi.Trades
+    # IB splits the order, the second part carries values the first one lacks
+    parts = [replace(trade, quantity=Decimal(4), proceeds=Decimal(-400), ibCommission=None),
+             replace(trade, quantity=Decimal(6), proceeds=Decimal(-600), ibCommission=Decimal(-1),
+                     openDateTime=datetime(2018, 1, 2, 10), taxes=Decimal('-0.5'))]
+    collapsed = CollapseTradeSplits(ProjectTable(parts, TABLE_COLUMNS['Trades']))
+    row = collapsed.iloc[0]
+    assert len(collapsed) == 1
+    assert (row['quantity'], row['proceeds'], row['ibCommission'], row['taxes']) == \
+        (Decimal(10), Decimal(-1000), Decimal(-1), Decimal('-0.5'))
+    # not the openDateTime of the second part
+    assert pd.isna(row['openDateTime'])
+    assert row['fifoPnlRealized'] is None
+
+
+PRICES = STATEMENT.replace('</CashReport>', (
+    '</CashReport><OpenPositions>'
+    '<OpenPosition accountId="U1" symbol="VT" currency="USD" markPrice="101.5" '
+    'reportDate="20191231" position="10" assetCategory="STK"/>'
+    '<OpenPosition accountId="U1" symbol="VTI" currency="USD" markPrice="160" '
+    'reportDate="20191231" position="5" assetCategory="STK"/>'
+    '<OpenPosition accountId="U1" symbol="EUR.USD" currency="USD" markPrice="1.12" '
+    'reportDate="20191231" position="100" assetCategory="CASH"/>'
+    '</OpenPositions><ConversionRates>'
+    '<ConversionRate reportDate="20191231" fromCurrency="USD" toCurrency="CHF" rate="0.97"/>'
+    '<ConversionRate reportDate="20191231" fromCurrency="USD" toCurrency="CHF" rate="0.97"/>'
+    '<ConversionRate reportDate="20191231" fromCurrency="CHF" toCurrency="CHF" rate="1"/>'
+    '<ConversionRate reportDate="20191231" fromCurrency="RUB" toCurrency="CHF" rate="-1"/>'
+    '</ConversionRates>'))
+
+
+def test_prices(importer):
+    importer.priceEntries = True
+    importer.symbolMap = {'VTI': 'VTI.US'}
+    tabs = importer.ProjectStatement(parser.parse(PRICES.encode()).FlexStatements[0])
+    known, = importer.Prices(tabs['OpenPositions'].iloc[:1], tabs['ConversionRates'].iloc[:0])
+    prices = importer.Prices(tabs['OpenPositions'], tabs['ConversionRates'], [known])
+    # forex positions, duplicates, identity and unavailable rates are left out
+    assert [(price.date, price.currency, price.amount) for price in prices] == [
+        (date(2019, 12, 31), 'VTI.US', Amount(Decimal(160), 'USD')),
+        (date(2019, 12, 31), 'USD', Amount(Decimal('0.97'), 'CHF'))]
@@ -0,0 +1,64 @@
+import itertools
+
+import pytest
+from beancount.ingest.cache import get_file
+from beancount.parser import printer
+
+import generators
+from drnukebean.importer.PFCC import PFCCImporter
+from drnukebean.importer.PFG import PFGImporter
+from drnukebean.importer.finpension import FinPensionImporter
+from drnukebean.importer.ibkr import IBKRImporter
+from drnukebean.importer.util import BATCH_ROWS
+
+
+def pfg(directory, size, manual_fixes=None):
+    return (generators.pfg_statement(directory, size),
+            PFGImporter(generators.IBAN, 'Assets:PF:Giro', currency='CHF',
+                        manual_fixes=manual_fixes))
+
+
+def pfcc(directory, size, manual_fixes=None):
+    return (generators.pfcc_statement(directory, size),
+            PFCCImporter(generators.CCNUMBER, 'Liabilities:PF:Card', currency='CHF',
+                         manual_fixes=manual_fixes))
+
+
+def finpension(directory, size):
+    return (generators.finpension_statement(directory, size),
+            FinPensionImporter(deposit_account='Assets:Bank',
+                               root_account='Assets:Invest:S3a:Finpension:Portfolio1',
+                               isin_lookup=generators.FUNDS))
+
+
+def ibkr(directory, size):
+    creds_path, statement_path = generators.ibkr_statement(directory, size)
+    return creds_path, IBKRImporter(Mainaccount='Assets:Invest:IB',
+                                    WHTAccount='Expenses:Invest:IB:WTax',
+                                    depositAccount='Assets:Bank', fpath=statement_path)
+
+
+@pytest.mark.parametrize('make', [pfg, pfcc, finpension, ibkr])
+def test_same_entries_as_extract(tmp_path, make):
+    path, importer = make(str(tmp_path), 300)
+    file_ = get_file(path)
+    entries = importer.extract(file_)
+    assert entries
+    assert [printer.format_entry(entry) for entry in importer.iter_extract(file_)] == \
+        [printer.format_entry(entry) for entry in entries]
+
+
+@pytest.mark.parametrize('make', [pfg, pfcc])
+def test_rows_built_as_consumed(tmp_path, make):
+    built = []
+
+    def count(txn):
+        built.append(txn)
+
+    path, importer = make(str(tmp_path), 3 * BATCH_ROWS, manual_fixes=count)
+    entries = importer.iter_extract(get_file(path))
+    first = list(itertools.islice(entries, 10))
+    assert len(first) == 10
+    # only the first batch of rows is built yet
+    assert len(built) <= BATCH_ROWS
+    assert len(first) + len(list(entries)) >= len(built) > 2 * BATCH_ROWS
@@ -0,0 +1,88 @@
+import datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from beancount import loader
+
+from drnukebean.importer.ibkr import IBKRImporter
+from drnukebean.importer.util import LotIndex
+
+LEDGER = '''
+2019-01-01 open Assets:Invest:IB:VT
+2019-01-01 open Assets:Invest:IB2:VT
+2019-01-01 open Assets:Bank
+2019-01-02 * "buy"
+  Assets:Invest:IB:VT 10 VT {100 USD}
+  Assets:Bank
+2019-02-01 * "buy"
+  Assets:Invest:IB:VT 5 VT {110 USD}
+  Assets:Bank
+2019-02-01 * "buy"
+  Assets:Invest:IB:VT 5 VT {120 USD}
+  Assets:Bank
+2019-03-01 * "buy"
+  Assets:Invest:IB2:VT 7 VT {130 USD}
+  Assets:Bank
+'''
+
+
+def day(month, dom=1):
+    return datetime.date(2019, month, dom)
+
+
+@pytest.fixture
+def entries():
+    entries, errors, _ = loader.load_string(LEDGER)
+    assert not errors
+    return entries
+
+
+def test_sibling_accounts_not_indexed(entries):
+    index = LotIndex(entries, 'Assets:Invest:IB')
+    assert len(index) == 3
+    assert index.take('Assets:Invest:IB2:VT', 'VT', 7) == []
+    assert len(LotIndex(entries, ('Assets:Invest:IB', 'Assets:Invest:IB2'))) == 4
+
+
+def test_take_oldest_first(entries):
+    index = LotIndex(entries, 'Assets:Invest:IB')
+    taken = index.take('Assets:Invest:IB:VT', 'VT', 4)
+    assert [(cost.number, units) for cost, units in taken] == [(100, 4)]
+    # the rest of the partly taken lot, then the next one
+    taken = index.take('Assets:Invest:IB:VT', 'VT', 8)
+    assert [(cost.number, units) for cost, units in taken] == [(100, 6), (110, 2)]
+    # not more than the ledger holds
+    taken = index.take('Assets:Invest:IB:VT', 'VT', 20)
+    assert sum(units for _, units in taken) == 8
+
+
+def test_find_same_day_by_cost(entries):
+    index = LotIndex(entries, 'Assets:Invest:IB')
+    assert index.find('Assets:Invest:IB:VT', 'VT', day(2), 3, Decimal(119)).number == 120
+    assert index.find('Assets:Invest:IB:VT', 'VT', day(2), 3, Decimal(119)).number == 110
+    # both lots of the day have only 2 units left
+    assert index.find('Assets:Invest:IB:VT', 'VT', day(2), 3) is None
+    assert index.find('Assets:Invest:IB:VT', 'VT', day(3), 1) is None
+
+
+def sale(quantity):
+    return pd.DataFrame([{
+        'currency': 'USD', 'ibCommissionCurrency': 'USD', 'symbol': 'VT',
+        'proceeds': Decimal(150) * -quantity, 'ibCommission': Decimal(-1),
+        'quantity': Decimal(quantity), 'tradePrice': Decimal(150),
+        'description': 'VT ETF', 'dateTime': pd.Timestamp(2019, 6, 3, 10)}])
+
+
+def test_panic_sale_spanning_lots(entries):
+    importer = IBKRImporter(Mainaccount='Assets:Invest:IB', WHTAccount='Expenses:Invest:IB:WTax',
+                            depositAccount='Assets:Bank')
+    # the statement reports one closed lot of the sale, the lots bought
+    # before the statement period come from the ledger
+    lots = pd.DataFrame([{'symbol': 'VT', 'quantity': Decimal(3), 'tradePrice': Decimal(120),
+                          'currency': 'USD', 'openDateTime': pd.Timestamp(2019, 2, 1)}],
+                        index=[1])
+    txn, = importer.Panic(sale(-15), lots, LotIndex(entries, 'Assets:Invest:IB'))
+    booked = [(posting.units.number, posting.cost.number_per, posting.cost.date)
+              for posting in txn.postings if posting.account == 'Assets:Invest:IB:VT']
+    assert booked == [(-3, 120, day(2)), (-10, 100, day(1, 2)), (-2, 110, day(2))]
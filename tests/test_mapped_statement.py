@@ -0,0 +1,67 @@
+import codecs
+
+import pytest
+
+from drnukebean.importer.util import MappedStatement, mapped_statement
+
+
+def write(tmp_path, content, name='statement.csv'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_lines(tmp_path, newline):
+    content = newline.join(['Datum:;01.01.2020', 'Konto:;CH93', '', 'Buchungsdatum;Betrag', '1;2'])
+    with MappedStatement(write(tmp_path, (content + newline).encode())) as statement:
+        assert statement.line(0) == 'Datum:;01.01.2020'
+        assert statement.line(2) == ''
+        assert statement.line(4) == '1;2'
+        assert statement.line(5) is None
+        assert list(statement.lines(3)) == ['Buchungsdatum;Betrag', '1;2']
+        assert list(statement.lines(5)) == []
+
+
+def test_last_line_without_newline(tmp_path):
+    with MappedStatement(write(tmp_path, b'a\r\nb')) as statement:
+        assert [statement.line(0), statement.line(1)] == ['a', 'b']
+        assert list(statement.lines()) == ['a', 'b']
+
+
+def test_bom(tmp_path):
+    path = write(tmp_path, codecs.BOM_UTF8 + 'Währung;CHF\nx'.encode())
+    with MappedStatement(path, 'utf-8-sig') as statement:
+        assert statement.line(0) == 'Währung;CHF'
+        assert list(statement.lines()) == ['Währung;CHF', 'x']
+    # the plain codec leaves it to the reader
+    with MappedStatement(path, 'utf-8') as statement:
+        assert statement.line(0) == '\ufeffWährung;CHF'
+
+
+def test_latin1(tmp_path):
+    with MappedStatement(write(tmp_path, 'Währung;CHF\n'.encode('latin-1')), 'latin-1') as statement:
+        assert statement.line(0) == 'Währung;CHF'
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'utf-8-sig'])
+def test_empty_file(tmp_path, encoding):
+    with MappedStatement(write(tmp_path, b''), encoding) as statement:
+        assert len(statement) == 0
+        assert statement.line(0) is None
+        assert list(statement.lines()) == []
+
+
+def test_mapped_only_within_block(tmp_path):
+    path = write(tmp_path, b'a\nb\n')
+    statement = mapped_statement(path)
+    with statement:
+        with mapped_statement(path) as inner:
+            assert inner is statement
+        assert statement.line(1) == 'b'
+    assert statement._map is None
+    # a changed file is mapped anew
+    write(tmp_path, b'c\nd\ne\n')
+    with mapped_statement(path) as changed:
+        assert changed is not statement
+        assert changed.line(2) == 'e'
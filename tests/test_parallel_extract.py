@@ -0,0 +1,41 @@
+import datetime
+import threading
+import time
+
+from beancount.core import data
+from beancount.ingest import importer
+
+from drnukebean import parallel_extract
+
+
+class StatefulImporter(importer.ImporterProtocol):
+    # keeps the file being extracted on itself, like FinPensionImporter
+    def __init__(self):
+        self.running = 0
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def identify(self, file_):
+        return file_.name.endswith('.txt')
+
+    def extract(self, file_, existing_entries=None):
+        with self.lock:
+            self.running += 1
+            self.overlaps += self.running > 1
+        self.current = file_.name
+        time.sleep(0.01)
+        meta = data.new_metadata(self.current, 0)
+        with self.lock:
+            self.running -= 1
+        return [data.Note(meta, datetime.date(2020, 1, 1), 'Assets:Bank', self.current)]
+
+
+def test_threaded_jobs_of_one_importer_in_turn(tmp_path):
+    for i in range(6):
+        (tmp_path / f'{i}.txt').write_text('x')
+    stateful = StatefulImporter()
+    extracted = parallel_extract.extract_files([stateful], [str(tmp_path)], max_workers=4,
+                                               threaded=(StatefulImporter,))
+    assert stateful.overlaps == 0
+    assert [(filename, entry.comment) for filename, (entry,) in extracted] == \
+        [(filename, filename) for filename, _ in extracted]
@@ -0,0 +1,90 @@
+import pytest
+
+from beancount.core import data
+from beancount.ingest.cache import get_file
+
+from drnukebean.importer.PFG import PFGImporter
+from drnukebean.importer.PFCC import PFCCImporter
+
+IBAN = 'CH9300762011623852957'
+CARD = '5555 4444 3333 1234'
+ACCOUNTS = {'CHF': 'Assets:PF:Giro', 'EUR': 'Assets:PF:GiroEUR'}
+CARD_ACCOUNTS = {'CHF': 'Liabilities:PF:Card', 'USD': 'Liabilities:PF:CardUSD'}
+
+
+def giro_statement(path, currency):
+    path.write_text('\n'.join([
+        'Datum von:;="01.01.2023"',
+        'Datum bis:;="31.01.2023"',
+        'Buchungsart:;="Alle Buchungen"',
+        f'Konto:;{IBAN}',
+        f'Währung:;="{currency}"',
+        '',
+        f'Buchungsdatum;Avisierungstext;Gutschrift in {currency};Lastschrift in {currency};'
+        f'Valuta;Saldo in {currency}',
+        '03.01.2023;EINKAUF SHOP;;-20.00;03.01.2023;;;980.00',
+        '02.01.2023;GUTSCHRIFT;1000.00;;02.01.2023;',
+        '']), encoding='utf-8')
+    return get_file(str(path))
+
+
+def card_statement(path, currency):
+    path.write_text('\n'.join([
+        'Card account:;0000 1234 5678',
+        'Card:;XXXX XXXX XXXX 1234',
+        'Category:;All',
+        f'Date;Booking details;Credit in {currency};Debit in {currency};Tag;Category',
+        '2023-01-03;SHOP ZUERICH CHE;;-25.00;;',
+        ';Total;0.00;0.00;;',
+        '']), encoding='utf-8')
+    return get_file(str(path))
+
+
+def accounts(entries):
+    return {posting.account for entry in entries if isinstance(entry, data.Transaction)
+            for posting in entry.postings} | \
+        {entry.account for entry in entries if isinstance(entry, data.Balance)}
+
+
+@pytest.mark.parametrize('currency', ['CHF', 'EUR'])
+def test_giro_routed_by_currency(tmp_path, currency):
+    importer = PFGImporter(IBAN, ACCOUNTS)
+    file_ = giro_statement(tmp_path / f'giro_{currency}.csv', currency)
+    assert importer.identify(file_)
+    assert importer.file_account(file_) == ACCOUNTS[currency]
+    entries = importer.extract(file_)
+    assert len(entries) == 3
+    assert accounts(entries) == {ACCOUNTS[currency]}
+    assert {entry.amount.currency for entry in entries if isinstance(entry, data.Balance)} == \
+        {currency}
+
+
+def test_giro_unmapped_currency(tmp_path):
+    importer = PFGImporter(IBAN, ACCOUNTS)
+    file_ = giro_statement(tmp_path / 'giro_usd.csv', 'USD')
+    assert importer.extract(file_) == []
+    # still filed, to the first account
+    assert importer.file_account(file_) == 'Assets:PF:Giro'
+
+
+def test_single_account(tmp_path):
+    importer = PFGImporter(IBAN, 'Assets:PF:Giro', currency='CHF')
+    assert len(importer.extract(giro_statement(tmp_path / 'giro.csv', 'CHF'))) == 3
+    assert importer.extract(giro_statement(tmp_path / 'giro_eur.csv', 'EUR')) == []
+
+
+@pytest.mark.parametrize('currency', ['CHF', 'USD'])
+def test_card_routed_by_currency(tmp_path, currency):
+    importer = PFCCImporter(CARD, CARD_ACCOUNTS, manual_fixes=None)
+    file_ = card_statement(tmp_path / f'card_{currency}.csv', currency)
+    assert importer.identify(file_)
+    assert importer.file_account(file_) == CARD_ACCOUNTS[currency]
+    entries = importer.extract(file_)
+    assert len(entries) == 1
+    assert accounts(entries) == {CARD_ACCOUNTS[currency]}
+    assert entries[0].postings[0].units.currency == currency
+
+
+def test_card_unmapped_currency(tmp_path):
+    importer = PFCCImporter(CARD, CARD_ACCOUNTS, manual_fixes=None)
+    assert importer.extract(card_statement(tmp_path / 'card_eur.csv', 'EUR')) == []
@@ -0,0 +1,80 @@
+import pytest
+
+from beancount.ingest.cache import get_file
+
+from drnukebean.importer.PFG import PFGImporter
+from drnukebean.importer.PFCC import PFCCImporter
+from drnukebean.importer.PFRegistry import PFRegistryImporter
+from drnukebean.importer.util import mapped_statement
+
+IBAN = 'CH9300762011623852957'
+
+
+def giro_statement(path, iban_cell):
+    path.write_text('\n'.join([
+        'Datum von:;="01.01.2023"',
+        'Datum bis:;="31.01.2023"',
+        'Buchungsart:;="Alle Buchungen"',
+        f'Konto:;{iban_cell}',
+        'Währung:;="CHF"',
+        '',
+        'Buchungsdatum;Avisierungstext;Gutschrift in CHF;Lastschrift in CHF;Valuta;Saldo in CHF',
+        '03.01.2023;EINKAUF SHOP;;-20.00;03.01.2023;;;980.00',
+        '02.01.2023;GUTSCHRIFT;1000.00;;02.01.2023;',
+        '']), encoding='utf-8')
+    return get_file(str(path))
+
+
+@pytest.fixture
+def registry():
+    return PFRegistryImporter([
+        PFGImporter(IBAN, 'Assets:PF:Giro', currency='CHF'),
+        PFGImporter('CH56 0483 5012 3456 7800 9', 'Assets:PF:Savings', currency='CHF'),
+        PFCCImporter('5555 4444 3333 1234', 'Liabilities:PF:Card', currency='CHF')])
+
+
+@pytest.mark.parametrize('iban_cell', [
+    IBAN,
+    '="CH9300762011623852957"',
+    'CH93 0076 2011 6238 5295 7',
+    '="CH93 0076 2011 6238 5295 7"',
+])
+def test_quoted_and_spaced_iban(tmp_path, registry, iban_cell):
+    file_ = giro_statement(tmp_path / 'giro.csv', iban_cell)
+    delegate = registry.giro[IBAN]
+    assert registry.identify(file_)
+    assert delegate.identify(file_)
+    assert registry.file_account(file_) == 'Assets:PF:Giro'
+    entries = registry.extract(file_)
+    assert len(entries) == 3  # two transactions and the balance
+
+
+def test_unknown_iban(tmp_path, registry):
+    file_ = giro_statement(tmp_path / 'giro.csv', '="CH11 0000 0000 0000 0000 0"')
+    assert not registry.identify(file_)
+
+
+def test_card(tmp_path, registry):
+    path = tmp_path / 'card.csv'
+    path.write_text('\n'.join([
+        'Card account:;0000 1234 5678',
+        'Card:;XXXX XXXX XXXX 1234',
+        'Category:;All',
+        'Date;Booking details;Credit in CHF;Debit in CHF;Tag;Category',
+        '2023-01-03;SHOP ZUERICH CHE;;-25.00;;',
+        ';Total;0.00;0.00;;',
+        '']), encoding='utf-8')
+    file_ = get_file(str(path))
+    assert registry.identify(file_)
+    assert registry.file_account(file_) == 'Liabilities:PF:Card'
+    assert len(registry.extract(file_)) == 1
+
+
+def test_statement_not_mapped_after_call(tmp_path, registry):
+    file_ = giro_statement(tmp_path / 'giro.csv', IBAN)
+    registry.identify(file_)
+    list(registry.iter_extract(file_))
+    statement = mapped_statement(file_.name, registry.giro[IBAN].file_encoding)
+    assert statement._map is None
+    # the file can be moved, as bean-file does after identify
+    (tmp_path / 'giro.csv').rename(tmp_path / 'moved.csv')
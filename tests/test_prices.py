@@ -0,0 +1,67 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from beancount import loader
+
+from drnukebean.plugins.prices import PriceIndex
+
+
+@pytest.fixture
+def index():
+    entries, errors, _ = loader.load_string('''
+2020-01-10 price USD 0.95 CHF
+2020-01-20 price USD 0.97 CHF
+2020-01-20 price USD 0.90 EUR
+2020-01-31 price VT 80.00 USD
+''')
+    assert not errors
+    return PriceIndex(entries)
+
+
+def day(dom):
+    return datetime.date(2020, 1, dom)
+
+
+@pytest.mark.parametrize('dom, price', [
+    (5, '0.95'),   # before the first price
+    (10, '0.95'),
+    (19, '0.95'),  # closer to the next price, still the last known one
+    (20, '0.97'),
+    (31, '0.97'),
+])
+def test_nearest(index, dom, price):
+    assert index.nearest('USD', day(dom), 'CHF') == Decimal(price)
+
+
+def test_nearest_unknown(index):
+    assert index.nearest('GBP', day(20)) is None
+    assert index.nearest('USD', day(20), 'GBP') is None
+    assert index.latest('USD', day(5), 'CHF') is None
+
+
+def test_convert(index):
+    assert index.convert(Decimal(10), 'CHF', 'CHF', day(1)) == 10
+    assert index.convert(Decimal(10), 'USD', 'EUR', day(25)) == Decimal('9.00')
+    # via the USD price of VT
+    assert index.convert(Decimal(2), 'VT', 'CHF', day(31)) == Decimal('155.2000')
+    with pytest.raises(KeyError):
+        index.convert(Decimal(1), 'VT', 'GBP', day(31))
+
+
+def test_index(index):
+    assert 'USD' in index and 'CHF' not in index
+    assert index.currencies() == {'USD', 'VT'}
+    assert index.quotes('USD') == {'CHF', 'EUR'}
+    # without a quote currency, prices in any currency
+    assert index.nearest('USD', day(15)) == Decimal('0.95')
+    assert index.latest('USD', day(15), 'CHF') == Decimal('0.95')
+
+
+def test_same_day_first_price_wins():
+    entries, errors, _ = loader.load_string('''
+2020-01-10 price USD 0.95 CHF
+2020-01-10 price USD 0.96 CHF
+''')
+    assert not errors
+    assert PriceIndex(entries).nearest('USD', day(10), 'CHF') == Decimal('0.95')
@@ -0,0 +1,55 @@
+import importlib
+import json
+
+import pytest
+from ibflex import parser
+
+from drnukebean import profiling
+from drnukebean.importer.ibkr import IBKRImporter
+
+from test_ibkr_tables import STATEMENT
+
+
+@pytest.fixture
+def profiled(tmp_path, monkeypatch):
+    report = tmp_path / 'report.jsonl'
+    monkeypatch.setenv(profiling.ENV_VAR, str(report))
+    importlib.reload(profiling)
+    yield report
+    profiling.disable()
+    monkeypatch.delenv(profiling.ENV_VAR)
+    importlib.reload(profiling)
+
+
+def build_statement():
+    importer = IBKRImporter(Mainaccount='Assets:Invest:IB', WHTAccount='Expenses:Invest:IB:WTax',
+                            depositAccount='Assets:Bank')
+    poi = parser.parse(STATEMENT.encode()).FlexStatements[0]
+    return list(importer.StatementEntries(importer.ProjectStatement(poi)))
+
+
+def test_phases_recorded(profiled):
+    assert profiling.is_enabled()
+    assert len(build_statement()) == 3
+    records = {record['name']: record for record in profiling.records()}
+    trades = records['IBKRImporter.build.Trades']
+    assert trades['entries_out'] == 1
+    assert trades['wall_time'] >= 0 and trades['peak_memory'] >= 0
+    assert records['IBKRImporter.balances']['entries_out'] == 1
+    with open(profiled) as f:
+        assert [json.loads(line)['name'] for line in f] == \
+            [record['name'] for record in profiling.records()]
+
+
+def test_without_reset_peak(profiled, monkeypatch):
+    # python < 3.9
+    monkeypatch.setattr(profiling, '_reset_peak', None)
+    build_statement()
+    assert all(record['peak_memory'] >= 0 for record in profiling.records())
+
+
+def test_disabled():
+    assert not profiling.is_enabled()
+    with profiling.phase('nothing') as record:
+        record['entries_out'] = 1
+    assert not [record for record in profiling.records() if record['name'] == 'nothing']
@@ -0,0 +1,61 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from beancount.core import amount, data
+
+from drnukebean.importer.util import RawTxn, apply_fixes
+
+
+@pytest.fixture
+def txn():
+    return RawTxn(date=datetime.date(2020, 1, 2), flag='*', narration='COOP 123  Basel',
+                  account='Assets:PF:Giro', amount=amount.Amount(Decimal('-12.50'), 'CHF'),
+                  meta=data.new_metadata('statement.csv', 3))
+
+
+def test_mapping(txn):
+    assert txn['narration'] == txn.narration
+    assert txn.get('payee') == '' and txn.get('foo', 1) == 1
+    assert 'account' in txn and 'foo' not in txn
+    assert list(txn.keys()) == list(RawTxn.__slots__)
+    assert dict(txn.items())['flag'] == '*'
+    txn.update(payee='Coop', flag='!')
+    assert (txn.payee, txn.flag) == ('Coop', '!')
+    with pytest.raises(KeyError):
+        txn['foo'] = 1
+    with pytest.raises(TypeError):
+        del txn['payee']
+
+
+def test_fix_in_place(txn):
+    def fix(txn):
+        txn.payee = 'Coop'
+        txn.add_posting('Expenses:Food', -txn.amount)
+
+    fixed = apply_fixes(txn, fix)
+    assert fixed is txn
+    entry = fixed.to_transaction()
+    assert entry.payee == 'Coop' and entry.narration == 'COOP 123 Basel'
+    assert [posting.account for posting in entry.postings] == ['Assets:PF:Giro', 'Expenses:Food']
+
+
+def test_fix_returns_rawtxn(txn):
+    def fix(txn):
+        return RawTxn(**dict(txn, narration='Groceries', postings=None))
+
+    fixed = apply_fixes(txn, fix)
+    assert fixed is not txn and fixed.narration == 'Groceries'
+    assert fixed.to_transaction().postings == txn.postings
+
+
+def test_fix_returns_dict(txn):
+    def fix(txn):
+        record = dict(txn.items())
+        record.update(narration='Groceries', category='food')
+        return record
+
+    with pytest.warns(UserWarning, match='category'):
+        fixed = apply_fixes(txn, fix)
+    assert isinstance(fixed, RawTxn)
+    assert fixed.narration == 'Groceries' and fixed.date == txn.date
@@ -0,0 +1,76 @@
+import pytest
+
+from drnukebean.plugins.fake_tax_server import serve_in_background
+from drnukebean.plugins.tax_forecast import APIError, ApiCache, TaxApiClient
+from drnukebean.plugins.tax_tables import URL_BUND, URL_STAAT
+
+from test_tax_forecast import load_forecast
+
+
+@pytest.fixture
+def server():
+    server = serve_in_background()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    host, port = server.server_address
+    return TaxApiClient(host=f'{host}:{port}', https=False, backoff=0, **kwargs)
+
+
+def payload(income):
+    return {"taxableIncome": income, "taxableAssets": 0}
+
+
+def test_cached_calls_skip_network(server, tmp_path):
+    client = make_client(server, cache=ApiCache(str(tmp_path)))
+    try:
+        first = client.query(URL_STAAT, payload(80000))
+        assert client.query(URL_STAAT, payload(80000)) == first
+        assert client.query_many([(URL_STAAT, payload(80000))]) == [first]
+    finally:
+        client.close()
+    assert server.requests == 1
+
+
+def test_retries_on_server_errors(server):
+    client = make_client(server, retries=2)
+    try:
+        server.failures = 2
+        assert client.query(URL_BUND, payload(80000)) == {"totalFederalTax": {"value": 2400.0}}
+        assert server.requests == 3
+        server.failures = 3
+        with pytest.raises(APIError):
+            client.query(URL_BUND, payload(80000))
+    finally:
+        client.close()
+
+
+def test_connections_shared(server):
+    client = make_client(server, max_workers=2)
+    try:
+        for income in range(3):
+            client.query(URL_STAAT, payload(income))
+        # one keep-alive connection for all the calls in turn
+        assert server.connections == 1
+        client.query_many([(URL_STAAT, payload(income)) for income in range(10)])
+        client.query_many([(URL_BUND, payload(income)) for income in range(10)])
+    finally:
+        client.close()
+    assert server.requests == 23
+    assert server.connections <= 2
+
+
+def test_plugin_against_server(server, tmp_path):
+    host, port = server.server_address
+    # the config is json dumped but evaluated as python, 0 for False
+    config = dict(tax_engine='api', api_host=f'{host}:{port}', api_https=0)
+    forecast = load_forecast(tmp_path, **config)
+    assert len(forecast) == 2
+    requests = server.requests
+    assert requests
+    # the second load is answered from the cache
+    assert load_forecast(tmp_path, **config) == forecast
+    assert server.requests == requests
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from beancount import loader
+from beancount.core import data
+
+from drnukebean.plugins import tax_forecast
+from drnukebean.plugins.tax_forecast import scenario_slug
+
+KINDS = ['Staats', 'Gemeinde', 'Personal', 'Vermoegen', 'Bundes']
+
+
+def load_forecast(tmp_path, ledger='', **config):
+    config = dict({"taxable_accounts": ["Income:Salary"], "deductable_accounts": [],
+                   "tax_expenses_main_account": "Expenses:Taxes",
+                   "liability_account": "Liabilities:Tax", "year": 2023, "api_year": 2023,
+                   "municipality": 261, "marial_srtatus": "single", "n_children": 0,
+                   "tax_day_of_month": 24, "precision": 2, "tax_engine": "local",
+                   "cache_dir": str(tmp_path)}, **config)
+    config_str = json.dumps(config).replace('"', '\\"')
+    opens = '\n'.join(f'2023-01-01 open Expenses:Taxes:{kind}' for kind in KINDS)
+    entries, errors, _ = loader.load_string(f'''
+option "operating_currency" "CHF"
+plugin "drnukebean.plugins.tax_forecast" "{config_str}"
+2023-01-01 open Income:Salary
+2023-01-01 open Assets:Bank
+2023-01-01 open Liabilities:Tax
+{opens}
+2023-01-25 * "salary"
+  Income:Salary -8000 CHF
+  Assets:Bank
+2023-02-25 * "salary"
+  Income:Salary -8000 CHF
+  Assets:Bank
+{ledger}
+''')
+    assert not errors
+    return [entry for entry in entries
+            if isinstance(entry, data.Transaction) and entry.payee == 'Tax Authority']
+
+
+@pytest.mark.parametrize('name, slug', [
+    ('married', 'married'),
+    ('married couple', 'married-couple'),
+    ('raise +10%', 'raise-10'),
+])
+def test_scenario_slug(name, slug):
+    assert scenario_slug(name) == slug
+
+
+def test_scenario_slug_empty():
+    with pytest.raises(ValueError):
+        scenario_slug(' %% ')
+
+
+def test_scenario_transactions_have_own_accounts(tmp_path):
+    forecast = load_forecast(tmp_path)
+    with_scenario = load_forecast(
+        tmp_path, scenarios=[{"name": "married couple", "marial_srtatus": "married"}],
+        scenario_output="transactions")
+    main = [txn for txn in with_scenario if not txn.tags]
+    scenario = [txn for txn in with_scenario if txn.tags]
+    # the forecast is booked once, whatever the scenarios
+    assert main == forecast
+    assert len(scenario) == 2
+    for txn in scenario:
+        assert txn.tags == {'tax-scenario-married-couple'}
+        assert {posting.account for posting in txn.postings} == \
+            {f'Expenses:Taxes:Scenario:Married-couple:{kind}' for kind in KINDS} | \
+            {'Liabilities:Tax:Scenario:Married-couple'}
+
+
+def test_rolling_incomes_follow_fx_rates(tmp_path):
+    bonus = '''
+2023-01-01 commodity USD
+2023-02-26 * "bonus"
+  Income:Salary -10000 USD
+  Assets:Bank
+2023-02-26 price USD {} CHF
+'''
+    # the second load hits the cached monthly incomes, with another rate
+    low = load_forecast(tmp_path, bonus.format('0.80'), forecast_mode='rolling')
+    high = load_forecast(tmp_path, bonus.format('1.20'), forecast_mode='rolling')
+    assert low[0] == high[0]  # january has no USD income
+    assert low[1].postings[-1].units.number > high[1].postings[-1].units.number
+
+
+def test_rolling_recomputes_changed_months_only(tmp_path, monkeypatch):
+    converted = []
+
+    def add_fx_info(entries, options, by_currency, today, price_index=None):
+        converted.append(by_currency.position.sum())
+        return original(entries, options, by_currency, today, price_index)
+
+    original = tax_forecast.add_fx_info
+    monkeypatch.setattr(tax_forecast, 'add_fx_info', add_fx_info)
+    load_forecast(tmp_path, forecast_mode='rolling')
+    assert len(converted) == 2
+    # another posting in february, january comes from the cache
+    converted.clear()
+    load_forecast(tmp_path, '''
+2023-02-27 * "expenses"
+  Income:Salary -100 CHF
+  Assets:Bank
+''', forecast_mode='rolling')
+    assert converted == [-8100]
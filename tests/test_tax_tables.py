@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from drnukebean.plugins.tax_forecast import CACHE_FILENAME, ApiCache
+from drnukebean.plugins.tax_tables import (URL_BUND, URL_STAAT, Tariff, TaxTables,
+                                           answer_requests, check_against_cache)
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return TaxTables.load(2023)
+
+
+def test_tariff():
+    tariff = Tariff([[0, 0.0], [100, 0.1], [200, 0.2]], flat_above=1000, flat_rate=0.15)
+    assert list(tariff([-5, 50, 150, 200, 300, 999, 1000])) == \
+        pytest.approx([0, 0, 5, 10, 30, 169.8, 150])
+
+
+# the federal tax of a single person at the bracket bounds of the 2023 DBG
+# tariff (Art. 36), as published by the ESTV, to the franc
+@pytest.mark.parametrize('income, tax', [
+    (14800, 0),
+    (32200, 134),
+    (42200, 222),
+    (56200, 592),
+    (73900, 1117),
+    (79600, 1455),
+    (105300, 3152),
+    (137300, 5968),
+    (179400, 10599),
+    (769600, 88504),
+    (1000000, 115000),
+])
+def test_federal_single(tables, income, tax):
+    assert float(tables.federal_income_tax(income, 'single')) == pytest.approx(tax, abs=1)
+
+
+# the "einfache Staatssteuer" of a single person at the bounds of the 2023
+# ZH tariff (StG 35)
+@pytest.mark.parametrize('income, tax', [
+    (6700, 0),
+    (11400, 94),
+    (16100, 235),
+    (23700, 539),
+    (33000, 1004),
+    (43700, 1646),
+    (56100, 2514),
+    (73100, 3874),
+    (106700, 6898),
+    (140300, 10258),
+    (183300, 14988),
+    (254900, 23580),
+])
+def test_simple_tax_single(tables, income, tax):
+    assert float(tables.simple_tax(income, 'single')) == pytest.approx(tax, abs=1)
+
+
+def test_vectorized(tables):
+    incomes = np.array([50000, 100000, 150000])
+    assert list(tables.cantonal_income_tax(incomes, 'married')) == \
+        [float(tables.cantonal_income_tax(income, 'married')) for income in incomes]
+    # incomes are rounded down to 100 francs
+    assert tables.simple_tax(100099, 'single') == tables.simple_tax(100000, 'single')
+    # and the municipality applies its own multiplier to the simple tax
+    assert float(tables.municipal_income_tax(100000, 'single', 261)) == \
+        pytest.approx(float(tables.simple_tax(100000, 'single')) * 1.19)
+
+
+def test_child_deduction(tables):
+    tax = float(tables.federal_income_tax(100000, 'married'))
+    assert float(tables.federal_income_tax(100000, 'married', n_children=2)) == \
+        pytest.approx(tax - 2 * 255)
+    assert tables.federal_income_tax(30000, 'married', n_children=2) == 0
+
+
+def test_load_year():
+    # a year without a file uses the latest earlier tariff
+    assert TaxTables.load(2025).year == 2023
+    with pytest.raises(KeyError):
+        TaxTables.load(2020)
+
+
+def payload(income):
+    return {'taxYear': 2023, 'taxableIncome': income, 'taxableAssets': 200000,
+            'maritalStatus': 'SINGLE', 'municipality': 261, 'taxScale': 'SINGLE'}
+
+
+def test_answer_requests():
+    staat, bund = answer_requests([(URL_STAAT, payload(100000)), (URL_BUND, payload(100000))])
+    assert set(staat) == {'cantonalBaseTax', 'municipalityTax', 'personalTax', 'assetsTax'}
+    assert staat['personalTax']['value'] == 24
+    assert bund['totalFederalTax']['value'] == pytest.approx(2802.25)
+
+
+def test_check_against_cache(tmp_path):
+    cache = ApiCache(str(tmp_path))
+    answer, = answer_requests([(URL_BUND, payload(100000))])
+    cache.put(URL_BUND, payload(100000), answer)
+    cache.put(URL_BUND, payload(50000), {'totalFederalTax': {'value': 1}})
+    cache.close()
+    differences = check_against_cache(str(tmp_path / CACHE_FILENAME))
+    assert [(row[1]['taxableIncome'], row[2]) for row in differences] == \
+        [(50000, 'totalFederalTax')]